@@ -27,34 +27,67 @@ from PIL import Image
 from PIL import ImageFile
 import threading
 import os
+import stat
 import sys
 import time
 import metadata
+from metadata import pool as metadata_pool
 import datetime
 import bisect
+import collections
+import heapq
+import itertools
+import Queue
 
 ##picty imports
 import settings
 import baseobjects
 import viewsupport
 import imagemanip
+import thumbpool
+import uidispatch
+import memcache
 import pluginmanager
 from fstools import io
+from fstools import walker
+from fstools import eventqueue
 from logger import log
 
 def idle_add(*args):
-    gobject.idle_add(*args)
-    time.sleep(0.005)
+    'queue a UI update on the gtk main loop (see uidispatch)'
+    uidispatch.dispatcher.add(*args)
+
+def apply_thumbnail_results(browser,results):
+    '''
+    create the thumbnails for the (collection,item,result) tuples returned by thumbpool.engine.get_ready
+    and redraw the browser
+    '''
+    redraw=set()
+    for collection,item,result in results:
+        if not collection.is_open:
+            continue
+        collection.make_thumbnail(item,preloaded=result)
+        redraw.add(collection)
+    for collection in redraw:
+        idle_add(browser.redraw_view,collection)
+
+
+##execution lanes of the worker. each lane has its own queue and thread so that long running
+##file system scans and thumbnail creation don't hold up the jobs the user is waiting on
+INTERACTIVE='interactive' #jobs that update what the user is looking at and every job that changes a collection, its views or item metadata (the default)
+IO='io' #jobs that only list, stat or read from the file system, passing what they find to a job on the interactive lane
+CPU='cpu' #jobs that only create thumbnails
+LANES=(INTERACTIVE,IO,CPU)
 
 
 ##TODO: ALL JOBS THE TOUCH A VIEW SHOULD BE PASSED THAT VIEW DURING CONSTRUCTION (do not use collection.get_active_view())
 
 class WorkerJob:
     '''
-    Base class for jobs performed on the browser's worker thread. Because all jobs share a single thread
-    they are run sequentially with higher priority jobs running first. A running job must regularly check for higher priority
-    job(s) being added to the queue and if so, pause operation and return, resuming when the higher priority job(s)
-    complete
+    Base class for jobs performed on the worker's threads. Each job runs on one of the worker's lanes (see the `lane`
+    class attribute). Jobs that share a lane share a single thread, so they are run sequentially with higher priority
+    jobs running first. A running job must regularly check for higher priority job(s) being added to its lane
+    and if so, pause operation and return, resuming when the higher priority job(s) complete
     Jobs:
        * must have an init constructor def __init__(self,worker,collection,browser,*extra_args)
        * should call the base __init__ method in their __init__ constructor providing a name (string) and priority (int/float)
@@ -62,28 +95,50 @@ class WorkerJob:
        * must provide a __call__ method, which is called to start or continue the job
        * can provide a cancel constructor def cancel(self,shutdown) which may be called from the worker
          thread when the job does not have priority but has been cancelled due to shutdown or for some other reason.
-       * jobs on this thread need to frequently check that they are the highest in the queue by calling
-         worker.jobs.get_highest() (which returns the job with the highest priority)
+       * should suspend the plugin events of their collection with suspend_events (rather than calling the plugin
+         manager directly) so that the events are resumed if the job is cancelled or fails
+       * jobs need to frequently check that they are the highest in the queue of their lane by calling
+         worker.jobs.ishighestpriority(job) (which only checks the job's preemption token, so it is cheap)
+       * jobs on different lanes run at the same time, so a job that adds, removes or changes the items of a collection
+         (or its views or item metadata) must run on the INTERACTIVE lane, where it can't interleave with other such jobs.
+         its file system reads can be done by a helper job on the IO lane (see ScanDirectoryJob and StatItemsJob)
        * if the job is unfinished it should promptly return False (unless cancelled) - the job will be resumed
          when no higher priority tasks are running
        * when a job is complete or cancelled it should return True signalling that it should be removed from the queue
     The helper function Worker.queue_job(job_class,*args) can be used to instantiate and queue a job and passing
     in default worker, collection, browser arguments (plus optional arguments in args)
     '''
+    lane=INTERACTIVE
     def __init__(self,name='',priority=50,worker=None,collection=None,browser=None):
         self.state=False
+        self.preempted=False #set by the queue when the job should return (to let a higher priority job run)
         self.name=name
         self.priority=priority
         self.worker=worker
         self.collection=collection
         self.browser=browser
+        self.events_suspended=False
+
+    def suspend_events(self):
+        'buffer the item events of the job\'s collection until resume_events is called (see pluginmanager.suspend_collection_events)'
+        if not self.events_suspended:
+            self.events_suspended=True
+            pluginmanager.mgr.suspend_collection_events(self.collection)
+
+    def resume_events(self):
+        'deliver the item events buffered since suspend_events was called'
+        if self.events_suspended:
+            self.events_suspended=False
+            pluginmanager.mgr.resume_collection_events(self.collection)
 
     def cancel(self,shutdown=False):
         '''
         this job is being cancelled externally
         this method will be called on outstanding jobs giving
         them an opportunity to notify gui etc
+        subclasses that override this method must call resume_events if they suspend events
         '''
+        self.resume_events()
         idle_add(self.browser.update_backstatus,False,'Nothing to do')
         idle_add(self.browser.update_status,2.0,'Nothing to do')
 
@@ -92,77 +147,120 @@ class WorkerJob:
         return True
 
 
+class JobLane:
+    '''
+    the queue of jobs for one lane of the worker, a heap ordered by (priority collection first, priority, order queued)
+    '''
+    def __init__(self,name):
+        self.name=name
+        self.heap=[] #[sort key,sequence number,job]
+        self.running=None #the job currently being called on the lane's thread
+        self.removed_jobs=[]
+        self.event=threading.Event()
+
+
 class WorkerJobQueue:
     '''
-    maintains the queue of jobs run on the Worker thread
+    maintains the queues of jobs run on the Worker threads, one queue per lane (see JobLane)
     manipulation of the queue using the member functions should be thread safe
+    a running job checks that it should continue by calling ishighestpriority, which only tests
+    the job's preemption token. the token is set when a job that should run before it is added to
+    its lane or when it is removed from the queue
     '''
     def __init__(self):
-        self.queue=[]
+        self.lanes=dict((name,JobLane(name)) for name in LANES)
         self.priority_collection=None
-        self.removed_jobs=[]
+        self.counter=itertools.count()
         self.lock=threading.Lock()
+        self.idle=threading.Condition(self.lock) #notified when a lane finishes calling a job
+
+    def lane_of(self,job):
+        if not settings.worker_lanes:
+            return self.lanes[INTERACTIVE]
+        return self.lanes.get(getattr(job,'lane',INTERACTIVE),self.lanes[INTERACTIVE])
+
+    def sort_key(self,job):
+        return (-1*(job.collection==self.priority_collection and job.collection is not None),-job.priority)
 
     def ishighestpriority(self,job):
+        return not job.preempted
+
+    def gethighest(self,lane=INTERACTIVE):
         self.lock.acquire()
-        for j in self.queue:
-            if j==job:
-                self.lock.release()
-                return True
-            break
-        self.lock.release()
-        return False
+        try:
+            heap=self.lanes[lane].heap
+            if heap:
+                return heap[0][2]
+            return None
+        finally:
+            self.lock.release()
 
-    def gethighest(self):
+    def start_job(self,lane):
+        '''
+        called on the lane's thread: returns the highest priority job in lane (clearing its preemption token), or None
+        '''
         self.lock.acquire()
-        for j in self.queue:
+        try:
+            l=self.lanes[lane]
+            l.running=None
+            if not l.heap:
+                return None
+            job=l.heap[0][2]
+            job.preempted=False
+            l.running=job
+            return job
+        finally:
             self.lock.release()
-            return j
+
+    def finish_job(self,lane):
+        'called on the lane\'s thread after calling a job'
+        self.lock.acquire()
+        self.lanes[lane].running=None
+        self.idle.notifyAll()
         self.lock.release()
-        return None
+
+    def _preempt(self,l):
+        '''
+        sets the preemption token of the job running on lane l if it is no longer the highest priority job
+        '''
+        if l.running is not None and (not l.heap or l.heap[0][2] is not l.running):
+            l.running.preempted=True
 
     def set_priority_collection(self,collection):
         self.lock.acquire()
         self.priority_collection=collection
-        jsort=[(-1*(j.collection==collection),-j.priority,j) for j in self.queue]
-        self.queue=[j[2] for j in sorted(jsort)]
+        for l in self.lanes.itervalues():
+            for entry in l.heap:
+                entry[0]=self.sort_key(entry[2])
+            heapq.heapify(l.heap)
+            self._preempt(l)
         self.lock.release()
 
     def get_priority_colleciton(self,collection):
         return self.priority_colelction
 
-    def get_removed_jobs(self):
+    def get_removed_jobs(self,lane=INTERACTIVE):
         '''
-        retrieves the list of removed jobs, clearing out the list in the process
+        retrieves the list of removed jobs of lane, clearing out the list in the process
         '''
         self.lock.acquire()
-        jobs=self.removed_jobs
-        self.removed_jobs=[]
+        l=self.lanes[lane]
+        jobs=l.removed_jobs
+        l.removed_jobs=[]
         self.lock.release()
         return jobs[:]
 
-#    def find_by_job_class(self,job_class):
-#        self.lock.acquire()
-#        return [j for j in self.queue if isinstance(j,job_class)]
-#        self.lock.release()
-#
-#    def find_by_job_name(self,job_name):
-#        self.lock.acquire()
-#        return [j for j in self.queue if j.name==job_name]
-#        self.lock.release()
-#
-#    def find_by_colleciton(self,collection):
-#        self.lock.acquire()
-#        return [j for j in self.queue if j.collection==collection]
-#        self.lock.release()
-#
     def has_job(self,job_class=None,collection=None):
-        match=self.queue
-        if job_class!=None:
-            match=[j for j in match if isinstance(j,job_class)]
-        if collection!=None:
-            match=[j for j in match if j.collection==collection ]
-        return len(match)>0
+        self.lock.acquire()
+        try:
+            for l in self.lanes.itervalues():
+                for entry in l.heap:
+                    j=entry[2]
+                    if (job_class==None or isinstance(j,job_class)) and (collection==None or j.collection==collection):
+                        return True
+            return False
+        finally:
+            self.lock.release()
 
     def clear(self,job_class=None,collection=None,excluded_job=None):
         '''
@@ -172,47 +270,79 @@ class WorkerJobQueue:
         excluded_job, a specific job that should be excluded from the removal operation
         '''
         self.lock.acquire()
-        self.removers=[j for j in self.queue if ##todo: verify that this actually works
-            (job_class==None or isinstance(j,job_class)) and
-            (collection==None or j.collection==collection) and
-            (excluded_job==None or j!=excluded_job) ]
-        self.removed_jobs+=self.removers
-        self.queue=[j for j in self.queue if not j in self.removers]
+        for l in self.lanes.itervalues():
+            removers=[e[2] for e in l.heap if
+                (job_class==None or isinstance(e[2],job_class)) and
+                (collection==None or e[2].collection==collection) and
+                (excluded_job==None or e[2]!=excluded_job) ]
+            if not removers:
+                continue
+            for j in removers:
+                j.preempted=True
+            l.removed_jobs+=removers
+            l.heap=[e for e in l.heap if e[2] not in removers]
+            heapq.heapify(l.heap)
+            l.event.set() #the lane's thread calls cancel on the removed jobs
         self.lock.release()
 
-    def pop(self,job):
+    def wait_for_collection(self,collection,excluded_job=None):
+        '''
+        blocks until no lane is running a job for collection (other than excluded_job)
+        call after clear to be sure that the removed jobs are no longer using the collection
+        '''
         self.lock.acquire()
         try:
-            ind=self.queue.index(job)
-        except ValueError:
+            while [l for l in self.lanes.itervalues() if l.running is not None and l.running is not excluded_job and l.running.collection==collection]:
+                self.idle.wait(0.5)
+        finally:
             self.lock.release()
+
+    def pop(self,job):
+        self.lock.acquire()
+        try:
+            for l in self.lanes.itervalues():
+                for i in xrange(len(l.heap)):
+                    if l.heap[i][2] is job:
+                        if i==0:
+                            heapq.heappop(l.heap)
+                        else:
+                            l.heap.pop(i)
+                            heapq.heapify(l.heap)
+                        return job
             return None
-        j=self.queue.pop(ind)
-        self.lock.release()
-        return j
+        finally:
+            self.lock.release()
 
     def add(self,job):
         '''
-        add job to the queue. if the job is associated with the "priority_collection"
+        add job to the queue of its lane. if the job is associated with the "priority_collection"
         then it receives higher priority than jobs not associated with the priority_collection
-        otherwise job ordering is determined by the "priority" member of the job.
+        otherwise job ordering is determined by the "priority" member of the job (jobs of the same
+        priority run in the order they were added)
         '''
         self.lock.acquire()
-        for j in xrange(len(self.queue)):
-            if (job.collection==self.priority_collection)>=(self.queue[j].collection==self.priority_collection):
-                if self.queue[j].priority<job.priority:
-                    self.queue.insert(j,job)
-                    self.lock.release()
-                    return
-        self.queue.append(job)
+        l=self.lane_of(job)
+        heapq.heappush(l.heap,[self.sort_key(job),self.counter.next(),job])
+        self._preempt(l)
+        l.event.set()
         self.lock.release()
 
+    def quit(self):
+        '''
+        queue a QuitJob on every lane
+        '''
+        for lane in LANES:
+            self.add(QuitJob(None,None,None,lane))
+
 class QuitJob(WorkerJob):
-    def __init__(self,worker,collection,browser):
+    def __init__(self,worker,collection,browser,lane=INTERACTIVE):
         WorkerJob.__init__(self,'QUIT',1000,worker,collection,browser)
+        self.lane=lane
 
 
 class ThumbnailJob(WorkerJob):
+    BATCH_SIZE=20 #number of thumbnails loaded by the collection at once (allowing it to read them sequentially)
+
     def __init__(self,worker,collection,browser,queue_onscreen):
         WorkerJob.__init__(self,'THUMBNAIL',950,worker,collection,browser)
         self.queue_onscreen=queue_onscreen
@@ -222,17 +352,23 @@ class ThumbnailJob(WorkerJob):
         jobs=self.worker.jobs
         i=0
         self.worker.jobs.clear(CollectionUpdateJob,self.collection)
+        thumbpool.engine.cancel_urgent(self.collection)
         while jobs.ishighestpriority(self) and len(self.queue_onscreen)>0:
-            item=self.queue_onscreen.pop(0)
-            if item.thumb!=False and item.thumb is not None:
-                continue
-            if not self.collection.load_thumbnail(item,False):
-                if item.thumb!=False and not self.collection.has_thumbnail(item):
-                    self.cu_job_queue.append(item)
-                    continue
-            i+=1
-            if i%20==0:
+            batch=[]
+            while len(batch)<self.BATCH_SIZE and len(self.queue_onscreen)>0:
+                item=self.queue_onscreen.pop(0)
+                if item.thumb==False or item.thumb is None:
+                    batch.append(item)
+            loaded=self.collection.load_thumbnails(batch,False)
+            for item,success in zip(batch,loaded):
+                if not success:
+                    if item.thumb!=False and not self.collection.has_thumbnail(item):
+                        self.cu_job_queue.append(item)
+                        continue
+                i+=1
+            if i>0:
                 idle_add(self.browser.redraw_view,self.collection)
+                i=0
         if len(self.queue_onscreen)==0:
             if i>0:
                 idle_add(self.browser.redraw_view,self.collection)
@@ -242,6 +378,35 @@ class ThumbnailJob(WorkerJob):
         return False
 
 
+class PrefetchThumbsJob(WorkerJob):
+    '''
+    loads the cached thumbnails of items just outside the visible part of the browser (in the direction
+    the user is scrolling) so they are ready when scrolled into view. thumbnails that have not been
+    created yet are left to the ThumbnailJob, which creates them once they are on screen
+    '''
+    BATCH_SIZE=20
+
+    def __init__(self,worker,collection,browser,queue):
+        WorkerJob.__init__(self,'PREFETCHTHUMBS',940,worker,collection,browser)
+        self.queue=queue
+
+    def cancel(self,shutdown=False):
+        ##prefetch requests are replaced on every scroll, so there's no need to notify the user
+        pass
+
+    def __call__(self):
+        jobs=self.worker.jobs
+        while jobs.ishighestpriority(self) and len(self.queue)>0:
+            batch=[]
+            while len(batch)<self.BATCH_SIZE and len(self.queue)>0:
+                item=self.queue.pop(0)
+                if item.thumb is None:
+                    batch.append(item)
+            if batch:
+                self.collection.load_thumbnails(batch)
+        return len(self.queue)==0
+
+
 class FlexibleJob(WorkerJob):
     def __init__(self, worker, collection, browser, task_cb, complete_cb, limit_to_view = True, *args):
         WorkerJob.__init__(self,'FLEXJOB',900,worker,collection,browser)
@@ -300,9 +465,16 @@ class CollectionUpdateJob(WorkerJob):
                     idle_add(self.browser.resize_and_refresh_view,self.collection)
                 self.browser.lock.release()
             if not c.has_thumbnail(item):
-                c.make_thumbnail(item)
-                idle_add(self.browser.resize_and_refresh_view,self.collection)
-        if len(self.queue)==0:
+                if thumbpool.engine.enabled(c):
+                    thumbpool.engine.put(c,item,urgent=True)
+                    apply_thumbnail_results(self.browser,thumbpool.engine.get_ready())
+                else:
+                    c.make_thumbnail(item)
+                    idle_add(self.browser.resize_and_refresh_view,self.collection)
+        ##wait for the thumbnails of the onscreen items to come back from the pool
+        while len(self.queue)==0 and thumbpool.engine.urgent_count>0 and jobs.ishighestpriority(self):
+            apply_thumbnail_results(self.browser,thumbpool.engine.get_ready(0.1))
+        if len(self.queue)==0 and thumbpool.engine.urgent_count==0:
             return True
         return False
 
@@ -373,6 +545,7 @@ class LoadCollectionJob(WorkerJob):
     def __call__(self):
         jobs=self.worker.jobs
         jobs.clear(None,self.collection,self)
+        jobs.wait_for_collection(self.collection,self)
         view=self.collection.get_active_view()
         collection=self.collection
         log.info('Loading collection file %s with type %s',self.collection_file,collection.type)
@@ -384,13 +557,13 @@ class LoadCollectionJob(WorkerJob):
             if os.path.exists(collection.image_dirs[0]):
                 collection.online=True
                 if self.browser!=None:
-                    gobject.idle_add(self.browser.collection_online,self.collection) ##should probably call worker.coll_set method as well?
+                    idle_add(self.browser.collection_online,self.collection) ##should probably call worker.coll_set method as well?
                 if collection.rescan_at_open:
                     self.worker.queue_job_instance(WalkDirectoryJob(self.worker,self.collection,self.browser))
             else:
                 collection.online=False
                 if self.browser!=None:
-                    gobject.idle_add(self.browser.collection_offline,self.collection) ##should probably call worker.coll_set method as well?
+                    idle_add(self.browser.collection_offline,self.collection) ##should probably call worker.coll_set method as well?
             pluginmanager.mgr.callback_collection('t_collection_loaded',collection)
             if not view.loaded:
                 self.worker.queue_job_instance(BuildViewJob(self.worker,self.collection,self.browser))
@@ -423,10 +596,10 @@ class SetOnlineStatusJob(WorkerJob):
     def __call__(self):
         if self.status:
             self.collection.connect()
-            gobject.idle_add(self.browser.collection_online,self.collection) ##should probably call worker.coll_set method as well?
+            idle_add(self.browser.collection_online,self.collection) ##should probably call worker.coll_set method as well?
         else:
             self.collection.disconnect()
-            gobject.idle_add(self.browser.collection_offline,self.collection) ##should probably call worker.coll_set method as well?
+            idle_add(self.browser.collection_offline,self.collection) ##should probably call worker.coll_set method as well?
         return True
 
 
@@ -437,6 +610,7 @@ class SaveCollectionJob(WorkerJob): ##TODO: This job features the nasty hack tha
     def __call__(self):
         mainframe=self.browser
         self.worker.jobs.clear(None,self.collection,self)
+        self.worker.jobs.wait_for_collection(self.collection,self)
         #idle_add(mainframe.update_backstatus,None,True,'Closing Collection '+self.collection.name)
         log.info('Closing and saving collection %s',self.collection.id)
         self.collection.end_monitor() ##todo: should be called in close
@@ -450,44 +624,97 @@ class SaveCollectionJob(WorkerJob): ##TODO: This job features the nasty hack tha
         return True
 
 
-class WalkDirectoryJob(WorkerJob):
-    '''this walks the collection directory adding new items the collection (but not the view)'''
+class CheckpointCollectionJob(WorkerJob):
+    '''
+    appends items changed since the last checkpoint to the collection's item store log, compacting
+    the log into a new snapshot when it has grown large. the compaction is resumed if interrupted
+    '''
     def __init__(self,worker,collection,browser):
-        WorkerJob.__init__(self,'WALKDIRECTORY',700,worker,collection,browser)
-        self.collection_walker=None
-        self.notify_items=[]
-        self.done=False
-        self.last_walk_state=None
+        WorkerJob.__init__(self,'CHECKPOINTCOLLECTION',350,worker,collection,browser)
+        self.items=None
+
+    def cancel(self,shutdown=False):
+        ##an unfinished compaction is left for the next checkpoint (or the close of the collection) to resume
+        ##(discarding it here would delete the partly written snapshot while the collection may be closing and resuming it)
+        if self.collection.is_open:
+            self.collection.schedule_checkpoint()
 
     def __call__(self):
-        collection=self.collection
         jobs=self.worker.jobs
-        self.last_update_time=time.time()
-        try:
-            if not self.collection_walker:
-                log.info('Starting directory walk on %s',collection.image_dirs[0])
-                scan_dir=self.collection.image_dirs[0]
-                self.collection_walker=os.walk(scan_dir)
-                self.done=False
-                pluginmanager.mgr.suspend_collection_events(self.collection)
-        except StopIteration:
-            self.notify_items=[]
-            self.collection_walker=None
-            log.error('Aborted directory walk on %s',collection.image_dirs[0])
+        collection=self.collection
+        store=collection.store
+        if not collection.is_open or store is None:
             return True
-        scan_dir=collection.image_dirs[0]
+        if not store.is_compacting():
+            store.flush()
+            if collection.thumb_store:
+                collection.thumb_store.flush()
+            if not store.needs_compaction(len(collection)):
+                collection.schedule_checkpoint()
+                return True
+            log.info('Compacting item store for collection %s',collection.id)
+            self.items=collection.get_all_items()
+        ##a compaction suspended by a cancelled checkpoint is resumed with the items it started with
+        if not store.compact(self.items,lambda:jobs.ishighestpriority(self)):
+            return False
+        log.info('Compacted item store for collection %s',collection.id)
+        self.items=None
+        collection.schedule_checkpoint()
+        return True
+
+
+def dir_key(collection,path):
+    'returns the key of the directory at path in collection.dir_state (the path relative to the collection root)'
+    reldir=collection.get_relpath(path)
+    if reldir=='.':
+        return ''
+    return reldir
+
+
+def walk_new_items(collection,root,files):
+    '''
+    returns the items for the files found by walker.walk in the directory root that are not in the collection
+    files is the sorted list of (name,mtime) tuples for the directory, which is diffed against the collection in one merge
+    '''
+    reldir=dir_key(collection,root)
+    items=[]
+    for name,mtime in files:
+        if reldir:
+            name=os.path.join(reldir,name)
+        item=baseobjects.Item(name)
+        item.mtime=mtime
+        items.append(item)
+    return collection.missing_items(items)
+
+
+class ScanDirectoryJob(WorkerJob):
+    '''
+    lists the directories of the collection for a WalkDirectoryJob on the io lane. the (root,files) of each directory
+    with files are put on the walk job's scanned queue followed by None when the scan is complete (False if cancelled)
+    the scan has a higher priority than the walk so that it runs first when the worker has a single lane
+    '''
+    lane=IO
+    def __init__(self,worker,collection,browser,walk_job):
+        WorkerJob.__init__(self,'SCANDIRECTORY',710,worker,collection,browser)
+        self.walk_job=walk_job
+        self.collection_walker=None
+
+    def cancel(self,shutdown=False):
+        self.walk_job.scanned.put(False)
+
+    def __call__(self):
+        jobs=self.worker.jobs
+        if not self.collection_walker:
+            self.collection_walker=walker.walk(self.collection.image_dirs[0],self.walk_job.unchanged_dir)
         while jobs.ishighestpriority(self):
             try:
-                if self.last_walk_state is None:
-                    root,dirs,files=self.collection_walker.next()
-                else:
-                    root,dirs,files = self.last_walk_state
-                    self.last_walk_state = None
+                root,dirs,files=self.collection_walker.next()
             except StopIteration:
-                self.done=True
-                break
+                self.walk_job.scanned.put(None)
+                self.collection_walker=None
+                return True
             i=0
-            if collection.recursive:
+            if self.collection.recursive:
                 while i<len(dirs):
                     if dirs[i].startswith('.'):
                         dirs.pop(i)
@@ -495,40 +722,100 @@ class WalkDirectoryJob(WorkerJob):
                         i+=1
             else:
                 del dirs[:]
+            if files:
+                self.walk_job.scanned.put((root,files))
+        return False
+
+
+class WalkDirectoryJob(WorkerJob):
+    '''
+    this walks the collection directory adding new items the collection (but not the view)
+    the directories are listed by a ScanDirectoryJob on the io lane, this job adds the new items it finds
+    '''
+    def __init__(self,worker,collection,browser):
+        WorkerJob.__init__(self,'WALKDIRECTORY',700,worker,collection,browser)
+        self.scan_job=None
+        self.scanned=None #queue of the directories listed by the scan job
+        self.notify_items=[]
+        self.done=False
+        self.last_walk_state=None
+        self.walked={} #relative directory path -> signature of each directory found by the walk
+        self.meta_loader=metadata_pool.MetadataLoadQueue(collection)
+
+    def unchanged_dir(self,root,signature):
+        '''
+        called by the walker (on the io lane) for each directory: records its signature and returns True
+        if it is unchanged since the last scan (so its files don't need to be checked)
+        '''
+        key=dir_key(self.collection,root)
+        self.walked[key]=signature
+        return self.collection.dir_state.get(key)==signature
 
+    def add_loaded_items(self,results):
+        'add new items to the collection once their metadata has been read by the process pool'
+        if not results:
+            return
+        collection=self.collection
+        for item,result in results:
+            collection.load_metadata(item,notify_plugins=False,preloaded=result)
+            self.browser.lock.acquire()
+            collection.add(item)
+            self.browser.lock.release()
+        idle_add(self.browser.resize_and_refresh_view,self.collection)
+
+    def __call__(self):
+        collection=self.collection
+        jobs=self.worker.jobs
+        self.last_update_time=time.time()
+        if not self.scan_job:
+            log.info('Starting directory walk on %s',collection.image_dirs[0])
+            self.walked={}
+            self.done=False
+            self.scanned=Queue.Queue()
+            self.scan_job=ScanDirectoryJob(self.worker,collection,self.browser,self)
+            self.worker.queue_job_instance(self.scan_job)
+            self.suspend_events()
+        files=[]
+        while jobs.ishighestpriority(self):
+            if self.last_walk_state is None:
+                try:
+                    scanned=self.scanned.get(True,0.05)
+                except Queue.Empty:
+                    self.add_loaded_items(self.meta_loader.get_ready())
+                    continue
+                if not scanned:
+                    if scanned is False: #the directories listed before the scan was cancelled are still recorded
+                        log.error('Aborted directory walk on %s',collection.image_dirs[0])
+                    self.done=True
+                    break
+                root,files=scanned
+                files=walk_new_items(collection,root,files)
+            else:
+                root,files=self.last_walk_state
+                self.last_walk_state=None
             idle_add(self.browser.update_backstatus,True,'Scanning for new images')
             while jobs.ishighestpriority(self) and len(files)>0:
-                p=files.pop(0)
-                r=p.rfind('.')
-                if r<=0:
-                    continue
-                fullpath=os.path.join(root, p)
-                relpath=os.path.relpath(os.path.join(root, p),scan_dir)
-                mimetype=io.get_mime_type(fullpath)
-                if not mimetype.lower().startswith('image') and not mimetype.lower().startswith('video'):
-##                    log.debug('Directory walk found invalid mimetype '+mimetype+' for '+fullpath)
+                self.add_loaded_items(self.meta_loader.get_ready())
+                if self.meta_loader.full():
+                    self.add_loaded_items(self.meta_loader.get_ready(0.05))
                     continue
-                mtime=io.get_mtime(fullpath)
-                st=os.stat(fullpath)
-                if os.path.isdir(fullpath):
-##                    log.warning('Directory Walk: item '+fullpath+' is a directory')
-                    continue
-                item=baseobjects.Item(relpath)
-                item.mtime=mtime
-                if collection.find(item)<0:
-                    if not collection.verify_after_walk:
-                        if collection.load_meta:
-                            collection.load_metadata(item,notify_plugins=False)
-                        elif collection.load_preview_icons:
-                            collection.load_thumbnail(item)
-                            if not item.thumb:
-                                item.thumb=False
-                        self.browser.lock.acquire()
-                        collection.add(item)
-                        self.browser.lock.release()
-                        idle_add(self.browser.resize_and_refresh_view,self.collection)
-                    else:
-                        self.notify_items.append(item)
+                item=files.pop(0)
+                if not collection.verify_after_walk:
+                    if collection.load_meta and self.meta_loader.enabled():
+                        self.meta_loader.put(item)
+                        continue
+                    if collection.load_meta:
+                        collection.load_metadata(item,notify_plugins=False)
+                    elif collection.load_preview_icons:
+                        collection.load_thumbnail(item)
+                        if not item.thumb:
+                            item.thumb=False
+                    self.browser.lock.acquire()
+                    collection.add(item)
+                    self.browser.lock.release()
+                    idle_add(self.browser.resize_and_refresh_view,self.collection)
+                else:
+                    self.notify_items.append(item)
             # once we have found enough items add to collection and notify browser
             if time.time()>self.last_update_time+1.0 or len(self.notify_items)>100:
                 self.last_update_time=time.time()
@@ -539,6 +826,11 @@ class WalkDirectoryJob(WorkerJob):
                 idle_add(self.browser.resize_and_refresh_view,self.collection)
                 self.notify_items=[]
         if self.done:
+            self.meta_loader.flush()
+            while len(self.meta_loader)>0 and jobs.ishighestpriority(self):
+                self.add_loaded_items(self.meta_loader.get_ready(0.1))
+            if len(self.meta_loader)>0:
+                return False
             log.info('Directory walk complete for '+collection.image_dirs[0])
             idle_add(self.browser.resize_and_refresh_view,self.collection)
             idle_add(self.browser.update_backstatus,False,'Search complete')
@@ -549,16 +841,27 @@ class WalkDirectoryJob(WorkerJob):
                 self.browser.lock.release()
                 idle_add(self.browser.resize_and_refresh_view,self.collection)
             self.notify_items=[]
-            self.collection_walker=None
+            self.scan_job=None
             self.done=False
-            pluginmanager.mgr.resume_collection_events(self.collection)
+            self.resume_events()
             if collection.verify_after_walk:
-                self.worker.queue_job_instance(VerifyImagesJob(self.worker,self.collection,self.browser))
+                self.worker.queue_job_instance(VerifyImagesJob(self.worker,self.collection,self.browser,self.walked))
+            else:
+                collection.update_dir_state(self.walked)
+            self.walked={}
             self.last_walk_state=None
             return True
-        self.last_walk_state=(root,dirs,files)
+        if files:
+            self.last_walk_state=(root,files)
         return False
 
+    def cancel(self,shutdown=False):
+        self.worker.jobs.clear(ScanDirectoryJob,self.collection)
+        self.notify_items=[]
+        self.scan_job=None
+        self.last_walk_state=None
+        WorkerJob.cancel(self,shutdown)
+
 
 class WalkSubDirectoryJob(WorkerJob):
     '''this walks a sub-folder in the collection directory adding new items to both view and collection'''
@@ -579,8 +882,8 @@ class WalkSubDirectoryJob(WorkerJob):
             if not self.collection_walker:
                 log.info('Starting directory walk on %s',self.sub_dir)
                 scan_dir=self.sub_dir
-                self.collection_walker=os.walk(scan_dir)
-                pluginmanager.mgr.suspend_collection_events(self.collection)
+                self.collection_walker=walker.walk(scan_dir)
+                self.suspend_events()
         except StopIteration:
             log.error('Aborted directory walk on %s',self.sub_dir)
             self.notify_items=[]
@@ -590,6 +893,7 @@ class WalkSubDirectoryJob(WorkerJob):
             try:
                 if self.last_walk_state is None:
                     root,dirs,files=self.collection_walker.next()
+                    files=walk_new_items(collection,root,files)
                 else:
                     root,dirs,files = self.last_walk_state
                     self.last_walk_state = None
@@ -604,28 +908,12 @@ class WalkSubDirectoryJob(WorkerJob):
                     i+=1
             idle_add(self.browser.update_backstatus,True,'Scanning for new images')
             while jobs.ishighestpriority(self) and len(files)>0:
-                p=files.pop(0)
-                r=p.rfind('.')
-                if r<=0:
-                    continue
-                fullpath=os.path.join(root, p)
-                relpath=os.path.relpath(os.path.join(root, p),scan_dir)
-                mimetype=io.get_mime_type(fullpath)
-                if not mimetype.lower().startswith('image') and not mimetype.lower().startswith('video'):
-                    log.debug('Directory walk found invalid mimetype '+mimetype+' for '+fullpath)
-                    continue
-                mtime=io.get_mtime(fullpath)
-                st=os.stat(fullpath)
-                if os.path.isdir(fullpath):
-                    log.warning('Directory Walk: item '+fullpath+' is a directory')
-                    continue
-                item=baseobjects.Item(relpath,mtime)
-                if collection.find(item)<0:
-                    collection.load_metadata(item,notify_plugins=False) ##todo: check if exists already
-                    self.browser.lock.acquire()
-                    collection.add(item)
-                    self.browser.lock.release()
-                    idle_add(self.browser.resize_and_refresh_view,self.collection)
+                item=files.pop(0)
+                collection.load_metadata(item,notify_plugins=False)
+                self.browser.lock.acquire()
+                collection.add(item)
+                self.browser.lock.release()
+                idle_add(self.browser.resize_and_refresh_view,self.collection)
         if self.done:
             log.info('Directory walk complete for %s',self.sub_dir)
             idle_add(self.browser.resize_and_refresh_view,self.collection)
@@ -638,7 +926,7 @@ class WalkSubDirectoryJob(WorkerJob):
                 idle_add(self.browser.resize_and_refresh_view,self.collection)
             self.notify_items=[]
             self.collection_walker=None
-            pluginmanager.mgr.resume_collection_events(self.collection)
+            self.resume_events()
             self.last_walk_state=None
             return True
         self.last_walk_state=(root,dirs,files)
@@ -664,6 +952,8 @@ def parse_filter_text(text):
 
 
 class BuildViewJob(WorkerJob):
+    BATCH_SIZE=250 #number of items filtered between checks for higher priority jobs
+    MERGE_SIZE=1000 #minimum number of matching items collected before they are added to the view
     def __init__(self,worker,collection,browser,sort_key=None,filter_text=''):
         WorkerJob.__init__(self,'BUILDVIEW',925,worker,collection,browser)
         self.sort_key=sort_key
@@ -679,96 +969,187 @@ class BuildViewJob(WorkerJob):
         self.browser.lock.acquire()
         if i==0:
             log.info('Building view for %s with sort key %s and filter %s',collection.id,self.sort_key,self.filter_text)
+            jobs.clear(PrefetchThumbsJob,collection)
+            filter_text=self.filter_text.strip()
+            if self.sort_key and self.sort_key!=view.sort_key_text and filter_text==view.built_filter:
+                ##only the sort order has changed: reorder the items already in the view
+                if view.resort(self.sort_key):
+                    self.browser.lock.release()
+                    log.info('Resorted view for %s with sort key %s',collection.id,self.sort_key)
+                    self.rebuilt_in_place(view)
+                    return True
+            ##if the new filter only narrows the one the view was built with, only the items in the view need to be filtered
+            narrowing=view.built_filter is not None and viewsupport.narrows_query(view.built_filter,filter_text)
+            view.built_filter=None
             if self.sort_key:
                 view.sort_key_text=self.sort_key
             if view.sort_key_text:
                 view.key_cb=self.collection.browser_sort_keys[view.sort_key_text]
             view.filters=None
-            filter_text=self.filter_text.strip()
             if filter_text.startswith('lastview&'):
                 filter_text=filter_text[9:]
                 self.superset=view.copy()
+            elif narrowing:
+                log.info('Filter %s narrows the current view',filter_text)
+                self.superset=view.copy()
             else:
                 self.superset=collection
             if filter_text.strip():
                 view.set_filter(filter_text)
             else:
                 view.clear_filter(filter_text)
+            if self.superset is collection and view.restore_query(filter_text):
+                ##the result of a recent search was still valid (e.g. the user deleted the last characters they typed)
+                view.built_filter=filter_text
+                self.browser.lock.release()
+                log.info('Restored view for %s with filter %s from the query cache',collection.id,filter_text)
+                self.rebuilt_in_place(view)
+                return True
             view.empty()
             pluginmanager.mgr.callback('t_view_emptied',collection,view)
-            pluginmanager.mgr.suspend_collection_events(collection)
+            self.suspend_events()
             idle_add(self.browser.update_view)
         lastrefresh=i
         self.browser.lock.release()
+        ##matching items are collected with their sort keys and added to the view with a single sort
+        ##each time the number collected reaches the size of the view (so the browser shows partial results)
+        pending_items=[]
+        pending_keys=[]
         while i<len(self.superset) and jobs.ishighestpriority(self):
-            item=self.superset(i)
-            if item.meta!=None:
-                self.browser.lock.acquire()
-                view.add_item(item)
-                self.browser.lock.release()
-                if i-lastrefresh>1000:
-                    lastrefresh=i
-                    idle_add(self.browser.resize_and_refresh_view,collection)
-                    idle_add(self.browser.update_status,1.0*i/len(self.superset),'Rebuilding image view - %i of %i'%(i,len(self.superset)))
-            i+=1
+            last=min(i+self.BATCH_SIZE,len(self.superset))
+            batch=[self.superset(j) for j in xrange(i,last)]
+            batch=view.filter_items([item for item in batch if item is not None and item.meta!=None])
+            pending_items+=batch
+            pending_keys+=view.keys_for(batch)
+            i=last
+            if len(pending_items)>=max(self.MERGE_SIZE,len(view)):
+                self.merge(view,pending_items,pending_keys)
+                pending_items=[]
+                pending_keys=[]
+                idle_add(self.browser.resize_and_refresh_view,collection)
+            if i-lastrefresh>1000:
+                lastrefresh=i
+                idle_add(self.browser.update_status,1.0*i/len(self.superset),'Rebuilding image view - %i of %i'%(i,len(self.superset)))
+        ##nothing is left pending when the job is preempted because other jobs may change the view
+        if pending_items:
+            self.merge(view,pending_items,pending_keys)
+            idle_add(self.browser.resize_and_refresh_view,collection)
         if i<len(self.superset):  ## and jobs.ishighestpriority(self)
             self.pos=i
             return False
         else:
             self.pos=0
+            if not self.filter_text.strip().startswith('lastview&'):
+                view.built_filter=self.filter_text.strip()
+                view.cache_query(view.built_filter)
             idle_add(self.browser.resize_and_refresh_view,collection)
             idle_add(self.browser.update_status,2,'View rebuild complete')
             idle_add(self.browser.post_build_view)
-            pluginmanager.mgr.resume_collection_events(collection)
+            self.resume_events()
+            pluginmanager.mgr.callback('t_view_updated',collection,view)
             log.info('Rebuild view complete for %s',collection.id)
             return True
 
+    def rebuilt_in_place(self,view):
+        'notify the browser and plugins that the view was updated without rebuilding it'
+        idle_add(self.browser.update_view)
+        idle_add(self.browser.resize_and_refresh_view,self.collection)
+        idle_add(self.browser.update_status,2,'View rebuild complete')
+        idle_add(self.browser.post_build_view)
+        pluginmanager.mgr.callback('t_view_updated',self.collection,view)
+
+    def merge(self,view,items,keys):
+        self.browser.lock.acquire()
+        try:
+            view.add_items(items,keys)
+        finally:
+            self.browser.lock.release()
+
 
 class MapImagesJob(WorkerJob):
+    '''
+    finds the images to show in a region of the map, sending lists of (item,thumbnail pixbuf,count,(lat,lon)) to
+    the callback. if there are more than max_images geotagged images in the region they are grouped into clusters
+    (count is the number of images of the cluster in the region, item is a representative image in the region and
+    (lat,lon) is their mean position)
+    '''
     def __init__(self,worker,collection,browser,region,callback,limit_to_view=True):
         WorkerJob.__init__(self,'MAPIMAGES',780,worker,collection,browser)
         self.pos=0
-        self.cancel=False
         self.limit_to_view=limit_to_view
         self.update_callback=callback
         self.pblist=[]
         self.region=region
         self.max_images=50
-        self.im_count=0
-        self.restart=False
+        self.results=None
         self.view=collection.get_active_view()
 
+    def cancel(self,shutdown=False):
+        ##map requests are replaced whenever the map moves, so there's no need to notify the user
+        pass
+
+    def find_items(self):
+        '''
+        returns a list of (item,count,(lat,lon)) for the images or clusters of images to show in the region
+        '''
+        collection=self.collection
+        index=collection.geo_index
+        lat0,lon0,lat1,lon1=self.region
+        if index is None:
+            listitems=self.view if self.limit_to_view else collection
+            items=[]
+            for i in xrange(len(listitems)):
+                item=listitems(i)
+                if imagemanip.item_in_region(item,*self.region):
+                    items.append(item)
+                    if len(items)>=self.max_images:
+                        break
+            return [(item,1,imagemanip.get_coords(item)) for item in items]
+        if not self.limit_to_view or len(self.view)==len(collection):
+            level=index.level_for_region(*self.region)
+            clusters=index.clusters(level,*self.region)
+            if sum(c[0] for c in clusters)<=self.max_images:
+                items=index.query(*self.region)
+            elif level<index.MAX_LEVEL:
+                return [(item,count,(lat,lon)) for count,lat,lon,item in clusters if item is not None]
+            else: ##the region is too small to split the images into clusters, show some of them
+                items=index.query(*self.region,limit=self.max_images)
+        else:
+            ##the index covers the whole collection, so the items in the region have to be checked against the view
+            view=self.view
+            items=[]
+            for item in index.query(*self.region):
+                if view.find_item(item)>=0:
+                    items.append(item)
+                    if len(items)>=self.max_images:
+                        break
+        return [(item,1,imagemanip.get_coords(item)) for item in items]
+
     def __call__(self):
         jobs=self.worker.jobs
+        if self.results is None:
+            self.results=self.find_items()
+            self.pos=0
         i=self.pos
-        if self.limit_to_view:
-            listitems=self.view
-        else:
-            listitems=collection
-        while i<len(listitems) and jobs.ishighestpriority(self) and self.im_count<self.max_images and not self.cancel:
-            item=listitems(i)
-            if imagemanip.item_in_region(item,*self.region):
-                self.collection.load_thumbnail(item)
-                if item.thumb:
-                    log.debug('Map plugin: found item %s with coordinates on current map view',item)
-                    pb=imagemanip.scale_pixbuf(item.thumb,40)
-                    self.pblist.append((item,pb))
-                    self.im_count+=1
-            if self.update_callback and i%100==0:
+        while i<len(self.results) and jobs.ishighestpriority(self):
+            item,count,coords=self.results[i]
+            self.collection.load_thumbnail(item)
+            if item.thumb:
+                log.debug('Map plugin: found item %s with coordinates on current map view',item)
+                pb=imagemanip.scale_pixbuf(item.thumb,40)
+                self.pblist.append((item,pb,count,coords))
+            i+=1
+            if self.update_callback and i%10==0:
                 idle_add(self.update_callback,self.pblist)
                 self.pblist=[]
-            i+=1
-        if i<len(listitems) and self.im_count<self.max_images and not self.cancel:
+        if i<len(self.results):
             self.pos=i
-        else:
-            idle_add(self.update_callback,self.pblist)
-            self.pblist=[]
-            self.pos=0
-            self.cancel=False
-            if not self.restart:
-                return True
-            self.restart=False
-            self.im_count=0
+            return False
+        idle_add(self.update_callback,self.pblist)
+        self.pblist=[]
+        self.results=None
+        self.pos=0
+        return True
 
 
 
@@ -776,7 +1157,6 @@ class RotateThumbJob(WorkerJob):
     def __init__(self,worker,collection,browser,left=True,limit_to_view=True):
         WorkerJob.__init__(self,'ROTATETHUMBS',830,worker,collection,browser)
         self.pos=0
-        self.cancel=False
         self.limit_to_view=limit_to_view
         self.left=left
         self.view=self.collection.get_active_view()
@@ -790,7 +1170,7 @@ class RotateThumbJob(WorkerJob):
             listitems=self.view
         else:
             listitems=self.collection
-        while i<len(listitems) and jobs.ishighestpriority(self) and not self.cancel:
+        while i<len(listitems) and jobs.ishighestpriority(self):
             item=listitems(i)
             if item.selected:
                 rotated=True
@@ -800,13 +1180,12 @@ class RotateThumbJob(WorkerJob):
                     imagemanip.rotate_right(item,self.collection)
                 idle_add(self.browser.update_status,1.0*i/len(listitems),'Rotating selected images')
             i+=1
-        if i<len(listitems) and not self.cancel:
+        if i<len(listitems):
             self.pos=i
         else:
             idle_add(self.browser.update_status,1.0*i/len(listitems),'Rotating selected images')
             idle_add(self.browser.resize_and_refresh_view,self.collection)
             self.pos=0
-            self.cancel=False
             return True
         return False
 
@@ -818,7 +1197,6 @@ class SelectionJob(WorkerJob):
     def __init__(self,worker,collection,browser,mode=SELECT,limit_to_view=True):
         WorkerJob.__init__(self,'SELECTION',825,worker,collection,browser)
         self.pos=0
-        self.cancel=False
         self.limit_to_view=limit_to_view
         self.mode=mode
         self.view=self.collection.get_active_view()
@@ -832,7 +1210,7 @@ class SelectionJob(WorkerJob):
             listitems=self.view
         else:
             listitems=self.collection
-        while i<len(listitems) and jobs.ishighestpriority(self) and not self.cancel:
+        while i<len(listitems) and jobs.ishighestpriority(self):
             item=listitems(i)
             prev=item.selected
             if self.mode==INVERT_SELECT:
@@ -843,13 +1221,12 @@ class SelectionJob(WorkerJob):
             if i%100==0:
                 idle_add(self.browser.update_status,1.0*i/len(listitems),'Selecting images - %i of %i'%(i,len(listitems)))
             i+=1
-        if i<len(listitems) and not self.cancel:
+        if i<len(listitems):
             self.pos=i
         else:
             idle_add(self.browser.update_status,1.0*i/len(listitems),'Selecting images - %i of %i'%(i,len(listitems)))
             idle_add(self.browser.resize_and_refresh_view,self.collection)
             self.pos=0
-            self.cancel=False
             return True
         return False
 
@@ -864,128 +1241,87 @@ EDIT_VIEW=2
 EDIT_SELECTION=3
 
 class EditMetaDataJob(WorkerJob):
+    BATCH_SIZE=500 #number of items edited before the collection and plugins are notified
     def __init__(self,worker,collection,browser,mode,meta,keyword_string='',scope=EDIT_SELECTION):
         WorkerJob.__init__(self,'EDITMETADATA',750,worker,collection,browser)
         self.pos=-1
-        self.cancel=False
         self.mode=mode
         self.scope=scope
         self.keyword_string=keyword_string
+        self.tags=metadata.tag_split(keyword_string)
         self.meta=meta
 ##PICKLED DICT
 #        self.meta=imageinfo.PickledDict(meta)
 
-    def __call__(self):
-        collection=self.collection
-        view=collection.get_active_view()
-        jobs=self.worker.jobs
-        if self.pos<0:
-            self.pos=0
-            pluginmanager.mgr.suspend_collection_events(self.collection)
-        i=self.pos
-        items=collection if self.scope==EDIT_COLLECTION else view
+    def keyword_changes(self,tags_kw):
+        '''
+        returns the list of keywords after the edit is applied to the list of keywords tags_kw
+        '''
+        tags=self.tags
         if self.mode==ADD_KEYWORDS:
-            tags=metadata.tag_split(self.keyword_string)
-            tags_lower=[t.lower() for t in tags]
-            while i<len(items) and jobs.ishighestpriority(self) and not self.cancel:
-                item=items(i)
-                if (self.scope!=EDIT_SELECTION or item.selected) and item.meta!=None and item.meta!=False:
-                    meta=item.meta.copy()
-                    try:
-                        tags_kw=meta['Keywords']
-                    except:
-                        tags_kw=[]
-                    tags_kw_lower=[t.lower() for t in tags_kw]
-                    new_tags=list(tags_kw)
-                    for j in range(len(tags)):
-                        if tags_lower[j] not in tags_kw_lower:
-                            new_tags.append(tags[j])
-                    if len(new_tags)==0:
-                        del meta['Keywords']
-                    else:
-                        meta['Keywords']=new_tags
-                    item.set_meta(meta,collection)
-                if i%100==0:
-                    idle_add(self.browser.update_status,1.0*i/len(items),'Selecting images - %i of %i'%(i,len(items)))
-                i+=1
+            tags_kw_lower=[t.lower() for t in tags_kw]
+            new_tags=list(tags_kw)
+            for t in tags:
+                if t.lower() not in tags_kw_lower:
+                    new_tags.append(t)
+                    tags_kw_lower.append(t.lower())
+            return new_tags
         if self.mode==RENAME_KEYWORDS:
-            tags=metadata.tag_split(self.keyword_string) ##tags should contain a pair of keywords (find, replace)
+            ##tags should contain a pair of keywords (find, replace)
             find_tag=tags[0].lower()
             repl_tag=tags[1] ##todo: can get weird results/errors if tags contains bad data
-            while i<len(items) and jobs.ishighestpriority(self) and not self.cancel:
-                item=items(i)
-                if (self.scope!=EDIT_SELECTION or item.selected) and item.meta!=None and item.meta!=False:
-                    meta=item.meta.copy()
-                    try:
-                        tags_kw=meta['Keywords']
-                    except:
-                        tags_kw=[]
-                    tags_kw_lower=[t.lower() for t in tags_kw]
-                    new_tags=list(tags_kw)
-                    for j in range(len(tags_kw_lower)):
-                        if find_tag==tags_kw_lower[j]:
-                            new_tags[j]=repl_tag
-                    if new_tags!=list(tags_kw):
-                        if len(new_tags)==0 and 'Keywords' in meta:
-                            del meta['Keywords']
-                        else:
-                            meta['Keywords']=new_tags
-                        item.set_meta(meta,collection)
-                if i%100==0:
-                    idle_add(self.browser.update_status,1.0*i/len(items),'Selecting images - %i of %i'%(i,len(items)))
-                i+=1
+            return [repl_tag if t.lower()==find_tag else t for t in tags_kw]
         if self.mode==TOGGLE_KEYWORDS:
-            tags=metadata.tag_split(self.keyword_string)
-            while i<len(items) and jobs.ishighestpriority(self) and not self.cancel:
-                item=items(i)
-                if (self.scope!=EDIT_SELECTION or item.selected) and item.meta!=None:
-                    imagemanip.toggle_tags(item,tags,collection)
-                if i%100==0:
-                    idle_add(self.browser.update_status,1.0*i/len(items),'Selecting images - %i of %i'%(i,len(items)))
-                i+=1
+            return imagemanip.toggled_keywords(tags_kw,tags)
         if self.mode==REMOVE_KEYWORDS:
-            tags=metadata.tag_split(self.keyword_string)
             tags_lower=[t.lower() for t in tags]
-            while i<len(items) and jobs.ishighestpriority(self) and not self.cancel:
-                item=items(i)
-                if (self.scope!=EDIT_SELECTION or item.selected) and item.meta!=None and item.meta!=False:
-                    meta=item.meta.copy()
-                    try:
-                        tags_kw=list(meta['Keywords'])
-                        tags_kw_lower=[t.lower() for t in tags_kw]
-                        new_tags=[]
-                        for j in range(len(tags_kw)):
-                            if tags_kw_lower[j] not in tags_lower:
-                                new_tags.append(tags_kw[j])
-                        if len(new_tags)==0:
-                            del meta['Keywords']
-                        else:
-                            meta['Keywords']=new_tags
-                        item.set_meta(meta,collection)
-                    except:
-                        pass
-                if i%100==0:
-                    idle_add(self.browser.update_status,1.0*i/len(items),'Removing keywords - %i of %i'%(i,len(items)))
-                i+=1
+            return [t for t in tags_kw if t.lower() not in tags_lower]
+        return list(tags_kw)
 
+    def changes(self,item):
+        '''
+        returns the dictionary of metadata changes for item (see CollectionBase.edit_metadata)
+        '''
         if self.mode==CHANGE_META:
-            while i<len(items) and jobs.ishighestpriority(self) and not self.cancel:
+            return self.meta
+        try:
+            tags_kw=item.meta['Keywords']
+        except:
+            tags_kw=[]
+        new_tags=self.keyword_changes(tags_kw)
+        if new_tags==list(tags_kw):
+            return {}
+        return {'Keywords':new_tags if len(new_tags)>0 else None}
+
+    def __call__(self):
+        collection=self.collection
+        view=collection.get_active_view()
+        jobs=self.worker.jobs
+        if self.pos<0:
+            self.pos=0
+            self.suspend_events()
+        i=self.pos
+        items=collection if self.scope==EDIT_COLLECTION else view
+        while i<len(items) and jobs.ishighestpriority(self):
+            edits=[]
+            end=min(i+self.BATCH_SIZE,len(items))
+            while i<end:
                 item=items(i)
                 if (self.scope!=EDIT_SELECTION or item.selected) and item.meta!=None and item.meta!=False:
-                    for k,v in self.meta.iteritems():
-                        item.set_meta_key(k,v,collection)
-                if i%100==0:
-                    idle_add(self.browser.update_status,1.0*i/len(items),'Setting keywords - %i of %i'%(i,len(items)))
+                    changes=self.changes(item)
+                    if changes:
+                        edits.append((item,changes))
                 i+=1
+            collection.edit_metadata(edits)
+            idle_add(self.browser.update_status,1.0*i/len(items),'Editing metadata - %i of %i'%(i,len(items)))
 
-        if i<len(items) and not self.cancel:
+        if i<len(items):
             self.pos=i
         else:
             idle_add(self.browser.update_status,2.0,'Metadata edit complete - %i of %i'%(i,len(items)))
             idle_add(self.browser.resize_and_refresh_view,collection)
             self.pos=0
-            self.cancel=False
-            pluginmanager.mgr.resume_collection_events(collection)
+            self.resume_events()
             return True
         return False
 
@@ -994,15 +1330,40 @@ class SaveViewJob(WorkerJob):
     def __init__(self,worker,collection,browser,save,selected_only):
         WorkerJob.__init__(self,'SAVEVIEW',750,worker,collection,browser)
         self.pos=0
-        self.cancel=False
         self.selected_only=selected_only
         self.save=save
+        self.meta_writer=metadata_pool.MetadataWriteQueue(collection)
+        self.saved=0
+        self.failed=[]
+
+    def add_written_items(self,results,progress):
+        '''
+        record the results of a batch of metadata writes, results is a list of (item,written) where written
+        is the result from the metadata process pool, or None if the metadata should be written here
+        '''
+        if not results:
+            return
+        for item,written in results:
+            if written is None:
+                result=self.collection.write_metadata(item)
+            else:
+                result=self.collection.write_metadata(item,written=written)
+            if result:
+                self.saved+=1
+            else:
+                self.failed.append(item)
+        idle_add(self.browser.resize_and_refresh_view,self.collection)
+        idle_add(self.browser.update_status,progress,'Committing changes in view - %i saved, %i failed'%(self.saved,len(self.failed)))
 
     def __call__(self):
         jobs=self.worker.jobs
         i=self.pos
         listitems=self.collection.get_active_view()
-        while i<len(listitems) and jobs.ishighestpriority(self) and not self.cancel:
+        use_pool=self.save and self.meta_writer.enabled()
+        while i<len(listitems) and jobs.ishighestpriority(self):
+            if self.meta_writer.full():
+                self.add_written_items(self.meta_writer.get_ready(0.05),1.0*i/len(listitems))
+                continue
             inc=True
             item=listitems(i)
             if not self.selected_only or listitems(i).selected:
@@ -1014,9 +1375,10 @@ class SaveViewJob(WorkerJob):
                         idle_add(self.browser.update_status,1.0*i/len(listitems),'Committing chages in view - %i of %i'%(i,len(listitems)))
                         inc=False
                     elif item.is_meta_changed():
-                        self.collection.write_metadata(item)
-                        idle_add(self.browser.resize_and_refresh_view,self.collection)
-                        idle_add(self.browser.update_status,1.0*i/len(listitems),'Committing changes in view - %i of %i'%(i,len(listitems)))
+                        if use_pool and 'sidecar' not in item.__dict__:
+                            self.meta_writer.put(item)
+                        else:
+                            self.add_written_items([(item,None)],1.0*i/len(listitems))
                 else:
                     ##revert the deletion mark and any changes to the image metadata
                     if item.is_meta_changed()==2:
@@ -1041,27 +1403,166 @@ class SaveViewJob(WorkerJob):
                         idle_add(self.browser.update_status,1.0*i/len(listitems),'Reverting changes in view - %i of %i'%(i,len(listitems)))
             if i%100==0:
                 if self.save:
+                    self.add_written_items(self.meta_writer.get_ready(),1.0*i/len(listitems))
                     idle_add(self.browser.update_status,1.0*i/len(listitems),'Committing changes in view - %i of %i'%(i,len(listitems)))
                 else:
                     idle_add(self.browser.update_status,1.0*i/len(listitems),'Reverting changes in view - %i of %i'%(i,len(listitems)))
             if inc:
                 i+=1
-        if i<len(listitems) and not self.cancel:
+        self.meta_writer.flush()
+        if i<len(listitems):
             self.pos=i
+            return False
+        ##wait for the writes still in the pool to finish
+        while len(self.meta_writer)>0 and jobs.ishighestpriority(self):
+            self.add_written_items(self.meta_writer.get_ready(0.05),1.0)
+        if len(self.meta_writer)>0:
+            self.pos=i
+            return False
+        if self.failed:
+            print 'Error writing metadata for',len(self.failed),'images:',', '.join(self.failed)
+            idle_add(self.browser.update_status,2.0,'Saving images complete - %i of %i could not be written'%(len(self.failed),self.saved+len(self.failed)))
         else:
             idle_add(self.browser.update_status,2.0,'Saving images complete')
-            idle_add(self.browser.resize_and_refresh_view,self.collection)
-            self.pos=0
-            self.cancel=False
-            return True
-        return False
+        idle_add(self.browser.resize_and_refresh_view,self.collection)
+        self.pos=0
+        self.saved=0
+        self.failed=[]
+        return True
+
+
+class StatItemsJob(WorkerJob):
+    '''
+    checks the directories and stats the items of a VerifyImagesJob on the io lane, in the order of the collection
+    when the verify started. the results are passed to the verify job in batches with put_stats
+    the job has a higher priority than the verify so that it runs first when the worker has a single lane
+    '''
+    lane=IO
+    def __init__(self,worker,collection,browser,verify_job,items):
+        WorkerJob.__init__(self,'STATITEMS',510,worker,collection,browser)
+        self.verify_job=verify_job
+        self.items=items #list of (uid,path) of the items to check
+        self.countpos=0
+
+    def cancel(self,shutdown=False):
+        self.verify_job.put_stats({},True)
+
+    def __call__(self):
+        jobs=self.worker.jobs
+        verify_job=self.verify_job
+        while self.countpos<len(self.items) and jobs.ishighestpriority(self):
+            batch=self.items[self.countpos:self.countpos+verify_job.STAT_BATCH]
+            self.countpos+=len(batch)
+            changed=[(uid,path) for uid,path in batch if verify_job.dir_changed(uid)]
+            results=dict((uid,(False,None)) for uid,path in batch)
+            for (uid,path),st in zip(changed,walker.stat_paths([path for uid,path in changed])):
+                results[uid]=(True,st)
+            verify_job.put_stats(results,False)
+        if self.countpos<len(self.items):
+            return False
+        verify_job.put_stats({},True)
+        return True
 
 
 class VerifyImagesJob(WorkerJob):
-    def __init__(self,worker,collection,browser):
+    '''
+    checks that the items in the collection still exist and reloads those that have changed
+    only the items in directories whose signature differs from collection.dir_state are stat'd, by a StatItemsJob
+    on the io lane. this job handles the changes to the collection on the interactive lane
+    walked is the dictionary of directory signatures recorded by the WalkDirectoryJob that queued the verify (if any)
+    '''
+    STAT_BATCH=64 #number of items stat'd together (in the stat thread pool if settings.stat_threads>0)
+    def __init__(self,worker,collection,browser,walked=None):
         WorkerJob.__init__(self,'VERIFYIMAGES',500,worker,collection,browser)
         self.countpos=-1
         self.view=self.collection.get_active_view()
+        self.meta_loader=metadata_pool.MetadataLoadQueue(collection)
+        self.walked=walked
+        self.changed_dirs={} #relative directory path -> (changed,signature) for the directories checked so far
+        self.stats={} #uid -> (changed,os.stat result) for the items checked by the StatItemsJob
+        self.pending=set() #uids of the items the StatItemsJob has still to check
+        self.stats_ready=threading.Condition()
+
+    def dir_changed(self,uid):
+        'returns True if the directory containing the item with uid has changed since the last scan'
+        key=os.path.dirname(uid)
+        try:
+            return self.changed_dirs[key][0]
+        except KeyError:
+            pass
+        signature=walker.dir_signature(os.path.join(self.collection.image_dirs[0],key))
+        changed=signature is None or self.collection.dir_state.get(key)!=signature
+        self.changed_dirs[key]=(changed,signature)
+        return changed
+
+    def put_stats(self,results,finished):
+        '''
+        called by the StatItemsJob with a dictionary of uid -> (changed,os.stat result) for the items it has checked
+        finished is True once it has checked all of the items (or has been cancelled)
+        '''
+        self.stats_ready.acquire()
+        self.stats.update(results)
+        self.pending.difference_update(results)
+        if finished:
+            self.pending.clear()
+        self.stats_ready.notifyAll()
+        self.stats_ready.release()
+
+    def check_item(self,item):
+        '''
+        returns a tuple (changed,os.stat result) for item, where changed is True if its directory has changed since the
+        last scan and the stat result is None if the file is missing (or the directory is unchanged). waits for the
+        StatItemsJob to check the item, returning None if this job is preempted first. items that were added after
+        the verify started are checked here
+        '''
+        jobs=self.worker.jobs
+        self.stats_ready.acquire()
+        try:
+            while item.uid in self.pending:
+                if not jobs.ishighestpriority(self):
+                    return None
+                self.stats_ready.wait(0.05)
+            result=self.stats.pop(item.uid,None)
+        finally:
+            self.stats_ready.release()
+        if result is not None:
+            return result
+        if not self.dir_changed(item.uid):
+            return (False,None)
+        return (True,walker.stat_paths([self.collection.get_path(item)])[0])
+
+    def cancel(self,shutdown=False):
+        self.worker.jobs.clear(StatItemsJob,self.collection)
+        WorkerJob.cancel(self,shutdown)
+
+    def update_dir_state(self):
+        '''
+        record the signatures of the directories checked by the walk and the verify. a changed directory is
+        only recorded if the walk saw the same signature (otherwise new files in it may not have been added)
+        '''
+        state={}
+        if self.walked is not None:
+            state.update(self.walked)
+        for key,(changed,signature) in self.changed_dirs.iteritems():
+            if changed and (self.walked is None or self.walked.get(key)!=signature):
+                state[key]=None
+        self.collection.update_dir_state(state)
+
+    def update_loaded_items(self,results):
+        '''
+        replace items in the collection with their updated metadata once it has been read by the process pool
+        '''
+        collection=self.collection
+        for item,result in results:
+            self.browser.lock.acquire()
+            removed=collection.delete(item)
+            self.browser.lock.release()
+            if removed is None: #item was removed from the collection while the metadata was being read
+                continue
+            collection.load_metadata(item,notify_plugins=False,preloaded=result)
+            self.browser.lock.acquire()
+            collection.add(item)
+            self.browser.lock.release()
 
     def __call__(self):
         jobs=self.worker.jobs
@@ -1069,15 +1570,24 @@ class VerifyImagesJob(WorkerJob):
         if self.countpos<0:
             log.info('Starting image verification job')
             self.countpos=0
-            pluginmanager.mgr.suspend_collection_events(self.collection)
+            items=[(item.uid,collection.get_path(item)) for item in collection.get_all_items()]
+            self.pending=set(uid for uid,path in items)
+            self.worker.queue_job_instance(StatItemsJob(self.worker,collection,self.browser,self,items))
+            self.suspend_events()
+        use_pool=self.meta_loader.enabled()
         i=self.countpos  ##todo: make sure this gets initialized
         while i<len(collection) and jobs.ishighestpriority(self):
+            if use_pool:
+                self.update_loaded_items(self.meta_loader.get_ready())
+                if self.meta_loader.full():
+                    self.update_loaded_items(self.meta_loader.get_ready(0.05))
+                    continue
             item=collection[i]
             if i%50==0:
                 idle_add(self.browser.update_backstatus,True,'Verifying images in collection - %i of %i'%(i,len(collection)))
             if item.meta==False: ##TODO: This is a legacy check -- should remove eventually
                 item.meta=None
-            if item.meta==None:
+            if item.meta==None and not use_pool:
                 log.debug('Verify job loading metadata %s',item.uid)
                 self.browser.lock.acquire()
                 collection.delete(item)
@@ -1087,16 +1597,40 @@ class VerifyImagesJob(WorkerJob):
                 collection.add(item)
                 self.browser.lock.release()
 #                idle_add(self.browser.resize_and_refresh_view,self.collection) #TODO: too slow to do this update for every image, but not doing so can cause issues with user clicking on one image but another actually being selected
-            if not os.path.exists(collection.get_path(item)) or os.path.isdir(collection.get_path(item)) or collection.get_path(item)!=io.get_true_path(collection.get_path(item)):  ##todo: what if mimetype or size changed?
-                log.debug('Verify job delete missing item %s',item.uid)
-                self.browser.lock.acquire()
-                collection.delete(item)
-                self.browser.lock.release()
-#                idle_add(self.browser.resize_and_refresh_view,self.collection)
+            result=self.check_item(item)
+            if result is None: #preempted while waiting for the StatItemsJob
+                break
+            changed,st=result
+            if changed:
+                if st is None or stat.S_ISDIR(st.st_mode) or collection.get_path(item)!=io.get_true_path(collection.get_path(item)):  ##todo: what if mimetype or size changed?
+                    log.debug('Verify job delete missing item %s',item.uid)
+                    self.browser.lock.acquire()
+                    collection.delete(item)
+                    self.browser.lock.release()
+#                    idle_add(self.browser.resize_and_refresh_view,self.collection)
+                    continue
+            if item.meta==None: #use_pool is True
+                log.debug('Verify job queueing metadata load %s',item.uid)
+                self.meta_loader.put(item)
+                i+=1
                 continue
-            mtime=io.get_mtime(collection.get_path(item))
+            if not changed:
+                if i%200 == 0:
+                    idle_add(self.browser.resize_and_refresh_view,self.collection)
+                i+=1
+                continue
+            mtime=int(st.st_mtime)
             if mtime!=item.mtime:
                 log.debug('Verify job mtime changed %s %s %s',item.uid,item.mtime,mtime)
+                if use_pool:
+                    item.mtime=mtime
+                    item.image=None
+                    item.qview=None
+                    item.thumb=None
+                    item.thumburi=None
+                    self.meta_loader.put(item)
+                    i+=1
+                    continue
                 self.browser.lock.acquire()
                 collection.delete(item)
                 self.browser.lock.release()
@@ -1115,11 +1649,17 @@ class VerifyImagesJob(WorkerJob):
             i+=1
         self.countpos=i
         if i>=len(collection):
+            self.meta_loader.flush()
+            while len(self.meta_loader)>0 and jobs.ishighestpriority(self):
+                self.update_loaded_items(self.meta_loader.get_ready(0.1))
+            if len(self.meta_loader)>0:
+                return False
             self.countpos=0
+            self.update_dir_state()
             idle_add(self.browser.resize_and_refresh_view,self.collection)
             idle_add(self.browser.update_backstatus,False,'Verification complete')
             log.info('Image verification complete')
-            pluginmanager.mgr.resume_collection_events(self.collection)
+            self.resume_events()
             if collection.store_thumbnails:
                 self.worker.queue_job_instance(MakeThumbsJob(self.worker,self.collection,self.browser))
             return True
@@ -1127,37 +1667,267 @@ class VerifyImagesJob(WorkerJob):
 
 
 class MakeThumbsJob(WorkerJob):
+    lane=CPU
+    '''
+    creates the missing thumbnails of the items in the collection when the job starts. the job runs on the cpu lane,
+    so it works through a copy of the item list (jobs on the interactive lane may add and remove items meanwhile)
+    '''
     def __init__(self,worker,collection,browser):
         WorkerJob.__init__(self,'MAKETHUMBS',300,worker,collection,browser)
         self.countpos=0
+        self.items=None
 
     def __call__(self):
         jobs=self.worker.jobs
         collection=self.collection
+        if self.items is None:
+            self.items=collection.get_all_items()
+        items=self.items
+        use_pool=thumbpool.engine.enabled(collection)
         i=self.countpos
-        while i<len(collection) and jobs.ishighestpriority(self):
-            item=collection[i]
+        while i<len(items) and jobs.ishighestpriority(self):
+            if use_pool and thumbpool.engine.full():
+                apply_thumbnail_results(self.browser,thumbpool.engine.get_ready(0.1))
+                continue
+            item=items[i]
             if i%50==0:
-                idle_add(self.browser.update_backstatus,True,'Validating and creating missing thumbnails - %i of %i'%(i,len(collection)))
+                idle_add(self.browser.update_backstatus,True,'Validating and creating missing thumbnails - %i of %i'%(i,len(items)))
                 idle_add(self.browser.resize_and_refresh_view,self.collection)
             if not collection.has_thumbnail(item):
-                collection.make_thumbnail(item)
+                if use_pool:
+                    thumbpool.engine.put(collection,item)
+                else:
+                    collection.make_thumbnail(item)
 #                idle_add(self.browser.update_backstatus,True,'Validating and creating missing thumbnails - %i of %i'%(i,len(collection)))
             i+=1
         self.countpos=i
-        if i>=len(collection):
+        while use_pool and i>=len(items) and len(thumbpool.engine)>0 and jobs.ishighestpriority(self):
+            apply_thumbnail_results(self.browser,thumbpool.engine.get_ready(0.1))
+        if i>=len(items) and (not use_pool or len(thumbpool.engine)==0):
             self.countpos=0
+            self.items=None
             idle_add(self.browser.update_backstatus,False,'Thumbnailing complete')
             idle_add(self.browser.resize_and_refresh_view,self.collection)
             return True
         return False
 
 
+class DeferredThumbQueue:
+    '''
+    items that need a thumbnail after being added or changed by a DirectoryUpdateJob. each item is
+    queued once, and an item that is removed before its thumbnail is made is dropped from the queue
+    '''
+    def __init__(self):
+        self.items=collections.OrderedDict() #(collection,uid) -> item
+        self.scheduled=set() #collections with a DeferredThumbsJob that will process their items
+        self.lock=threading.Lock()
+
+    def put(self,collection,item):
+        '''
+        queue item, returns True if a DeferredThumbsJob needs to be queued for collection
+        (the collection is then marked as scheduled until the job calls finish)
+        '''
+        self.lock.acquire()
+        try:
+            self.items.pop((collection,item.uid),None)
+            self.items[(collection,item.uid)]=item
+            if collection in self.scheduled:
+                return False
+            self.scheduled.add(collection)
+            return True
+        finally:
+            self.lock.release()
+
+    def finish(self,collection):
+        '''
+        called by the DeferredThumbsJob of collection once the queue is empty, returns False (and the job
+        must carry on) if items were queued since, otherwise the collection is no longer scheduled
+        '''
+        self.lock.acquire()
+        try:
+            for key in self.items:
+                if key[0]==collection:
+                    return False
+            self.scheduled.discard(collection)
+            return True
+        finally:
+            self.lock.release()
+
+    def clear(self,collection):
+        'drop the items queued for collection (called when its DeferredThumbsJob is cancelled)'
+        self.lock.acquire()
+        for key in [key for key in self.items if key[0]==collection]:
+            del self.items[key]
+        self.scheduled.discard(collection)
+        self.lock.release()
+
+    def discard(self,collection,uid):
+        'remove the item with uid from the queue, returns True if it was queued'
+        self.lock.acquire()
+        try:
+            return self.items.pop((collection,uid),None) is not None
+        finally:
+            self.lock.release()
+
+    def pop_batch(self,collection,count):
+        'remove and return up to count of the items queued for collection'
+        self.lock.acquire()
+        try:
+            keys=[]
+            for key in self.items:
+                if key[0]==collection:
+                    keys.append(key)
+                    if len(keys)>=count:
+                        break
+            return [self.items.pop(key) for key in keys]
+        finally:
+            self.lock.release()
+
+    def count(self,collection):
+        self.lock.acquire()
+        try:
+            return len([key for key in self.items if key[0]==collection])
+        finally:
+            self.lock.release()
+
+
+class DeferredThumbsJob(WorkerJob):
+    '''
+    creates the thumbnails queued with Worker.defer_thumbnail in batches, once the jobs the user is waiting on are done
+    '''
+    lane=CPU
+    BATCH_SIZE=20
+    def __init__(self,worker,collection,browser):
+        WorkerJob.__init__(self,'DEFERREDTHUMBS',320,worker,collection,browser)
+
+    def cancel(self,shutdown=False):
+        self.worker.deferred_thumbs.clear(self.collection)
+
+    def __call__(self):
+        jobs=self.worker.jobs
+        collection=self.collection
+        queue=self.worker.deferred_thumbs
+        use_pool=thumbpool.engine.enabled(collection)
+        while jobs.ishighestpriority(self) and queue.count(collection)>0:
+            if not collection.is_open:
+                queue.pop_batch(collection,queue.count(collection))
+                break
+            if use_pool and thumbpool.engine.full():
+                apply_thumbnail_results(self.browser,thumbpool.engine.get_ready(0.1))
+                continue
+            for item in queue.pop_batch(collection,self.BATCH_SIZE if use_pool else 1):
+                if collection.find(item)<0 or collection.has_thumbnail(item):
+                    continue
+                if use_pool:
+                    thumbpool.engine.put(collection,item)
+                else:
+                    collection.make_thumbnail(item)
+                    idle_add(self.browser.redraw_view,collection)
+        while use_pool and queue.count(collection)==0 and len(thumbpool.engine)>0 and jobs.ishighestpriority(self):
+            apply_thumbnail_results(self.browser,thumbpool.engine.get_ready(0.1))
+        if use_pool and len(thumbpool.engine)>0:
+            return False
+        return queue.finish(collection)
+
+
 class DirectoryUpdateJob(WorkerJob):
+    '''
+    applies a batch of coalesced directory monitor events (see fstools.eventqueue) to the collections
+    renamed files and directories keep their metadata and thumbnails
+    '''
     def __init__(self,worker,collection,browser,action_queue):
         WorkerJob.__init__(self,'DIRECTORYUPDATE',400,worker,collection,browser)
         self.queue=action_queue
         self.started=False
+        self.verify=set() #collections that need a verify because a directory was removed
+
+    def update_file(self,collection,fullpath):
+        'add the file at fullpath to the collection, or reload it if it has changed'
+        relpath=collection.get_relpath(fullpath)
+        if not (os.path.exists(fullpath) and os.path.isfile(fullpath)):
+            return
+        if not walker.is_media_file(os.path.basename(fullpath),fullpath):
+            return
+        i=collection.find(relpath)
+        if i>=0:
+            if io.get_mtime(fullpath)!=collection[i].mtime:
+                item=collection[i]
+                self.browser.lock.acquire()
+                collection.delete(item)
+                self.browser.lock.release()
+                item.mtime=io.get_mtime(fullpath)
+                item.image=None
+                item.qview=None
+                item.thumb=None
+                item.thumburi=None
+                collection.load_metadata(item,notify_plugins=False)
+                self.browser.lock.acquire()
+                collection.add(item)
+                self.browser.lock.release()
+                self.worker.defer_thumbnail(collection,item)
+                idle_add(self.browser.resize_and_refresh_view,collection)
+        else:
+            log.debug('Adding new item %s to collection %s',fullpath,collection.id)
+            item=baseobjects.Item(relpath)
+            item.mtime=io.get_mtime(fullpath)
+            collection.load_metadata(item,notify_plugins=False)
+            self.browser.lock.acquire()
+            collection.add(item)
+            self.browser.lock.release()
+            self.worker.defer_thumbnail(collection,item)
+            idle_add(self.browser.resize_and_refresh_view,collection)
+
+    def rename_file(self,collection,src,dest):
+        i=collection.find(collection.get_relpath(src))
+        if i>=0 and walker.is_media_file(os.path.basename(dest),dest):
+            log.debug('Renaming item %s to %s in collection %s',src,dest,collection.id)
+            self.browser.lock.acquire()
+            item=collection.rename_item(collection[i],collection.get_relpath(dest))
+            self.browser.lock.release()
+            if item is not None:
+                if self.worker.deferred_thumbs.discard(collection,collection.get_relpath(src)):
+                    self.worker.defer_thumbnail(collection,item)
+                idle_add(self.browser.resize_and_refresh_view,collection)
+                self.update_file(collection,dest) #in case the file was also changed
+                return
+        self.remove_file(collection,src)
+        self.update_file(collection,dest)
+
+    def rename_dir(self,collection,src,dest):
+        '''
+        rename the items in the directory src (and its sub-directories), which has been moved to dest
+        '''
+        src_rel=collection.get_relpath(src)
+        dest_rel=collection.get_relpath(dest)
+        prefix=src_rel+os.sep
+        log.debug('Renaming items in directory %s to %s in collection %s',src,dest,collection.id)
+        self.browser.lock.acquire()
+        i=bisect.bisect_left(collection,prefix)
+        items=[]
+        while i<len(collection) and collection[i].startswith(prefix):
+            items.append(collection[i])
+            i+=1
+        renamed=0
+        for item in items:
+            new_item=collection.rename_item(item,dest_rel+item.uid[len(src_rel):])
+            if new_item is not None:
+                renamed+=1
+                if self.worker.deferred_thumbs.discard(collection,item.uid):
+                    self.worker.defer_thumbnail(collection,new_item)
+        self.browser.lock.release()
+        idle_add(self.browser.resize_and_refresh_view,collection)
+        if renamed<len(items):
+            self.verify.add(collection)
+            self.worker.queue_job_instance(WalkSubDirectoryJob(self.worker,collection,self.browser,dest))
+
+    def remove_file(self,collection,fullpath):
+        if not os.path.exists(fullpath):
+            log.debug('Removing deleted item %s from collection %s',fullpath,collection.id)
+            self.worker.deferred_thumbs.discard(collection,collection.get_relpath(fullpath))
+            self.browser.lock.acquire()
+            collection.delete(collection.get_relpath(fullpath))
+            self.browser.lock.release()
+            idle_add(self.browser.resize_and_refresh_view,collection)
 
     def __call__(self):
         #todo: make sure job.queue has been initialized
@@ -1165,53 +1935,30 @@ class DirectoryUpdateJob(WorkerJob):
         jobs=self.worker.jobs
         if not self.started:
             self.started=True
-            pluginmanager.mgr.suspend_collection_events(self.collection)
+            self.suspend_events()
         while jobs.ishighestpriority(self) and len(self.queue)>0:
-            collection,fullpath,action=self.queue.pop(0)
-            relpath=collection.get_relpath(fullpath)
-            if action in ('DELETE','MOVED_FROM'):
-                if not os.path.exists(fullpath):
-                    log.debug('Removiing deleted item %s from collection %s',fullpath,collection.id)
-                    self.browser.lock.acquire()
-                    collection.delete(relpath)
-                    self.browser.lock.release()
-                    idle_add(self.browser.resize_and_refresh_view,collection)
-            if action in ('MOVED_TO','MODIFY','CREATE'):
-                if os.path.exists(fullpath) and os.path.isfile(fullpath):
-                    log.debug('Adding new item %s to collection %s',fullpath,collection.id)
-                    mimetype=io.get_mime_type(fullpath)
-                    if not mimetype.lower().startswith('image') and not mimetype.lower().startswith('video'):
-                        continue
-                    i=collection.find(relpath)
-                    if i>=0:
-                        if io.get_mtime(fullpath)!=collection[i].mtime:
-                            item=collection[i]
-                            self.browser.lock.acquire()
-                            collection.delete(item)
-                            self.browser.lock.release()
-                            item.mtime=io.get_mtime(fullpath)
-                            collection.load_metadata(item,notify_plugins=False)
-                            collection.make_thumbnail(item) ##todo: queue this onto lower priority job
-                            self.browser.lock.acquire()
-                            collection.add(item)
-                            self.browser.lock.release()
-                            idle_add(self.browser.resize_and_refresh_view,self.collection)
-                    else:
-                        item=baseobjects.Item(relpath)
-                        item.mtime=io.get_mtime(fullpath)
-                        collection.load_metadata(item,notify_plugins=False)
-                        self.browser.lock.acquire()
-                        collection.add(item)
-                        self.browser.lock.release()
-                        if not collection.has_thumbnail(item):
-                            collection.make_thumbnail(item) ##todo: queue this onto lower priority job
-                        idle_add(self.browser.resize_and_refresh_view,collection)
-                if os.path.exists(fullpath) and os.path.isdir(fullpath):
-                    if action=='MOVED_TO':
-                        log.debug('Adding new directory %s to collection %s',fullpath,collection.id)
-                        self.worker.queue_job_instance(WalkSubDirectoryJob(self.worker,collection,self.browser,fullpath))
+            collection,fullpath,action,isdir,src=self.queue.pop(0)
+            if action=='RENAME':
+                if isdir:
+                    self.rename_dir(collection,src,fullpath)
+                else:
+                    self.rename_file(collection,src,fullpath)
+            elif action in ('DELETE','MOVED_FROM'):
+                if isdir:
+                    self.verify.add(collection) #we don't get individual notifications for the files in the directory
+                else:
+                    self.remove_file(collection,fullpath)
+            elif action=='MOVED_TO' and isdir:
+                if os.path.isdir(fullpath):
+                    log.debug('Adding new directory %s to collection %s',fullpath,collection.id)
+                    self.worker.queue_job_instance(WalkSubDirectoryJob(self.worker,collection,self.browser,fullpath))
+            elif not isdir:
+                self.update_file(collection,fullpath)
         if len(self.queue)==0:
-            pluginmanager.mgr.resume_collection_events(self.collection)
+            for collection in self.verify:
+                self.worker.queue_job_instance(VerifyImagesJob(self.worker,collection,self.browser))
+            self.verify=set()
+            self.resume_events()
             return True
         return False
 
@@ -1220,43 +1967,57 @@ class Worker:
     def __init__(self,coll_set):
         self.coll_set=coll_set
         self.jobs=WorkerJobQueue()
-        self.event=threading.Event()
         self.lock=threading.Lock()
-        self.thread=threading.Thread(target=self._loop)
-        self.dirtimer=None # timer used to delay update after directory change notifications
-        self.dirlock=threading.Lock() #lock used to update the queue of deferred directory change notifications
-        self.deferred_dir_update_queue=[]
+        lanes=LANES if settings.worker_lanes else (INTERACTIVE,)
+        self.threads=[threading.Thread(target=self._loop,args=(lane,)) for lane in lanes]
+        self.dir_events=eventqueue.EventQueue(self.deferred_dir_update) #coalesces directory change notifications
+        self.deferred_thumbs=DeferredThumbQueue() #items waiting for a thumbnail after a directory change
         self.active_collection=None #to be used only on main thread
 
     def start(self):
-        self.thread.start()
+        for thread in self.threads:
+            thread.start()
 
-    def _loop(self):
-        log.info('Worker thread started')
+    def _loop(self,lane):
+        log.info('Worker thread started for the %s lane',lane)
+        event=self.jobs.lanes[lane].event
         while 1:
+            job=None
             try:
-                rem_jobs=self.jobs.get_removed_jobs()
+                rem_jobs=self.jobs.get_removed_jobs(lane)
                 if len(rem_jobs)>0:
                     for j in rem_jobs: ##clean up any cancelled jobs
-                        j.cancel()
-                if self.jobs.gethighest()==None:
-                    self.event.clear()
-                    self.event.wait()
-                job=self.jobs.gethighest()
+                        try:
+                            j.cancel()
+                        except:
+                            import traceback
+                            log.error("Error cancelling task "+j.name+" on Worker Thread ("+lane+" lane)\n"+traceback.format_exc(sys.exc_info()[2]))
+                job=self.jobs.start_job(lane)
+                if job is None:
+                    event.wait()
+                    event.clear()
+                    continue
                 if isinstance(job,QuitJob):
-                    log.info('Worker thread finished')
+                    self.jobs.pop(job)
+                    self.jobs.finish_job(lane)
+                    log.info('Worker thread finished for the %s lane',lane)
                     return
-                if job:
+                try:
                     if job():
                         self.jobs.pop(job)
+                finally:
+                    self.jobs.finish_job(lane)
             except:
                 import traceback
                 tb_text=traceback.format_exc(sys.exc_info()[2])
-                log.error("Error on Worker Thread\n"+tb_text)
-                job=self.jobs.gethighest()
+                log.error("Error on Worker Thread ("+lane+" lane)\n"+tb_text)
                 if job:
                     log.info("Abandoning Highest Priority Task "+job.name+" and Resuming Worker Loop")
                     self.jobs.pop(job)
+                    try:
+                        job.cancel() ##lets the job resume suspended events and release anything it holds
+                    except:
+                        log.error("Error cancelling task "+job.name+"\n"+traceback.format_exc(sys.exc_info()[2]))
 
     def set_active_collection(self,collection):
         '''
@@ -1273,11 +2034,9 @@ class Worker:
 
     def queue_job_instance(self,job_instance):
         self.jobs.add(job_instance)
-        self.event.set()
 
     def queue_job(self,job_class,*extra_args):
         self.jobs.add(job_class(self,self.active_collection,self.active_collection.browser,*extra_args))
-        self.event.set()
 
     def kill_jobs_by_class(self,job_class):
         self.jobs.clear_by_job_class(job_class)
@@ -1287,18 +2046,33 @@ class Worker:
         self.queue_job(WalkDirectoryJob,collection)
 
     def quit(self):
-        sj=QuitJob(self,None,None)
-        self.queue_job_instance(sj)
-        while self.thread.isAlive(): ##todo: replace this with a notification
-            time.sleep(0.1)
+        self.dir_events.stop()
+        self.jobs.quit()
+        for thread in self.threads:
+            thread.join()
+        metadata_pool.close_pool()
+        thumbpool.close_pool()
+        walker.close_stat_pool()
+        uidispatch.dispatcher.log_stats()
+        for s in memcache.stats():
+            log.info('Memory cache %(name)s: %(items)i items, %(bytes)i of %(budget)i bytes, %(hits)i hits, %(misses)i misses, %(evictions)i evictions',s)
 
     def request_map_images(self,region,callback):
+        self.jobs.clear(MapImagesJob) ##results for the previous region are no longer needed
         self.queue_job(MapImagesJob,region,callback)
 
     def request_thumbnails(self,itemlist):
         if not self.jobs.has_job(job_class=ThumbnailJob,collection=self.active_collection):
             self.queue_job(ThumbnailJob,itemlist)
 
+    def request_prefetch_thumbnails(self,itemlist):
+        '''
+        replace any outstanding prefetch request for the active collection with itemlist (nearest items first)
+        '''
+        self.jobs.clear(PrefetchThumbsJob,self.active_collection)
+        if itemlist:
+            self.queue_job(PrefetchThumbsJob,itemlist)
+
     def rotate_selected_thumbs(self,left=True):
         self.queue_job(RotateThumbJob,left)
 
@@ -1308,6 +2082,11 @@ class Worker:
     def recreate_thumb(self,item):
         self.queue_job(RecreateThumbJob,[item])
 
+    def defer_thumbnail(self,collection,item):
+        'queue a thumbnail to be made for item once the jobs the user is waiting on are done'
+        if self.deferred_thumbs.put(collection,item):
+            self.queue_job_instance(DeferredThumbsJob(self,collection,collection.browser))
+
     def recreate_selected_thumbs(self):
         self.queue_job(RecreateThumbJob,self.active_collection.get_active_view().get_selected_items())
 
@@ -1341,15 +2120,11 @@ class Worker:
     def save_or_revert_view(self,save=True,selected_only=False):
         self.queue_job(SaveViewJob,save,selected_only)
 
-    def deferred_dir_update(self):
-        self.dirlock.acquire()
-        log.debug('Starting deferred directory monitor event handler')
-        self.queue_job_instance(DirectoryUpdateJob(self,None,self.active_collection.browser,self.deferred_dir_update_queue[:])) #queue a verify job since we won't get individual image removal notifications
-        del self.deferred_dir_update_queue[:]
-        self.dirtimer=None
-        self.dirlock.release()
+    def deferred_dir_update(self,batch):
+        log.debug('Starting deferred directory monitor event handler for %i events',len(batch))
+        self.queue_job_instance(DirectoryUpdateJob(self,None,self.active_collection.browser,batch))
 
-    def directory_change_notify(self,collection,path,action,isdir):
+    def directory_change_notify(self,collection,path,action,isdir,cookie=None):
         homedir=os.path.normpath(collection.image_dirs[0])
         #ignore notifications on files in a hidden dir or not in the image dir
         if os.path.normpath(os.path.commonprefix([path,homedir]))!=homedir:
@@ -1362,21 +2137,7 @@ class Worker:
             if name.startswith('.') or name=='':
                 log.debug('Invalid directory change notification: %s %s',path,action)
                 return
-        if isdir:
-            log.debug('Directory changed notification on path: %s %s',path,action)
-            if action in ('MOVED_FROM','DELETE'):
-                self.queue_job_instance(VerifyImagesJob(self,collection,self.active_collection.browser)) #queue a verify job since we won't get individual image removal notifications
-                return
-        #valid file or a moved directory, so queue the update
-        #(modify and create notifications are
-        #only processed after some delay because many events may be generated
-        #before the files are closed)
-        ##todo: respond to file close events instead of modify/create events??
-        self.dirlock.acquire()
-        if self.dirtimer!=None:
-            self.dirtimer.cancel()
-        self.dirtimer=threading.Timer(3,self.deferred_dir_update)
-        self.dirtimer.start()
-        self.deferred_dir_update_queue.append((collection,path,action))
-        self.dirlock.release()
+        #valid file or directory, so queue the update (the events are coalesced
+        #and handled in batches once the notifications have been quiet for a short time)
+        self.dir_events.add(collection,path,action,isdir,cookie)
         log.debug('File change event: %s %s',path,action)
@@ -2,6 +2,7 @@ import pluginmanager
 import viewsupport
 import os.path
 import cPickle
+import threading
 import settings
 
 registered_collection_classes={}
@@ -88,15 +89,17 @@ class IndexRulesList:
     def remove(self,index_item,item):
         if item.meta and self.key in item.meta:
             for t in item.meta[self.key]:
-                index_item[t].remove(item)
-                if not len(index_item[t]):
-                    del index_item[t]
+                if t in index_item:
+                    index_item[t].discard(item)
+                    if not len(index_item[t]):
+                        del index_item[t]
     def update(self,index_item,item,old_meta):
         if old_meta and self.key in old_meta:
             for t in old_meta[self.key]:
-                index_item[t].remove(item)
-                if not len(index_item[t]):
-                    del index_item[t]
+                if t in index_item:
+                    index_item[t].discard(item)
+                    if not len(index_item[t]):
+                        del index_item[t]
         if item.meta and self.key in item.meta:
             for t in item.meta[self.key]:
                 if t not in index_item:
@@ -106,31 +109,65 @@ class IndexRulesList:
 class IndexRulesStr:
     def __init__(self,meta_key):
         self.key = meta_key
+    def values(self,meta):
+        if meta and self.key in meta:
+            v = meta[self.key]
+            if isinstance(v,(list,tuple)):
+                return v
+            if v:
+                return (v,)
+        return ()
     def add(self,index_item,item):
-        if item.meta and self.key in item.meta:
+        for t in self.values(item.meta):
             if t not in index_item:
                 index_item[t] = set()
-            t = item.meta[self.key]
             index_item[t].add(item)
     def remove(self,index_item,item):
-        if item.meta and self.key in item.meta:
-            t = item.meta[self.key]
-            index_item[t].remove(item)
-            if not len(index_item[t]):
-                del index_item[t]
+        for t in self.values(item.meta):
+            if t in index_item:
+                index_item[t].discard(item)
+                if not len(index_item[t]):
+                    del index_item[t]
     def update(self,index_item,item,old_meta):
-        if old_meta and self.key in old_meta:
-            t = old_meta[self.key]
-            index_item[t].remove(item)
+        for t in self.values(old_meta):
+            if t in index_item:
+                index_item[t].discard(item)
+                if not len(index_item[t]):
+                    del index_item[t]
+        self.add(index_item,item)
+
+class IndexRulesFolder:
+    '''
+    indexes items by the folder containing the image (the uid of items in local collections is the relative path)
+    '''
+    def __init__(self,meta_key='Folder'):
+        self.key = meta_key
+    def add(self,index_item,item):
+        t = os.path.split(item.uid)[0]
+        if t not in index_item:
+            index_item[t] = set()
+        index_item[t].add(item)
+    def remove(self,index_item,item):
+        t = os.path.split(item.uid)[0]
+        if t in index_item:
+            index_item[t].discard(item)
             if not len(index_item[t]):
                 del index_item[t]
-        if item.meta and self.key in item.meta:
-            if t not in index_item:
-                index_item[t] = set()
-            t = item.meta[self.key]
-            index_item[t].add(item)
+    def update(self,index_item,item,old_meta):
+        pass
+
+default_rules = {
+    'Keywords': IndexRulesList('Keywords'),
+    'Artist': IndexRulesStr('Artist'),
+    'Album': IndexRulesStr('Album'),
+    'Make': IndexRulesStr('Make'),
+    'Model': IndexRulesStr('Model'),
+    }
 
-default_rules = {'Keywords': IndexRulesList('Keywords')}
+local_rules = dict(default_rules)
+local_rules['Folder'] = IndexRulesFolder()
+
+INDEX_VERSION = '1.0'
 
 class MetadataIndex:
     '''
@@ -141,12 +178,80 @@ class MetadataIndex:
     `rules` a dictionary of rules to add and remove items to the index
         index[metadata_item] = rules_object
         a rules object has an add and remove class
+    the index can be saved to a file and restored, and can be populated lazily by passing
+    a loader callback to `defer` (the loader is called the first time the index is used)
     '''
     def __init__(self,rules = default_rules):
         self.rules = rules
         self.index = {}
         for r in rules:
             self.index[r] = {}
+    def __getattr__(self,name):
+        if name != 'index' or '_loader' not in self.__dict__:
+            raise AttributeError(name)
+        ##the index is loaded into a new MetadataIndex and only published once complete,
+        ##other threads using the index wait for the load instead of seeing it partly populated
+        self._load_lock.acquire()
+        try:
+            if 'index' not in self.__dict__:
+                loaded = MetadataIndex(self.rules)
+                self._loader(loaded)
+                self.index = loaded.index
+                del self._loader
+            return self.index
+        finally:
+            self._load_lock.release()
+    def defer(self,loader):
+        '''
+        discard the contents of the index and call loader(index) to populate it when first accessed
+        '''
+        if 'index' in self.__dict__:
+            del self.index
+        self._load_lock = threading.Lock()
+        self._loader = loader
+    def is_deferred(self):
+        return '_loader' in self.__dict__
+    def signature(self):
+        '''
+        describes the rules used to build the index, a saved index is only valid for the same rules
+        '''
+        return sorted((r,self.rules[r].__class__.__name__,self.rules[r].key) for r in self.rules)
+    def rebuild(self,items):
+        for r in self.rules:
+            self.index[r] = {}
+        for item in items:
+            self.add(item)
+    def save(self,f,stamp):
+        '''
+        write the index to file `f` storing uids instead of items
+        `stamp` should identify the state of the collection the index was built from
+        '''
+        data = {}
+        for r in self.index:
+            data[r] = dict((t,[item.uid for item in s]) for t,s in self.index[r].iteritems())
+        cPickle.dump((INDEX_VERSION,self.signature(),stamp),f,-1)
+        cPickle.dump(data,f,-1)
+    def load(self,f,stamp,items):
+        '''
+        restore the index from file `f` returning True on success
+        returns False (leaving the index unchanged) if the file was written by a different version,
+        for different rules or for a different state of the collection (i.e. the index is stale)
+        `items` is a list of the collection's items used to map uids back to items
+        '''
+        version,signature,saved_stamp = cPickle.load(f)
+        if version != INDEX_VERSION or signature != self.signature() or saved_stamp != stamp:
+            return False
+        data = cPickle.load(f)
+        by_uid = dict((item.uid,item) for item in items)
+        index = {}
+        for r in self.rules:
+            index[r] = {}
+            for t,uids in data.get(r,{}).iteritems():
+                s = set(by_uid[uid] for uid in uids if uid in by_uid)
+                if s:
+                    index[r][t] = s
+        self.index = index
+        return True
     def add(self,item):
         for r in self.rules:
             self.rules[r].add(self.index[r],item)
@@ -179,6 +284,7 @@ class CollectionBase:
         self.active_view=None
 
         self.index = None
+        self.geo_index = None #a viewsupport.GeoIndex if the collection indexes the geolocation of its items
 
         self.name=''
         self.pixbuf=None
@@ -308,6 +414,12 @@ class CollectionBase:
     def find(self,item):
         'returns index of item'
         pass
+    def rename_item(self,item,uid):
+        'give item a new uid after its file is renamed, returns the renamed item (or None if the collection does not support renames)'
+        return None
+    def missing_items(self,items):
+        'returns the items in the sorted list items that are not in the collection'
+        return [item for item in items if self.find(item)<0]
     def __call__(self,ind):
         'returns item at list position ind'
         pass
@@ -334,9 +446,12 @@ class CollectionBase:
     def delete_item(self,item):
         'remove the item from the underlying store'
         pass
-    def load_thumbnail(self,item):
+    def load_thumbnail(self,item,fast_only=True):
         'load the thumbnail from the local cache'
         pass
+    def load_thumbnails(self,items,fast_only=True):
+        'load the thumbnails for a list of items, returns a list of True/False for each item indicating success'
+        return [self.load_thumbnail(item,fast_only) for item in items]
     def make_thumbnail(self,item,pixbuf):
         'create a cached thumbnail of the image'
         pass
@@ -346,6 +461,25 @@ class CollectionBase:
     def item_metadata_update(self,item,old_metadata):
         'collection will receive when item metadata has been changed (it was previously old_metadata)'
         pass
+    def items_metadata_update(self,changes):
+        'collection will receive when the metadata of a batch of items has been changed (changes is a list of (item,old_metadata))'
+        for item,old_metadata in changes:
+            self.item_metadata_update(item,old_metadata)
+    def edit_metadata(self,edits):
+        '''
+        apply a batch of metadata edits. edits is a list of (item,changes) where changes is a dictionary
+        of key -> new value (None removes the key). the collection and plugins are notified once for the batch
+        with a 't_collection_items_metadata_changed' callback. returns the list of (item,old_metadata) for the changed items
+        '''
+        changes=[]
+        for item,item_changes in edits:
+            old=item.apply_meta_changes(item_changes)
+            if old is not None:
+                changes.append((item,old))
+        if changes:
+            self.items_metadata_update(changes)
+            pluginmanager.mgr.callback_collection('t_collection_items_metadata_changed',self,changes)
+        return changes
     def load_metadata(self,item):
         'retrieve metadata for an item from the source'
         pass
@@ -374,7 +508,9 @@ class ViewBase: ##base class for the filter view of a collection and (for now) r
             if cb==key_cb:
                 self.sort_key_text=text
         self.filter_tree=None
+        self.filter_fn=None
         self.filter_text=''
+        self.built_filter=None #the filter expression of the last complete build of the view (None if incomplete)
         self.reverse=False
         self.collection=collection
     def __call__(self,ind):
@@ -383,13 +519,50 @@ class ViewBase: ##base class for the filter view of a collection and (for now) r
         return self(ind)
     def set_filter(self,expr):
         self.filter_tree=sp.parse_expr(viewsupport.TOKENS[:],expr,viewsupport.literal_converter)
+        self.filter_fn=sp.compile_tree(bool,self.filter_tree,viewsupport.search_converter(self.collection))
     def clear_filter(self,expr):
         self.filter_tree=None
+        self.filter_fn=None
+    def filter_items(self,items):
+        '''
+        returns the list of items that pass the current filter (all of items if there is no filter)
+        '''
+        if self.filter_fn is None:
+            return list(items)
+        return sp.filter_items(self.filter_fn,items)
     def add_item(self,item,apply_filter=True):
         '''
         add item to the view
         provider should send 't_collection_item_added_to_view' notification to plugins
         '''
+    def keys_for(self,items):
+        'returns the list of the sort keys of items'
+        return [self.key_cb(item) for item in items]
+    def add_items(self,items,keys=None):
+        '''
+        add a batch of items (already filtered) to the view, `keys` are their sort keys (as returned by keys_for)
+        the caller sends a 't_view_updated' notification for the batch, so providers should override this to add the
+        items without notifying plugins of each one. this default calls add_item, which notifies for each item
+        '''
+        for item in items:
+            self.add_item(item,False)
+    def cache_query(self,expr):
+        '''
+        remember the items in the view as the result of filtering with expr (so restore_query can restore it)
+        '''
+        pass
+    def restore_query(self,expr):
+        '''
+        restore the items in the view from the result of a recent search for expr, returns True on success
+        (False if there is no valid result cached)
+        '''
+        return False
+    def resort(self,sort_key_text):
+        '''
+        reorder the items in the view using the sort key named sort_key_text, returns True on success
+        (False if the view must be rebuilt instead)
+        '''
+        return False
     def find_item(self,item):
         '''
         return the index position whose for a given item in the collection
@@ -473,6 +646,28 @@ class Item(str):
             del self.meta_backup
         if collection:
             collection.item_metadata_update(self,old)
+    def apply_meta_changes(self,changes):
+        '''
+        apply the dictionary of changes (key -> new value, None to remove the key) to the item's metadata
+        using the same rules as set_meta_key, without notifying plugins or the collection (see CollectionBase.edit_metadata)
+        returns the metadata before the changes, or None if the metadata was not changed
+        '''
+        if self.meta==None:
+            return None
+        old=self.meta
+        meta=self.meta.copy()
+        backup=self.meta_backup if self.is_meta_changed()==True else old
+        for key,value in changes.iteritems():
+            if value is None and key in meta:
+                del meta[key]
+            elif key in meta and key not in backup and value=='':
+                del meta[key]
+            else:
+                meta[key]=value
+        if meta==old:
+            return None
+        self.set_meta(meta)
+        return old
     def set_meta_key(self,key,value,collection=None):
         if self.meta==None:
             return None
@@ -521,6 +716,8 @@ class Item(str):
         del odict['relevance']
         if 'original_image' in self.__dict__:
             del odict['original_image']
+        if 'image_draft_scale' in self.__dict__:
+            del odict['image_draft_scale']
         if 'meta_backup' in self.__dict__ and self.meta==self.meta_backup:
             del self.meta_backup
         return odict
@@ -51,6 +51,9 @@ import viewsupport
 from fstools import io
 
 import imagemanip
+import memcache
+
+THUMB_BYTES=128*128*4 #approximate memory used by a thumbnail
 
 class ImageBrowser(gtk.HBox):
     '''
@@ -65,6 +68,10 @@ class ImageBrowser(gtk.HBox):
     TARGET_TYPE_URI_LIST = 0
     TARGET_TYPE_XDS = 1
     TARGET_TYPE_IMAGE = 2
+
+    # thumbnail prefetching while scrolling (see update_prefetch_thumbs)
+    PREFETCH_MAX_SCREENS = 4
+    PREFETCH_ROWS_BEHIND = 2
     XDS_ATOM = gtk.gdk.atom_intern("XdndDirectSave0")
     TEXT_ATOM = gtk.gdk.atom_intern("text/plain")
     XDS_SUCCESS = "S"
@@ -119,6 +126,10 @@ class ImageBrowser(gtk.HBox):
         self.offsetx=0
         self.geo_ind_view_first=0
         self.geo_ind_view_last=1
+        self.scroll_time=0 #time, view offset and velocity (pixels/second) of the last scroll, used to prefetch thumbnails
+        self.scroll_offset=0
+        self.scroll_velocity=0.0
+        self.prefetch_first=None #index of the first visible item when thumbnails were last prefetched
         self.hover_ind=-1
         self.command_highlight_ind=-1
         self.command_highlight_bd=False
@@ -531,6 +542,8 @@ class ImageBrowser(gtk.HBox):
     def update_view(self):
         '''reset position, update geometry, scrollbars, redraw the thumbnail view'''
         self.geo_view_offset=0
+        self.scroll_velocity=0.0
+        self.prefetch_first=None
         self.resize_and_refresh_view()
 
     def scroll_signal_pane(self,obj,event):
@@ -546,9 +559,49 @@ class ImageBrowser(gtk.HBox):
 #        self.update_geometry()
         self.update_view_index_range()
         ##self.update_required_thumbs()
+        self.update_scroll_velocity()
+        self.update_prefetch_thumbs()
         self.imarea.window.invalidate_rect((0,0,self.geo_width,self.geo_height),True)
         self.vscroll.trigger_tooltip_query()
 
+    def update_scroll_velocity(self):
+        '''track the direction and speed of scrolling (smoothed over successive scroll events)'''
+        now=time.time()
+        dt=now-self.scroll_time
+        velocity=(self.geo_view_offset-self.scroll_offset)/dt if dt>0 else 0.0
+        if dt<0.5:
+            self.scroll_velocity=0.5*self.scroll_velocity+0.5*velocity
+        else:
+            self.scroll_velocity=velocity
+        self.scroll_time=now
+        self.scroll_offset=self.geo_view_offset
+
+    def update_prefetch_thumbs(self):
+        '''
+        request the thumbnails of items beyond the visible part of the view: up to PREFETCH_MAX_SCREENS screens
+        in the direction of scrolling (more the faster the user is scrolling) and PREFETCH_ROWS_BEHIND rows behind.
+        the request is limited by settings.precache_count and to half of the in-memory thumbnail budget
+        so that prefetched thumbnails don't evict the visible ones
+        '''
+        if self.active_view is None or self.prefetch_first==self.geo_ind_view_first:
+            return
+        self.prefetch_first=self.geo_ind_view_first
+        first=self.geo_ind_view_first
+        last=min(self.geo_ind_view_last,len(self.active_view))
+        per_screen=max(1,self.geo_ind_view_last-self.geo_ind_view_first)
+        limit=min(settings.precache_count,memcache.thumbs.budget/(2*THUMB_BYTES))
+        screens=1+min(self.PREFETCH_MAX_SCREENS-1,abs(self.scroll_velocity)/max(1,self.geo_height))
+        ahead=min(limit,int(screens*per_screen))
+        behind=min(limit-ahead,self.PREFETCH_ROWS_BEHIND*self.geo_horiz_count)
+        if self.scroll_velocity>=0:
+            fore=range(last,min(last+ahead,len(self.active_view)))
+            back=range(first-1,max(0,first-behind)-1,-1)
+        else:
+            fore=range(first-1,max(0,first-ahead)-1,-1)
+            back=range(last,min(last+behind,len(self.active_view)))
+        items=[self.active_view(i) for i in fore+back]
+        self.tm.request_prefetch_thumbnails([item for item in items if item.thumb is None])
+
     def update_scrollbar(self):
         '''called to resync the scrollbar to changes in view geometry'''
         upper=len(self.active_view)/self.geo_horiz_count
@@ -744,6 +797,7 @@ class ImageBrowser(gtk.HBox):
                 if not self.active_collection.load_thumbnail(item):
                     request_thumbs=True
             if item.thumb:
+                memcache.thumbs.touch(item)
                 th=self.active_view(i).thumb
                 (thumbwidth,thumbheight)=th.get_width(),th.get_height()
                 adjy=self.geo_pad/2+(128-thumbheight)/2
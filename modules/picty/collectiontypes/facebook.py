@@ -230,7 +230,7 @@ class LoadFacebookCollectionJob(backend.WorkerJob):
                 self.worker.queue_job_instance(backend.MakeThumbsJob(self.worker,self.collection,self.browser))
 #            log.info('Loaded collection with '+str(len(collection))+' images')
             if self.browser!=None:
-                gobject.idle_add(self.browser.resize_and_refresh_view,collection)
+                backend.idle_add(self.browser.resize_and_refresh_view,collection)
         else:
             pass
 #            log.error('Load collection failed')
@@ -260,7 +260,7 @@ class FacebookSyncJob(backend.WorkerJob):
         while jobs.ishighestpriority(self) and self.page<=self.pages:
             while self.counter<len(self.photodata) and jobs.ishighestpriority(self):
                 pct=(1.0*(self.page-1)*500+self.counter)/(self.pages*500)
-                gobject.idle_add(self.browser.update_status,pct,'Syncing with Facebook')
+                backend.idle_add(self.browser.update_status,pct,'Syncing with Facebook')
                 ph=self.photodata[self.counter]
                 self.counter+=1
                 uid=str(ph.object_id)
@@ -281,7 +281,7 @@ class FacebookSyncJob(backend.WorkerJob):
                     collection.load_metadata(item,photo_data=ph)
                 if ind<0:
                     self.collection.add(item,self.collection)
-                gobject.idle_add(self.browser.resize_and_refresh_view,self.collection)
+                backend.idle_add(self.browser.resize_and_refresh_view,self.collection)
                 if self.counter == len(self.photodata):
                     pass
 #                    ##TODO: Look for another page of data
@@ -310,12 +310,12 @@ class FacebookSyncJob(backend.WorkerJob):
                     self.browser.lock.acquire()
                     collection.delete(item)
                     self.browser.lock.release()
-                    gobject.idle_add(self.browser.resize_and_refresh_view,self.collection)
+                    backend.idle_add(self.browser.resize_and_refresh_view,self.collection)
             pluginmanager.mgr.resume_collection_events(self.collection)
-            gobject.idle_add(self.browser.update_status,2.0,'Syncing Complete')
+            backend.idle_add(self.browser.update_status,2.0,'Syncing Complete')
             gobject.idle_add(self.browser.update_backstatus,False,'Syncing Complete - %s'%(collection.name,))
             return True
-        gobject.idle_add(self.browser.update_status,2.0,'Pausing Facebook Syncing')
+        backend.idle_add(self.browser.update_status,2.0,'Pausing Facebook Syncing')
         gobject.idle_add(self.browser.update_backstatus,False,'Syncing Paused - %s'%(collection.name,))
         return False
 
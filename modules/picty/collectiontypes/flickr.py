@@ -189,7 +189,7 @@ class LoadFlickrCollectionJob(backend.WorkerJob):
                 self.worker.queue_job_instance(backend.MakeThumbsJob(self.worker,self.collection,self.browser))
 #            log.info('Loaded collection with '+str(len(collection))+' images')
             if self.browser!=None:
-                gobject.idle_add(self.browser.resize_and_refresh_view,collection)
+                backend.idle_add(self.browser.resize_and_refresh_view,collection)
         else:
             pass
 #            log.error('Load collection failed')
@@ -225,7 +225,7 @@ class FlickrSyncJob(backend.WorkerJob):
                 self.page+=1
                 self.counter=0
                 pct=(1.0*(self.page-1)*500+self.counter)/(self.pages*500)
-                gobject.idle_add(self.browser.update_status,pct,'Syncing with Flickr')
+                backend.idle_add(self.browser.update_status,pct,'Syncing with Flickr')
                 if recently_updated: ##TODO: This isn't going to work if recentlyUpdated doesn't report deleted images
                     photos=flickr_client.photos_recentlyUpdated(min_date=collection.last_update_time, page=self.page, per_page=100, extras='description,license,geo,tags,date_upload,date_taken,last_update,url_s,url_o,original_format')
                 else:
@@ -236,7 +236,7 @@ class FlickrSyncJob(backend.WorkerJob):
                 self.photodata=photos.findall('photo')
             while self.counter<len(self.photodata) and jobs.ishighestpriority(self):
                 pct=(1.0*(self.page-1)*500+self.counter)/(self.pages*500)
-                gobject.idle_add(self.browser.update_status,pct,'Syncing with Flickr')
+                backend.idle_add(self.browser.update_status,pct,'Syncing with Flickr')
                 ph=self.photodata[self.counter]
                 self.counter+=1
                 uid=ph.attrib['id']
@@ -250,7 +250,7 @@ class FlickrSyncJob(backend.WorkerJob):
                     collection.load_metadata(item)
                 if ind<0:
                     self.collection.add(item,self.collection)
-                gobject.idle_add(self.browser.resize_and_refresh_view,self.collection)
+                backend.idle_add(self.browser.resize_and_refresh_view,self.collection)
         if self.page>self.pages:
             collection.last_update_time=new_time
 
@@ -271,12 +271,12 @@ class FlickrSyncJob(backend.WorkerJob):
                     self.browser.lock.acquire()
                     collection.delete(item)
                     self.browser.lock.release()
-                    gobject.idle_add(self.browser.resize_and_refresh_view,self.collection)
+                    backend.idle_add(self.browser.resize_and_refresh_view,self.collection)
             pluginmanager.mgr.resume_collection_events(self.collection)
-            gobject.idle_add(self.browser.update_status,2.0,'Syncing Complete')
+            backend.idle_add(self.browser.update_status,2.0,'Syncing Complete')
             gobject.idle_add(self.browser.update_backstatus,False,'Syncing Complete - %s'%(collection.name,))
             return True
-        gobject.idle_add(self.browser.update_status,2.0,'Pausing Flickr Syncing')
+        backend.idle_add(self.browser.update_status,2.0,'Pausing Flickr Syncing')
         gobject.idle_add(self.browser.update_backstatus,False,'Syncing Paused - %s'%(collection.name,))
         return False
 
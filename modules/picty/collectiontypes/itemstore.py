@@ -0,0 +1,363 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Log structured storage for the items of a persistent collection
+
+The store consists of three files in the collection directory:
+    items.snapshot -- header (version, generation, count) followed by the items pickled in chunks
+    items.log -- header (version, generation) followed by one (uid, item) record per change
+                 (item is None if the uid was removed from the collection)
+    view -- the keys and uids of the active view (see SimpleView.save)
+    index -- the collection's MetadataIndex, stamped with the generation and log length it was built from
+    dirs -- the signature (mtime, entry count) of each scanned directory, stamped like the index
+The log is only replayed if its generation matches the snapshot, so a crash part way through
+compacting the log into a new snapshot never replays stale records.
+'''
+
+__version__='1.0'
+
+import os
+import os.path
+import cPickle
+import threading
+
+SNAPSHOT_FILE='items.snapshot'
+LOG_FILE='items.log'
+VIEW_FILE='view'
+INDEX_FILE='index'
+DIRS_FILE='dirs'
+LEGACY_DATA_FILE='data'
+
+CHUNK_SIZE=2000 #number of items pickled together in a snapshot chunk
+COMPACT_MIN_RECORDS=1000 #the log is never compacted before it has this many records
+
+
+def _fsync(f):
+    f.flush()
+    try:
+        os.fsync(f.fileno())
+    except (OSError,AttributeError):
+        pass
+
+def _replace(src,dest):
+    ##os.rename won't overwrite an existing file on windows
+    if os.name=='nt' and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(src,dest)
+
+
+class ItemStore:
+    '''
+    Stores the items of a collection as a snapshot plus an append-only log of changed items
+    the owner calls mark_dirty/mark_deleted as items change, flush to append the changes to the log
+    and compact (possibly over several calls) to fold the log into a new snapshot
+    '''
+    def __init__(self,coll_dir):
+        self.coll_dir=coll_dir
+        self.generation=0
+        self.log_records=0
+        self.dirty={} #uid -> item or None if deleted
+        self.lock=threading.Lock()
+        self._compaction=None
+
+    def snapshot_file(self):
+        return os.path.join(self.coll_dir,SNAPSHOT_FILE)
+
+    def log_file(self):
+        return os.path.join(self.coll_dir,LOG_FILE)
+
+    def view_file(self):
+        return os.path.join(self.coll_dir,VIEW_FILE)
+
+    def index_file(self):
+        return os.path.join(self.coll_dir,INDEX_FILE)
+
+    def dirs_file(self):
+        return os.path.join(self.coll_dir,DIRS_FILE)
+
+    def legacy_data_file(self):
+        return os.path.join(self.coll_dir,LEGACY_DATA_FILE)
+
+    def exists(self):
+        return os.path.exists(self.snapshot_file())
+
+    def stamp(self):
+        '''
+        identifies the current state of the store on disk
+        '''
+        return (self.generation,self.log_records)
+
+    ''' ************************************************************************
+                            LOADING
+        ************************************************************************'''
+
+    def load(self):
+        '''
+        returns the sorted list of items from the snapshot with the changes in the log applied
+        '''
+        f=open(self.snapshot_file(),'rb')
+        try:
+            version,self.generation,count=cPickle.load(f)
+            items={}
+            while True:
+                try:
+                    chunk=cPickle.load(f)
+                except EOFError:
+                    break
+                for item in chunk:
+                    items[item.uid]=item
+        finally:
+            f.close()
+        if len(items)!=count:
+            print 'Warning: collection snapshot in',self.coll_dir,'has',len(items),'items, expected',count
+        self.log_records=self._replay_log(items)
+        return sorted(items.itervalues())
+
+    def _replay_log(self,items):
+        '''
+        applies the records in the log to the items dictionary, returns the number of records applied
+        a partially written record at the end of the log (e.g. after a crash) is discarded
+        '''
+        log_file=self.log_file()
+        if not os.path.exists(log_file):
+            self._new_log()
+            return 0
+        f=open(log_file,'rb')
+        try:
+            try:
+                version,generation=cPickle.load(f)
+            except:
+                generation=None
+            if generation!=self.generation:
+                print 'Discarding stale collection log',log_file
+                f.close()
+                self._new_log()
+                return 0
+            count=0
+            good_pos=f.tell()
+            while True:
+                try:
+                    uid,item=cPickle.load(f)
+                except EOFError:
+                    break
+                except:
+                    print 'Discarding truncated record at the end of collection log',log_file
+                    break
+                if item is None:
+                    if uid in items:
+                        del items[uid]
+                else:
+                    items[uid]=item
+                count+=1
+                good_pos=f.tell()
+        finally:
+            f.close()
+        if good_pos<os.path.getsize(log_file):
+            f=open(log_file,'r+b')
+            f.truncate(good_pos)
+            f.close()
+        return count
+
+    def _new_log(self):
+        tmp_file=self.log_file()+'.tmp'
+        f=open(tmp_file,'wb')
+        cPickle.dump((__version__,self.generation),f,-1)
+        _fsync(f)
+        f.close()
+        _replace(tmp_file,self.log_file())
+        self.log_records=0
+
+    def load_view(self,view):
+        if not os.path.exists(self.view_file()):
+            return False
+        f=open(self.view_file(),'rb')
+        try:
+            view.load(f)
+        finally:
+            f.close()
+        return True
+
+    def save_view(self,view):
+        tmp_file=self.view_file()+'.tmp'
+        f=open(tmp_file,'wb')
+        view.save(f)
+        _fsync(f)
+        f.close()
+        _replace(tmp_file,self.view_file())
+
+    def load_index(self,index,items,stamp=None):
+        '''
+        restore the MetadataIndex `index` if it was saved for the state identified by `stamp`
+        (the current state of the store by default), returns False if missing or stale
+        '''
+        if not os.path.exists(self.index_file()):
+            return False
+        if stamp is None:
+            stamp=self.stamp()
+        f=open(self.index_file(),'rb')
+        try:
+            return index.load(f,stamp,items)
+        finally:
+            f.close()
+
+    def save_index(self,index):
+        tmp_file=self.index_file()+'.tmp'
+        f=open(tmp_file,'wb')
+        index.save(f,self.stamp())
+        _fsync(f)
+        f.close()
+        _replace(tmp_file,self.index_file())
+
+    def load_dirs(self,stamp=None):
+        '''
+        returns the dictionary of directory signatures if it was saved for the state identified by `stamp`
+        (the current state of the store by default), or an empty dictionary if missing or stale
+        '''
+        if not os.path.exists(self.dirs_file()):
+            return {}
+        if stamp is None:
+            stamp=self.stamp()
+        f=open(self.dirs_file(),'rb')
+        try:
+            version,saved_stamp=cPickle.load(f)
+            if saved_stamp!=stamp:
+                return {}
+            return cPickle.load(f)
+        except:
+            print 'Discarding corrupt directory signatures',self.dirs_file()
+            return {}
+        finally:
+            f.close()
+
+    def save_dirs(self,dirs):
+        tmp_file=self.dirs_file()+'.tmp'
+        f=open(tmp_file,'wb')
+        cPickle.dump((__version__,self.stamp()),f,-1)
+        cPickle.dump(dirs,f,-1)
+        _fsync(f)
+        f.close()
+        _replace(tmp_file,self.dirs_file())
+
+    ''' ************************************************************************
+                            RECORDING CHANGES
+        ************************************************************************'''
+
+    def mark_dirty(self,item):
+        self.lock.acquire()
+        self.dirty[item.uid]=item
+        self.lock.release()
+
+    def mark_deleted(self,item):
+        self.lock.acquire()
+        self.dirty[item.uid]=None
+        self.lock.release()
+
+    def has_changes(self):
+        return len(self.dirty)>0
+
+    def flush(self):
+        '''
+        appends a record for each item changed since the last flush to the log
+        returns False if a compaction is in progress (the changes are kept until it completes)
+        '''
+        if self._compaction is not None:
+            return False
+        self.lock.acquire()
+        dirty=self.dirty
+        self.dirty={}
+        self.lock.release()
+        if not dirty:
+            return True
+        try:
+            f=open(self.log_file(),'ab')
+            for uid,item in dirty.iteritems():
+                cPickle.dump((uid,item),f,-1)
+            _fsync(f)
+            f.close()
+        except:
+            ##put the changes back so they are retried on the next flush
+            self.lock.acquire()
+            dirty.update(self.dirty)
+            self.dirty=dirty
+            self.lock.release()
+            raise
+        self.log_records+=len(dirty)
+        return True
+
+    ''' ************************************************************************
+                            SNAPSHOTS
+        ************************************************************************'''
+
+    def needs_compaction(self,item_count,ratio=0.25):
+        return self.log_records>=max(COMPACT_MIN_RECORDS,ratio*item_count)
+
+    def is_compacting(self):
+        return self._compaction is not None
+
+    def compact(self,items,continue_cb=None):
+        '''
+        writes a new snapshot containing items and starts a new log
+        items should be a copy of the collection's list of items
+        if continue_cb is provided, it is called between chunks and the compaction is
+        suspended if it returns False. returns True once the compaction is complete,
+        call again with the same arguments to resume.
+        '''
+        if self._compaction is None:
+            self.flush()
+            tmp_file=self.snapshot_file()+'.tmp'
+            f=open(tmp_file,'wb')
+            cPickle.dump((__version__,self.generation+1,len(items)),f,-1)
+            self._compaction=[f,items,0]
+        f,items,pos=self._compaction
+        while pos<len(items):
+            if continue_cb is not None and not continue_cb():
+                self._compaction[2]=pos
+                return False
+            cPickle.dump(items[pos:pos+CHUNK_SIZE],f,-1)
+            pos+=CHUNK_SIZE
+        _fsync(f)
+        f.close()
+        self._compaction=None
+        _replace(f.name,self.snapshot_file())
+        self.generation+=1
+        self._new_log()
+        return True
+
+    def cancel_compaction(self):
+        if self._compaction is None:
+            return
+        f=self._compaction[0]
+        f.close()
+        os.remove(f.name)
+        self._compaction=None
+
+    def create(self,items=[]):
+        '''
+        create a new store (discarding any existing snapshot and log) containing items
+        '''
+        self.cancel_compaction()
+        self.generation=0
+        self.lock.acquire()
+        self.dirty={}
+        self.lock.release()
+        self.compact(items)
+
@@ -179,6 +179,7 @@ class LocalDir(localstorebin.Collection):
         baseobjects.CollectionBase.__init__(self)
 #        ##the collection consists of an array of entries for images, which are cached in the collection file
         self.items=[] #the image/video items
+        self.init_runtime_attributes()
 
         ##and has the following properties (which are stored in the collection file if it exists)
         self.image_dirs=[]
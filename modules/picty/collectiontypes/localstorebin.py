@@ -31,6 +31,7 @@ import re
 import cPickle
 import string
 import tempfile
+import threading
 
 import gtk
 
@@ -51,6 +52,8 @@ from picty import backend
 from picty.fstools import io
 from picty.uitools import widget_builder as wb
 import simpleview
+import itemstore
+import thumbstore
 
 
 exist_actions=['Skip','Rename','Overwrite Always','Overwrite if Newer']
@@ -219,7 +222,7 @@ class LocalStorePrefWidget(gtk.VBox):
         self.monitor_images_check.set_active(True)
         self.use_internal_thumbnails_check=gtk.CheckButton("Use embedded thumbnails if available")
         self.use_internal_thumbnails_check.set_active(False)
-        self.store_thumbs_combo=wb.LabeledComboBox("Thumbnail storage",["Gnome Desktop Thumbnail Cache (User's Home)","Hidden Folder in Collection Folder"])
+        self.store_thumbs_combo=wb.LabeledComboBox("Thumbnail storage",["Gnome Desktop Thumbnail Cache (User's Home)","Hidden Folder in Collection Folder","Packed Thumbnail File (Collection Data Folder)"])
         if settings.is_windows:
             self.store_thumbs_combo.set_sensitive(False)
             self.store_thumbs_combo.set_form_data(1)
@@ -267,7 +270,8 @@ class LocalStorePrefWidget(gtk.VBox):
                 'monitor_image_dirs':self.monitor_images_check.get_active(),
                 'trash_location':'OPEN-DESKTOP' if self.trash_location_combo.get_form_data()==0 else None,
                 'store_thumbnails':self.store_thumbnails_check.get_active(),
-                'store_thumbs_with_images':self.store_thumbs_combo.get_form_data(),
+                'store_thumbs_with_images':self.store_thumbs_combo.get_form_data()==1,
+                'pack_thumbnails':self.store_thumbs_combo.get_form_data()==2,
                 'use_sidecars':self.sidecar_check.get_active(),
                 }
 
@@ -281,7 +285,7 @@ class LocalStorePrefWidget(gtk.VBox):
         self.use_internal_thumbnails_check.set_active(val_dict['load_embedded_thumbs'])
         self.monitor_images_check.set_active(val_dict['monitor_image_dirs'])
         self.store_thumbnails_check.set_active(val_dict['store_thumbnails'])
-        self.store_thumbs_combo.set_form_data(val_dict['store_thumbs_with_images'])
+        self.store_thumbs_combo.set_form_data(2 if val_dict.get('pack_thumbnails') else int(val_dict['store_thumbs_with_images']))
         self.trash_location_combo.set_form_data(0 if val_dict['trash_location'] is not None else 1)
         self.sidecar_check.set_active(val_dict['use_sidecars'])
 
@@ -309,7 +313,7 @@ class NewLocalStoreWidget(gtk.VBox):
         self.load_meta_check.set_active(True)
         self.use_internal_thumbnails_check=gtk.CheckButton("Use embedded thumbnails if available")
         self.use_internal_thumbnails_check.set_active(False)
-        self.store_thumbs_combo=wb.LabeledComboBox("Thumbnail storage",["Gnome Desktop Thumbnail Cache (User's Home)","Hidden Folder in Collection Folder"])
+        self.store_thumbs_combo=wb.LabeledComboBox("Thumbnail storage",["Gnome Desktop Thumbnail Cache (User's Home)","Hidden Folder in Collection Folder","Packed Thumbnail File (Collection Data Folder)"])
         if settings.is_windows:
             self.store_thumbs_combo.set_sensitive(False)
             self.store_thumbs_combo.set_form_data(1)
@@ -371,7 +375,8 @@ class NewLocalStoreWidget(gtk.VBox):
                 'load_embedded_thumbs':self.use_internal_thumbnails_check.get_active(),
                 'load_preview_icons':self.use_internal_thumbnails_check.get_active() and not self.load_meta_check.get_active(),
                 'monitor_image_dirs':self.monitor_images_check.get_active(),
-                'store_thumbs_with_images':self.store_thumbs_combo.get_form_data(),
+                'store_thumbs_with_images':self.store_thumbs_combo.get_form_data()==1,
+                'pack_thumbnails':self.store_thumbs_combo.get_form_data()==2,
                 'store_thumbnails':self.store_thumbnails_check.get_active(),
                 'trash_location':'OPEN-DESKTOP' if self.trash_location_combo.get_form_data()==0 else None,
                 'use_sidecars':self.sidecar_check.get_active(),
@@ -387,7 +392,7 @@ class NewLocalStoreWidget(gtk.VBox):
         self.use_internal_thumbnails_check.set_active(val_dict['load_embedded_thumbs'])
         self.monitor_images_check.set_active(val_dict['monitor_image_dirs'])
         self.store_thumbnails_check.set_active(val_dict['store_thumbnails'])
-        self.store_thumbs_combo.set_form_data(val_dict['store_thumbs_with_images'])
+        self.store_thumbs_combo.set_form_data(2 if val_dict.get('pack_thumbnails') else int(val_dict['store_thumbs_with_images']))
         self.store_thumbnails_check.set_active(val_dict['store_thumbnails'])
         self.trash_location_combo.set_form_data(0 if val_dict['trash_location'] is not None else 1)
         self.sidecar_check.set_active(val_dict['use_sidecars'])
@@ -396,7 +401,6 @@ class NewLocalStoreWidget(gtk.VBox):
 def create_empty_localstore(name,prefs,overwrite_if_exists=False):
     col_dir=os.path.join(settings.collections_dir,name)
     pref_file=os.path.join(os.path.join(settings.collections_dir,name),'prefs')
-    data_file=os.path.join(os.path.join(settings.collections_dir,name),'data')
     if not overwrite_if_exists:
         if os.path.exists(col_dir):
             return False
@@ -411,10 +415,7 @@ def create_empty_localstore(name,prefs,overwrite_if_exists=False):
                 d[p]=prefs[p]
         cPickle.dump(prefs,f,-1)
         f.close()
-        f=open(data_file,'wb')
-        cPickle.dump(__version__,f,-1)
-        cPickle.dump([],f,-1) #empty list of items
-        f.close()
+        itemstore.ItemStore(col_dir).create() #empty list of items
     except:
         print 'Error writing empty collection to ',col_dir
         import traceback,sys
@@ -442,15 +443,17 @@ class Collection(baseobjects.CollectionBase):
     user_creatable=True
     view_class=simpleview.SimpleView
     pref_items=baseobjects.CollectionBase.pref_items+('image_dirs','recursive','verify_after_walk','load_meta','load_embedded_thumbs',
-                'load_preview_icons','trash_location','thumbnail_cache_dir','monitor_image_dirs','rescan_at_open','store_thumbnails','store_thumbs_with_images','use_sidecars')
+                'load_preview_icons','trash_location','thumbnail_cache_dir','monitor_image_dirs','rescan_at_open','store_thumbnails','store_thumbs_with_images','pack_thumbnails','use_sidecars')
     def __init__(self,prefs): #todo: store base path for the collection
         ##the following attributes are set at run-time by the owner
         baseobjects.CollectionBase.__init__(self)
 
-        self.index = baseobjects.MetadataIndex()
+        self.index = baseobjects.MetadataIndex(baseobjects.local_rules)
+        self.index_stamp = None
 
 #        ##the collection consists of an array of entries for images, which are cached in the collection file
         self.items=[] #the image/video items
+        self.init_runtime_attributes()
 
         ##and has the following properties (which are stored in the collection file if it exists)
         self.image_dirs=[]
@@ -464,6 +467,7 @@ class Collection(baseobjects.CollectionBase):
         self.monitor_image_dirs=True
         self.store_thumbnails=True
         self.store_thumbs_with_images=False
+        self.pack_thumbnails=False #store thumbnails in a single packed file in the collection directory (see thumbstore.py)
         self.rescan_at_open=True
         self.use_sidecars=False
 
@@ -478,12 +482,29 @@ class Collection(baseobjects.CollectionBase):
 
         self.id=self.name
 
+    def init_runtime_attributes(self):
+        '''
+        sets up the run-time attributes used by the methods of the collection
+        (subclasses that don't call Collection.__init__, such as localdir.LocalDir, must call this)
+        '''
+        self.store=None #the log structured file store for the items (created when the collection is opened)
+        self.checkpoint_timer=None
+        self.worker=None
+        self.thumb_store=None #the packed thumbnail store if pack_thumbnails is set (created when the collection is opened)
+        self.text_index = viewsupport.TextIndex(lambda: self.items) #full text index used by keyword searches (built on first use)
+        self.sort_columns = viewsupport.SortKeyColumns(self.browser_sort_keys) #precomputed sort keys used by the views
+        self.change_count = 0 #incremented when items are added, removed or their metadata changes (invalidates cached search results)
+        self.dir_state = {} #relative directory path -> signature (mtime, entry count) when the directory was last scanned (see fstools.walker)
+        self.geo_index = viewsupport.GeoIndex(lambda: self.items) #grid index of geotagged items used by the map (built on first use)
+
     ''' ************************************************************************
                             PREFERENCES, OPENING AND CLOSING
         ************************************************************************'''
     def set_prefs(self,prefs):
         baseobjects.CollectionBase.set_prefs(self,prefs)
-        if settings.is_windows or self.store_thumbs_with_images:
+        if self.pack_thumbnails:
+            self.thumbnail_cache_dir=None
+        elif settings.is_windows or self.store_thumbs_with_images:
             self.thumbnail_cache_dir=os.path.join(self.image_dirs[0],'.thumbnails')
         else:
             self.thumbnail_cache_dir=None
@@ -525,13 +546,14 @@ class Collection(baseobjects.CollectionBase):
         return create_empty_localstore(self.name,self.get_prefs())
 
     def open(self,thread_manager,browser=None):
+        self.worker=thread_manager
         self.start_monitor(thread_manager.directory_change_notify) ##todo: THIS SHOULDN'T HAPPEN UNTIL AFTER WE SUCCESSFULLY OPEN
         j=backend.LoadCollectionJob(thread_manager,self,browser)
         thread_manager.queue_job_instance(j)
 
     def _open(self):
         '''
-        load the collection from a binary pickle file
+        load the collection from the item store, migrating the older single pickle data file if necessary
         '''
         col_dir=os.path.join(settings.collections_dir,self.name)
         if self.is_open:
@@ -539,26 +561,20 @@ class Collection(baseobjects.CollectionBase):
         try:
             if os.path.isfile(col_dir):
                 return self.legacy_open(col_dir)
-            f=open(self.data_file(),'rb')
-            version=cPickle.load(f)
-            print 'Loaded collection %s (version %s)'%(self.name,version,)
-            if version>='0.5':
-                try:
-                    self.items=cPickle.load(f)
-                except:
-                    pass
-            if version>='0.8':
-                try:
-                    self.views[0].load(f)
-                except:
-                    pass
-            if version<'0.7':
-                print 'Updating legacy collection'
-                self.items=[update_legacy_item(i,self.image_dirs[0]) for i in self.items]
-                print 'Update complete'
+            self.store=itemstore.ItemStore(col_dir)
+            if not self.store.exists() and os.path.exists(self.data_file()):
+                return self._migrate_data_file()
+            self.items=self.store.load()
+            print 'Loaded collection %s (%i items, %i log records)'%(self.name,len(self.items),self.store.log_records)
+            self.dir_state=self.store.load_dirs()
+            try:
+                self.store.load_view(self.views[0])
+            except:
+                pass
             self.numselected=0
-            for i in self.items: #todo: this could be cached as well
-                self.index.add(i)
+            self.init_index()
+            self.open_thumb_store()
+            self.schedule_checkpoint()
             return True
         except:
             import traceback,sys
@@ -568,14 +584,95 @@ class Collection(baseobjects.CollectionBase):
             self.empty()
             return False
 
+    def _migrate_data_file(self):
+        '''
+        load the collection from the binary pickle file used by older versions and convert it to an item store
+        '''
+        f=open(self.data_file(),'rb')
+        version=cPickle.load(f)
+        print 'Loaded collection %s (version %s)'%(self.name,version,)
+        if version>='0.5':
+            try:
+                self.items=cPickle.load(f)
+            except:
+                pass
+        if version>='0.8':
+            try:
+                self.views[0].load(f)
+            except:
+                pass
+        f.close()
+        if version<'0.7':
+            print 'Updating legacy collection'
+            self.items=[update_legacy_item(i,self.image_dirs[0]) for i in self.items]
+            print 'Update complete'
+        print 'Migrating collection %s to the log structured item store'%(self.name,)
+        self.store.create(self.items)
+        if self.views[0].loaded:
+            self.store.save_view(self.views[0])
+        os.rename(self.data_file(),self.data_file()+'.bak')
+        self.numselected=0
+        self.init_index()
+        self.open_thumb_store()
+        self.schedule_checkpoint()
+        return True
+
+    def init_index(self):
+        '''
+        defer loading the metadata index until it is first used. the saved index is used
+        if it matches the state of the item store at open, otherwise it is rebuilt
+        '''
+        self.index_stamp=self.store.stamp()
+        self.index.defer(self._load_index)
+        self.text_index.reset()
+        self.geo_index.reset()
+        self.sort_columns.reset()
+        self.change_count+=1
+
+    def _load_index(self,index):
+        try:
+            if self.store is not None and self.store.load_index(index,self.items,self.index_stamp):
+                return
+        except:
+            import traceback,sys
+            tb_text=traceback.format_exc(sys.exc_info()[2])
+            print "Error Loading Metadata Index",self.name
+            print tb_text
+        print 'Rebuilding metadata index for collection',self.name
+        index.rebuild(self.items)
+
+    def open_thumb_store(self):
+        if not self.pack_thumbnails:
+            return
+        try:
+            self.thumb_store=thumbstore.ThumbStore(os.path.join(settings.collections_dir,self.name))
+            self.thumb_store.open()
+        except:
+            import traceback,sys
+            tb_text=traceback.format_exc(sys.exc_info()[2])
+            print "Error Opening Thumbnail Pack",self.name
+            print tb_text
+            self.thumb_store=None
+
+    def close_thumb_store(self):
+        'save the thumbnail index, first dropping thumbnails of removed items if the pack has a lot of dead space'
+        if self.thumb_store is None:
+            return
+        if self.thumb_store.needs_compaction():
+            self.thumb_store.compact(set([item.uid for item in self.items]))
+        self.thumb_store.close()
+        self.thumb_store=None
+
     def close(self):
         '''
-        save the collection to a binary pickle file using the filename attribute of the collection
+        append any unsaved changes to the item store log (compacting the log into a new snapshot if it has grown large)
+        and save the active view
         '''
         if not self.is_open:
             return True
         if not self.persistent:
             return True
+        self.cancel_checkpoint()
         try:
             col_dir=os.path.join(settings.collections_dir,self.name)
             if os.path.isfile(col_dir):
@@ -583,11 +680,20 @@ class Collection(baseobjects.CollectionBase):
             if not os.path.exists(col_dir):
                 os.makedirs(col_dir)
             #self.save_prefs()
-            f=open(self.data_file(),'wb')
-            cPickle.dump(__version__,f,-1)
-            cPickle.dump(self.items,f,-1)
-            self.get_active_view().save(f)
-            f.close()
+            if self.store is None:
+                self.store=itemstore.ItemStore(col_dir)
+                self.store.create(self.items)
+            elif self.store.is_compacting():
+                self.store.compact(self.get_all_items())
+            self.store.flush()
+            if self.store.needs_compaction(len(self.items)):
+                self.store.compact(self.get_all_items())
+            self.store.save_view(self.get_active_view())
+            if not self.index.is_deferred() or self.store.stamp()!=self.index_stamp:
+                self.store.save_index(self.index)
+            self.store.save_dirs(self.dir_state)
+            self.store=None
+            self.close_thumb_store()
             self.empty()
         except:
             import traceback,sys
@@ -597,6 +703,38 @@ class Collection(baseobjects.CollectionBase):
             return False
         return True
 
+    def schedule_checkpoint(self):
+        '''
+        queue a job on the worker thread to append changed items to the store after the checkpoint interval
+        '''
+        if self.worker is None or not self.persistent:
+            return
+        self.cancel_checkpoint()
+        self.checkpoint_timer=threading.Timer(settings.collection_checkpoint_interval,self._queue_checkpoint)
+        self.checkpoint_timer.setDaemon(True)
+        self.checkpoint_timer.start()
+
+    def cancel_checkpoint(self):
+        if self.checkpoint_timer is not None:
+            self.checkpoint_timer.cancel()
+            self.checkpoint_timer=None
+
+    def _queue_checkpoint(self):
+        self.checkpoint_timer=None
+        if not self.worker.jobs.has_job(backend.CheckpointCollectionJob,self):
+            self.worker.queue_job_instance(backend.CheckpointCollectionJob(self.worker,self,self.browser))
+
+    def update_dir_state(self,state):
+        '''
+        record the signatures of scanned directories (a signature of None forgets the directory,
+        so that its files are checked by the next scan)
+        '''
+        for reldir,signature in state.iteritems():
+            if signature is None:
+                self.dir_state.pop(reldir,None)
+            else:
+                self.dir_state[reldir]=signature
+
     def rescan(self,thead_manager):
         sj=backend.WalkDirectoryJob(thead_manager,self,self.browser)
         thead_manager.queue_job_instance(sj)
@@ -620,8 +758,8 @@ class Collection(baseobjects.CollectionBase):
             self.monitor.stop()
             self.monitor=None
 
-    def monitor_callback(self,path,action,is_dir):
-        self.monitor_master_callback(self,path,action,is_dir)
+    def monitor_callback(self,path,action,is_dir,cookie=None):
+        self.monitor_master_callback(self,path,action,is_dir,cookie)
 
 
 
@@ -640,12 +778,17 @@ class Collection(baseobjects.CollectionBase):
                 raise LookupError
             self.items.insert(ind,item)
             self.numselected+=item.selected
+            if self.store:
+                self.store.mark_dirty(item)
             pluginmanager.mgr.callback_collection('t_collection_item_added',self,item)
             if add_to_view:
                 for v in self.views:
                     v.add_item(item)
             if self.index:
                 self.index.add(item)
+            self.text_index.add(item)
+            self.geo_index.add(item)
+            self.change_count+=1
             return True
         except LookupError:
             print 'WARNING: tried to add',item,ind,'to collection',self.id,'but an item with this id was already present'
@@ -665,14 +808,37 @@ class Collection(baseobjects.CollectionBase):
             item=self.items[i]
             self.numselected-=item.selected
             self.items.pop(i)
+            if self.store:
+                self.store.mark_deleted(item)
             pluginmanager.mgr.callback_collection('t_collection_item_removed',self,item)
             for v in self.views:
                 v.del_item(item)
             if self.index:
                 self.index.remove(item)
+            self.text_index.remove(item)
+            self.geo_index.remove(item)
+            self.sort_columns.remove(item)
+            self.change_count+=1
             return item
         return None
 
+    def rename_item(self,item,uid):
+        '''
+        give item a new uid after its file has been renamed or moved, keeping its metadata and thumbnail
+        (an existing item with the new uid is replaced). returns the renamed item or None if item is not in the collection
+        '''
+        old=self.delete(item)
+        if old is None:
+            return None
+        self.delete(uid)
+        new_item=baseobjects.Item(uid)
+        new_item.__dict__.update(old.__dict__)
+        new_item.uid=uid
+        if self.thumb_store:
+            self.thumb_store.rename(old.uid,uid)
+        self.add(new_item)
+        return new_item
+
     def find(self,item):
         '''
         find an item in the collection and return its index
@@ -684,6 +850,20 @@ class Collection(baseobjects.CollectionBase):
             return i
         return -1
 
+    def missing_items(self,items):
+        '''
+        returns the items in the sorted list items that are not in the collection
+        the items are merged with the collection in a single pass (each search starts from the previous match)
+        '''
+        missing=[]
+        coll_items=self.items
+        i=0
+        for item in items:
+            i=bisect.bisect_left(coll_items,item,i)
+            if i>=len(coll_items) or coll_items[i]!=item:
+                missing.append(item)
+        return missing
+
     def get_mtime(self,item):
         return io.get_mtime(self.get_path(item))
 
@@ -712,7 +892,12 @@ class Collection(baseobjects.CollectionBase):
 
     def empty(self,empty_views=True):
         del self.items[:]
+        self.dir_state={}
         self.numselected=0
+        self.text_index.reset()
+        self.geo_index.reset()
+        self.sort_columns.reset()
+        self.change_count+=1
         if empty_views:
             for v in self.views:
                 v.empty()
@@ -870,20 +1055,55 @@ class Collection(baseobjects.CollectionBase):
         if fast_only and not item.thumburi and self.load_embedded_thumbs:
             if imagemanip.load_embedded_thumb(item,self):
                 return True
+        if self.thumb_store:
+            return self._load_packed_thumbnails([item])[0]
         return imagemanip.load_thumb(item,self,self.thumbnail_cache_dir)
+    def load_thumbnails(self,items,fast_only=True):
+        'load the thumbnails for a list of items, returns a list of True/False for each item indicating success'
+        if not self.thumb_store or self.load_preview_icons or self.load_embedded_thumbs:
+            return baseobjects.CollectionBase.load_thumbnails(self,items,fast_only)
+        return self._load_packed_thumbnails(items)
+    def _load_packed_thumbnails(self,items):
+        results=[]
+        for item,thumb_data in zip(items,self.thumb_store.get_many([(item.uid,item.mtime) for item in items])):
+            if thumb_data is None or item.thumb==False:
+                results.append(False)
+                continue
+            try:
+                item.thumb=imagemanip.thumb_data_to_pixbuf(thumb_data)
+            except:
+                print 'Error creating thumbnail for',item.uid,'from thumbnail pack'
+                results.append(False)
+                continue
+            imagemanip.cache_thumb_in_memory(item)
+            results.append(True)
+        return results
     def has_thumbnail(self,item):
+        if self.thumb_store:
+            return self.thumb_store.has(item.uid,item.mtime)
         return imagemanip.has_thumb(item,self,self.thumbnail_cache_dir)
-    def make_thumbnail(self,item,interrupt_fn=None,force=False):
-        'create a cached thumbnail of the image'
+    def make_thumbnail(self,item,interrupt_fn=None,force=False,preloaded=None):
+        '''
+        create a cached thumbnail of the image
+        preloaded - thumbnail data decoded by the thumbnail process pool (see thumbpool.make_thumb_data)
+        '''
         if not force and (self.load_embedded_thumbs or self.load_preview_icons):
             return False
-        imagemanip.make_thumb(item,self,interrupt_fn,force,self.thumbnail_cache_dir,write_to_cache = self.store_thumbnails)
+        if self.thumb_store:
+            if imagemanip.make_thumb(item,self,interrupt_fn,force,write_to_cache=False,preloaded=preloaded) and self.store_thumbnails:
+                self.thumb_store.put(item.uid,item.mtime,imagemanip.pixbuf_to_thumb_data(item.thumb))
+        else:
+            imagemanip.make_thumb(item,self,interrupt_fn,force,self.thumbnail_cache_dir,write_to_cache = self.store_thumbnails,preloaded=preloaded)
+        if self.store:
+            self.store.mark_dirty(item)
 ## TODO: Why was the update_thumb_date call here??? Maybe a FAT issue?
 ##        imagemanip.update_thumb_date(item,cache=self.thumbnail_cache_dir)
         return
     def delete_thumbnail(self,item):
         'clear out the thumbnail and delete the file from the users gnome desktop cache'
         imagemanip.delete_thumb(item)
+        if self.thumb_store:
+            self.thumb_store.remove(item.uid)
     def rotate_thumbnail(self,item,right=True,interrupt_fn=None):
         '''
         rotates thumbnail of item 90 degrees right (clockwise) or left (anti-clockwise)
@@ -892,6 +1112,14 @@ class Collection(baseobjects.CollectionBase):
         '''
         if item.thumb==False:
             return False
+        if self.thumb_store:
+            if not item.thumb and not self.load_thumbnail(item):
+                return False
+            rotation=gtk.gdk.PIXBUF_ROTATE_CLOCKWISE if right else gtk.gdk.PIXBUF_ROTATE_COUNTERCLOCKWISE
+            item.thumb=item.thumb.rotate_simple(rotation)
+            imagemanip.cache_thumb_in_memory(item)
+            self.thumb_store.put(item.uid,item.mtime,imagemanip.pixbuf_to_thumb_data(item.thumb))
+            return True
         thumb_pb=imagemanip.rotate_thumb(item,right,interrupt_fn)
         if not thumb_pb:
             return  False
@@ -906,32 +1134,66 @@ class Collection(baseobjects.CollectionBase):
             if not os.path.exists(cache):
                 os.makedirs(cache)
             item.thumb.save(item.thumburi,"png")
+        if self.store:
+            self.store.mark_dirty(item)
         return True
 
     def item_metadata_update(self,item,old_metadata):
         'collection will receive this call when item metadata has been changed'
         if self.index:
             self.index.update(item,old_metadata)
-    def load_metadata(self,item,missing_only=False,notify_plugins=True):
-        'retrieve metadata for an item from the source'
+        self.text_index.update(item,old_metadata)
+        self.geo_index.update(item,old_metadata)
+        self.sort_columns.invalidate(item)
+        self.change_count+=1
+        if self.store:
+            self.store.mark_dirty(item)
+    def items_metadata_update(self,changes):
+        'collection will receive this call when the metadata of a batch of items has been changed'
+        for item,old_metadata in changes:
+            if self.index:
+                self.index.update(item,old_metadata)
+            self.text_index.update(item,old_metadata)
+            self.geo_index.update(item,old_metadata)
+            self.sort_columns.invalidate(item)
+            if self.store:
+                self.store.mark_dirty(item)
+        self.change_count+=1
+    def load_metadata(self,item,missing_only=False,notify_plugins=True,preloaded=None):
+        'retrieve metadata for an item from the source (or from the result of metadata.read_metadata in preloaded)'
+        old_meta=item.meta.copy() if item.meta is not None else None
         if self.load_embedded_thumbs:
             result=imagemanip.load_metadata(item,collection=self,filename=self.get_path(item),
                 get_thumbnail=True,missing_only=missing_only,check_for_sidecar=self.use_sidecars,
-                notify_plugins=notify_plugins)
+                notify_plugins=notify_plugins,preloaded=preloaded)
         else:
             result=imagemanip.load_metadata(item,collection=self,filename=self.get_path(item),
                 get_thumbnail=False,missing_only=missing_only,check_for_sidecar=self.use_sidecars,
-                notify_plugins=notify_plugins)
+                notify_plugins=notify_plugins,preloaded=preloaded)
         if self.load_embedded_thumbs and not item.thumb:
             item.thumb=False
+        if item.meta!=old_meta:
+            self.text_index.update(item,old_meta)
+            self.geo_index.update(item,old_meta)
+            self.sort_columns.invalidate(item)
+        self.change_count+=1
+        if self.store:
+            self.store.mark_dirty(item)
+        return result
+    def write_metadata(self,item,written=None):
+        'write metadata for an item to the source (or apply the result of writing it in the metadata process pool in written)'
+        result=imagemanip.save_metadata(item,self,cache=self.thumbnail_cache_dir,sidecar_on_failure=self.use_sidecars,written=written)
+        self.change_count+=1 #saving changes the result of the changed and mdate filters
+        if self.store:
+            self.store.mark_dirty(item)
         return result
-    def write_metadata(self,item):
-        'write metadata for an item to the source'
-        return imagemanip.save_metadata(item,self,cache=self.thumbnail_cache_dir,sidecar_on_failure=self.use_sidecars)
     def load_image(self,item,interrupt_fn=None,size_bound=None,apply_transforms=True):
-        'load the fullsize image, up to maximum size given by the (width, height) tuple in size_bound'
-        draft_mode=False
-        return imagemanip.load_image(item,self,interrupt_fn,draft_mode,apply_transforms=apply_transforms)
+        '''
+        load the fullsize image. if a (width, height) tuple is given in size_bound JPEGs are
+        decoded at the smallest reduced scale that covers it (see imagemanip.load_image)
+        '''
+        draft_mode=size_bound is not None
+        return imagemanip.load_image(item,self,interrupt_fn,draft_mode,apply_transforms=apply_transforms,draft_size=size_bound)
     def get_file_stream(self,item):
         'return a stream read the entire photo file from the source (as binary stream)'
         return open(self.get_path(item),'rb')
@@ -236,8 +236,8 @@ class LocalStoreDB(baseobjects.CollectionBase):
             self.monitor.stop()
             self.monitor=None
 
-    def monitor_callback(self,path,action,is_dir):
-        self.monitor_master_callback(self,path,action,is_dir)
+    def monitor_callback(self,path,action,is_dir,cookie=None):
+        self.monitor_master_callback(self,path,action,is_dir,cookie)
 
 
 class LocalStoreDBView(baseobjects.ViewBase):
@@ -1,10 +1,14 @@
 from picty import baseobjects, viewsupport, pluginmanager, simple_parser as sp
 import bisect
+import collections
 import cPickle
 
 class SimpleView(baseobjects.ViewBase):
+    QUERY_CACHE_SIZE=5 #number of recent search results kept
     def __init__(self,key_cb=viewsupport.get_mtime,items=[],collection=None):
         self.items=[]
+        self.item_keys={} #item -> the key it was added to the view with
+        self.query_cache=collections.OrderedDict() #(filter expression,sort key) -> (collection change count,items)
         for item in items:
             self.add(key_cb(item),item)
         self.key_cb=key_cb
@@ -13,7 +17,9 @@ class SimpleView(baseobjects.ViewBase):
             if cb==key_cb:
                 self.sort_key_text=text
         self.filter_tree=None
+        self.filter_fn=None
         self.filter_text=''
+        self.built_filter=None
         self.reverse=False
         self.collection=collection
         self.loaded=False
@@ -31,6 +37,7 @@ class SimpleView(baseobjects.ViewBase):
         items,self.filter_text,self.reverse,self.sort_key_text = cPickle.load(file_handle)
         self.set_cb()
         self.items = [[key, self.collection[self.collection.find(uid)] ] for (key,uid) in items]
+        self.item_keys = dict((item,key) for (key,item) in self.items)
         self.loaded=True
     def save(self,file_handle):
         '''
@@ -44,19 +51,30 @@ class SimpleView(baseobjects.ViewBase):
         dup=SimpleView(self.key_cb,[],self.collection)
         dup.sort_key_text=self.sort_key_text
         dup.filter_tree=self.filter_tree
+        dup.filter_fn=self.filter_fn
         dup.filter_text=self.filter_text
         dup.reverse=self.reverse
         dup.items[:]=self.items[:]
+        dup.item_keys=self.item_keys.copy()
         return dup
     def set_filter(self,expr):
         self.filter_tree=sp.parse_expr(viewsupport.TOKENS[:],expr,viewsupport.literal_converter)
+        self.filter_fn=sp.compile_tree(bool,self.filter_tree,viewsupport.search_converter(self.collection))
     def clear_filter(self,expr):
         self.filter_tree=None
+        self.filter_fn=None
+    def filter_items(self,items):
+        if self.filter_fn is None:
+            return list(items)
+        return sp.filter_items(self.filter_fn,items)
     def add(self,key,item,apply_filter=True):
-        if apply_filter and self.filter_tree:
-            if not sp.call_tree(bool,self.filter_tree,viewsupport.converter,item):
+        if item in self.item_keys:
+            return False
+        if apply_filter and self.filter_fn:
+            if not self.filter_fn(item):
                 return False
         bisect.insort(self.items,[key,item])
+        self.item_keys[item]=key
         return True
     def remove(self,key,item):
         ind=bisect.bisect_left(self.items,[key,item])
@@ -64,13 +82,72 @@ class SimpleView(baseobjects.ViewBase):
         if key==i[0]:
             if item==i[1]:
                 list.pop(self.items,ind)
+                self.item_keys.pop(item,None)
                 return
             raise KeyError
+    def sort_columns(self):
+        '''
+        returns the collection's store of precomputed sort keys if it has one for the current sort key
+        '''
+        columns=getattr(self.collection,'sort_columns',None)
+        if columns is not None and self.collection.browser_sort_keys.get(self.sort_key_text)==self.key_cb:
+            return columns
+    def item_key(self,item):
+        columns=self.sort_columns()
+        if columns is not None:
+            return columns.key(self.sort_key_text,item)
+        return self.key_cb(item)
+    def keys_for(self,items):
+        columns=self.sort_columns()
+        if columns is not None:
+            return columns.keys(self.sort_key_text,items)
+        return [self.key_cb(item) for item in items]
+    def add_items(self,items,keys=None):
+        if keys is None:
+            keys=self.keys_for(items)
+        ##the new items are appended and sorted as a run, the sort then merges them with the (sorted) items in the view
+        ##(items already in the view, e.g. added to the collection while the view was being built, are skipped)
+        item_keys=self.item_keys
+        pairs=[[key,item] for key,item in zip(keys,items) if item not in item_keys]
+        pairs.sort()
+        self.items.extend(pairs)
+        self.items.sort()
+        item_keys.update((item,key) for key,item in pairs)
+    def cache_query(self,expr):
+        change_count=getattr(self.collection,'change_count',None)
+        if change_count is None or not viewsupport.cacheable_query(expr) or self.sort_key_text not in viewsupport.cached_sort_keys:
+            return
+        key=(expr,self.sort_key_text)
+        self.query_cache.pop(key,None)
+        self.query_cache[key]=(change_count,list(self.items))
+        while len(self.query_cache)>self.QUERY_CACHE_SIZE:
+            self.query_cache.popitem(last=False)
+    def restore_query(self,expr):
+        key=(expr,self.sort_key_text)
+        entry=self.query_cache.pop(key,None)
+        if entry is None or entry[0]!=getattr(self.collection,'change_count',None):
+            return False
+        self.query_cache[key]=entry
+        self.items=list(entry[1])
+        self.item_keys=dict((item,key) for key,item in self.items)
+        return True
+    def resort(self,sort_key_text):
+        self.sort_key_text=sort_key_text
+        self.set_cb()
+        items=[i[1] for i in self.items]
+        keys=self.keys_for(items)
+        self.items=[[key,item] for key,item in zip(keys,items)]
+        self.items.sort()
+        self.item_keys=dict(zip(items,keys))
+        return True
     def add_item(self,item,apply_filter=True):
-        if self.add(self.key_cb(item),item,apply_filter):
+        if self.add(self.item_key(item),item,apply_filter):
             pluginmanager.mgr.callback_collection('t_collection_item_added_to_view',self.collection,self,item)
     def find_item(self,item):
-        i=bisect.bisect_left(self.items,[self.key_cb(item),item])
+        ##use the key the item was added with (the item's metadata may have changed since)
+        if item not in self.item_keys:
+            return -1
+        i=bisect.bisect_left(self.items,[self.item_keys[item],item])
         if i>=len(self) or i<0:
             return -1
         if self.items[i][1]==item:
@@ -79,12 +156,10 @@ class SimpleView(baseobjects.ViewBase):
     def del_ind(self,ind):
         ##todo: check ind is in the required range
         if self.reverse:
-            i=len(self.items)-1-ind
-            pluginmanager.mgr.callback_collection('t_collection_item_removed_from_view',self.collection,self,self.items[i][1])
-            del self.items[i]
-        else:
-            pluginmanager.mgr.callback_collection('t_collection_item_removed_from_view',self.collection,self,self.items[ind][1])
-            del self.items[ind]
+            ind=len(self.items)-1-ind
+        pluginmanager.mgr.callback_collection('t_collection_item_removed_from_view',self.collection,self,self.items[ind][1])
+        self.item_keys.pop(self.items[ind][1],None)
+        del self.items[ind]
     def del_item(self,item):
         ind=self.find_item(item)
         if ind>=0:
@@ -111,6 +186,7 @@ class SimpleView(baseobjects.ViewBase):
         return [i[1] for i in self.items if i[1].selected]
     def empty(self):
         del self.items[:]
+        self.item_keys.clear()
 
 
 baseobjects.register_view('SIMPLEVIEW',SimpleView)
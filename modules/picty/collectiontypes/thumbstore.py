@@ -0,0 +1,326 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Packed storage for the thumbnails of a collection
+
+Instead of one image file per thumbnail, the thumbnails are appended to a single file that is
+memory mapped for reading. The store consists of two files in the collection directory:
+    thumbs.pack -- a sequence of records, each a 4 byte length, a pickled header (uid, mtime, has_alpha,
+                   width, height, rowstride, compressed length) and the zlib compressed pixel data
+    thumbs.index -- header (version, pack length) followed by the pickled dictionary of
+                    uid -> (mtime, offset, header length, data length, has_alpha, width, height, rowstride)
+The index is saved when the store is flushed or closed. Records appended to the pack after the
+index was last saved are recovered by scanning the end of the pack when the store is opened.
+'''
+
+__version__='1.0'
+
+import os
+import os.path
+import cPickle
+import mmap
+import struct
+import threading
+import zlib
+
+PACK_FILE='thumbs.pack'
+INDEX_FILE='thumbs.index'
+
+COMPRESSION_LEVEL=1 #zlib level -- thumbnails are small, so favour speed over size
+COMPACT_MIN_BYTES=8*1024*1024 #the pack is never compacted before it has this many bytes of dead records
+
+_len_struct=struct.Struct('<I')
+
+
+def _fsync(f):
+    f.flush()
+    try:
+        os.fsync(f.fileno())
+    except (OSError,AttributeError):
+        pass
+
+def _replace(src,dest):
+    ##os.rename won't overwrite an existing file on windows
+    if os.name=='nt' and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(src,dest)
+
+
+class ThumbStore:
+    '''
+    Stores the thumbnails of a collection in a single memory mapped pack file. Thumbnails are
+    keyed by the item's uid and are only returned if the mtime matches the one they were stored with.
+    Thumbnails are stored and returned as (has_alpha,width,height,rowstride,pixels) tuples
+    (the arguments needed to create a gdk pixbuf, see imagemanip.pixbuf_to_thumb_data)
+    '''
+    def __init__(self,coll_dir):
+        self.coll_dir=coll_dir
+        self.index={}
+        self.dead_bytes=0
+        self.pack=None
+        self.map=None
+        self.map_size=0
+        self.pack_size=0
+        self.index_size=0 #the length of the pack when the index was last saved
+        self.lock=threading.Lock()
+
+    def pack_file(self):
+        return os.path.join(self.coll_dir,PACK_FILE)
+
+    def index_file(self):
+        return os.path.join(self.coll_dir,INDEX_FILE)
+
+    ''' ************************************************************************
+                            OPENING AND CLOSING
+        ************************************************************************'''
+
+    def open(self):
+        if not os.path.exists(self.coll_dir):
+            os.makedirs(self.coll_dir)
+        self.index={}
+        self.index_size=0
+        self.dead_bytes=0
+        if os.path.exists(self.index_file()):
+            try:
+                f=open(self.index_file(),'rb')
+                try:
+                    version,self.index_size=cPickle.load(f)
+                    self.index=cPickle.load(f)
+                finally:
+                    f.close()
+            except:
+                print 'Discarding corrupt thumbnail index',self.index_file()
+                self.index={}
+                self.index_size=0
+        self.pack=open(self.pack_file(),'a+b')
+        self.pack.seek(0,2)
+        self.pack_size=self.pack.tell()
+        if self.index_size>self.pack_size:
+            print 'Thumbnail index',self.index_file(),'does not match the pack, rebuilding'
+            self.index={}
+            self.index_size=0
+        live_bytes=sum([e[2]+e[3] for e in self.index.itervalues()])
+        self.dead_bytes=self.index_size-live_bytes
+        if self.index_size<self.pack_size:
+            self._recover(self.index_size)
+        self._remap()
+
+    def _recover(self,pos):
+        '''
+        add the records in the pack from pos to the end to the index (they were written
+        after the index was last saved). a partially written record at the end is discarded
+        '''
+        f=open(self.pack_file(),'rb')
+        try:
+            f.seek(pos)
+            while pos<self.pack_size:
+                try:
+                    header_len=_len_struct.unpack(f.read(_len_struct.size))[0]
+                    uid,mtime,has_alpha,width,height,rowstride,data_len=cPickle.loads(f.read(header_len))
+                except:
+                    break
+                record_len=_len_struct.size+header_len
+                if pos+record_len+data_len>self.pack_size:
+                    break
+                f.seek(data_len,1)
+                self._set_entry(uid,(mtime,pos,record_len,data_len,has_alpha,width,height,rowstride))
+                pos+=record_len+data_len
+        finally:
+            f.close()
+        if pos<self.pack_size:
+            print 'Discarding truncated record at the end of thumbnail pack',self.pack_file()
+            self.pack.truncate(pos)
+            self.pack_size=pos
+
+    def _remap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map=None
+        self.map_size=self.pack_size
+        if self.pack_size>0:
+            self.map=mmap.mmap(self.pack.fileno(),self.pack_size,access=mmap.ACCESS_READ)
+
+    def flush(self):
+        'save the index (the records themselves are written to the pack when they are added)'
+        self.lock.acquire()
+        try:
+            if self.pack is None or self.index_size==self.pack_size:
+                return
+            _fsync(self.pack)
+            tmp_file=self.index_file()+'.tmp'
+            f=open(tmp_file,'wb')
+            cPickle.dump((__version__,self.pack_size),f,-1)
+            cPickle.dump(self.index,f,-1)
+            _fsync(f)
+            f.close()
+            _replace(tmp_file,self.index_file())
+            self.index_size=self.pack_size
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.flush()
+        self.lock.acquire()
+        if self.map is not None:
+            self.map.close()
+            self.map=None
+        if self.pack is not None:
+            self.pack.close()
+            self.pack=None
+        self.lock.release()
+
+    ''' ************************************************************************
+                            READING AND WRITING THUMBNAILS
+        ************************************************************************'''
+
+    def _set_entry(self,uid,entry):
+        if uid in self.index:
+            old=self.index[uid]
+            self.dead_bytes+=old[2]+old[3]
+        self.index[uid]=entry
+
+    def has(self,uid,mtime):
+        entry=self.index.get(uid)
+        return entry is not None and entry[0]==int(mtime)
+
+    def put(self,uid,mtime,thumb_data):
+        '''
+        append the thumbnail (a (has_alpha,width,height,rowstride,pixels) tuple) for the item with uid
+        and mtime, replacing any existing thumbnail for the item
+        '''
+        has_alpha,width,height,rowstride,pixels=thumb_data
+        data=zlib.compress(pixels,COMPRESSION_LEVEL)
+        mtime=int(mtime)
+        header=cPickle.dumps((uid,mtime,has_alpha,width,height,rowstride,len(data)),-1)
+        self.lock.acquire()
+        try:
+            pos=self.pack_size
+            self.pack.seek(pos)
+            self.pack.write(_len_struct.pack(len(header)))
+            self.pack.write(header)
+            self.pack.write(data)
+            self.pack.flush()
+            record_len=_len_struct.size+len(header)
+            self.pack_size=pos+record_len+len(data)
+            self._set_entry(uid,(mtime,pos,record_len,len(data),has_alpha,width,height,rowstride))
+        finally:
+            self.lock.release()
+
+    def remove(self,uid):
+        self.lock.acquire()
+        if uid in self.index:
+            old=self.index.pop(uid)
+            self.dead_bytes+=old[2]+old[3]
+        self.lock.release()
+
+    def rename(self,uid,new_uid):
+        'store the thumbnail of the item with uid under new_uid (e.g. after the file is renamed)'
+        self.lock.acquire()
+        if uid in self.index:
+            self._set_entry(new_uid,self.index.pop(uid))
+        self.lock.release()
+
+    def get(self,uid,mtime):
+        return self.get_many([(uid,mtime)])[0]
+
+    def get_many(self,keys):
+        '''
+        returns a list containing the thumbnail data (or None if not available) for each (uid,mtime) in keys
+        the records are read from the pack in the order they are stored so that a batch of thumbnails
+        that were created together is read sequentially
+        '''
+        results=[None]*len(keys)
+        self.lock.acquire()
+        try:
+            if self.pack is None:
+                return results
+            if self.map_size<self.pack_size:
+                self.pack.flush()
+                self._remap()
+            wanted=[]
+            for i in range(len(keys)):
+                uid,mtime=keys[i]
+                entry=self.index.get(uid)
+                if entry is not None and entry[0]==int(mtime):
+                    wanted.append((entry[1],i,entry))
+            wanted.sort()
+            for pos,i,entry in wanted:
+                mtime,pos,record_len,data_len,has_alpha,width,height,rowstride=entry
+                start=pos+record_len
+                try:
+                    pixels=zlib.decompress(self.map[start:start+data_len])
+                except zlib.error:
+                    print 'Error reading thumbnail for',keys[i][0],'from',self.pack_file()
+                    continue
+                results[i]=(has_alpha,width,height,rowstride,pixels)
+        finally:
+            self.lock.release()
+        return results
+
+    ''' ************************************************************************
+                            COMPACTION
+        ************************************************************************'''
+
+    def needs_compaction(self,ratio=0.5):
+        return self.dead_bytes>=max(COMPACT_MIN_BYTES,ratio*self.pack_size)
+
+    def compact(self,live_uids=None):
+        '''
+        rewrite the pack keeping only the current thumbnail of each item
+        (and only items whose uid is in live_uids, if specified)
+        '''
+        self.lock.acquire()
+        try:
+            if self.pack is None:
+                return
+            if self.map_size<self.pack_size:
+                self.pack.flush()
+                self._remap()
+            entries=sorted([(e[1],uid,e) for uid,e in self.index.iteritems() if live_uids is None or uid in live_uids])
+            tmp_file=self.pack_file()+'.tmp'
+            f=open(tmp_file,'wb')
+            index={}
+            pos=0
+            for old_pos,uid,entry in entries:
+                mtime,old_pos,record_len,data_len,has_alpha,width,height,rowstride=entry
+                f.write(self.map[old_pos:old_pos+record_len+data_len])
+                index[uid]=(mtime,pos,record_len,data_len,has_alpha,width,height,rowstride)
+                pos+=record_len+data_len
+            _fsync(f)
+            f.close()
+            if self.map is not None:
+                self.map.close()
+                self.map=None
+            self.pack.close()
+            ##the old index can't describe the new pack, so remove it before the pack is replaced
+            if os.path.exists(self.index_file()):
+                os.remove(self.index_file())
+            _replace(tmp_file,self.pack_file())
+            self.pack=open(self.pack_file(),'a+b')
+            self.index=index
+            self.pack_size=pos
+            self.index_size=0
+            self.dead_bytes=0
+            self._remap()
+        finally:
+            self.lock.release()
+        self.flush()
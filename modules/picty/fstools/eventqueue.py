@@ -0,0 +1,166 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+eventqueue.py
+
+Coalesces the change notifications from the directory monitor before they are handed to the worker.
+Only the last event for each path is kept (the worker checks the file when it handles the event),
+MOVED_FROM/MOVED_TO pairs with the same cookie become a single RENAME event and the events are flushed
+in batches of at most BATCH_SIZE once the notifications have been quiet for QUIET_DELAY seconds
+(or the oldest pending event has waited MAX_DELAY seconds).
+
+The flush callback receives a list of (collection,path,action,isdir,src) tuples, where action is one of
+CREATE, MODIFY, DELETE, MOVED_FROM, MOVED_TO (a move to or from an unmonitored location) or RENAME
+(src is the original path of a renamed file or directory, None for the other actions)
+'''
+
+##standard imports
+import collections
+import os
+import threading
+import time
+
+QUIET_DELAY=1.0 #seconds without notifications before the pending events are flushed
+MAX_DELAY=5.0 #maximum number of seconds an event waits before it is flushed
+PAIR_TIMEOUT=0.5 #seconds to wait for the MOVED_TO that pairs with a MOVED_FROM
+BATCH_SIZE=500 #maximum number of events passed to the flush callback at once
+
+
+class EventQueue:
+    def __init__(self,flush_cb):
+        self.flush_cb=flush_cb
+        self.events=collections.OrderedDict() #(collection,path) -> [action,isdir,src] in the order the events arrived
+        self.moves={} #(collection,cookie) -> (path,isdir,time) for MOVED_FROM events waiting for their MOVED_TO
+        self.first_time=None
+        self.last_time=None
+        self.timer=None
+        self.lock=threading.Lock()
+
+    def add(self,collection,path,action,isdir,cookie=None):
+        now=time.time()
+        batches=[]
+        self.lock.acquire()
+        try:
+            if action=='MOVED_FROM' and cookie:
+                self.moves[(collection,cookie)]=(path,isdir,now)
+            elif action=='MOVED_TO' and (collection,cookie) in self.moves:
+                src,src_isdir,t=self.moves.pop((collection,cookie))
+                self._rename(collection,src,path,isdir)
+            else:
+                self._put(collection,path,action,isdir)
+            if self.first_time is None:
+                self.first_time=now
+            self.last_time=now
+            if len(self.events)>=BATCH_SIZE:
+                batches=self._take()
+            self._schedule()
+        finally:
+            self.lock.release()
+        for batch in batches:
+            self.flush_cb(batch)
+
+    def _put(self,collection,path,action,isdir):
+        key=(collection,path)
+        old=self.events.pop(key,None)
+        if old is not None and old[0]=='RENAME':
+            if action in ('CREATE','MODIFY'):
+                ##the renamed file is checked for changes when the rename is handled
+                self.events[key]=old
+                return
+            ##the renamed file has gone: remove the item at the original path
+            self.events.pop((collection,old[2]),None)
+            self.events[(collection,old[2])]=['DELETE',isdir,None]
+        self.events[key]=[action,isdir,None]
+
+    def _rename(self,collection,src,dest,isdir):
+        old=self.events.pop((collection,src),None)
+        if old is not None and old[0]=='RENAME':
+            src=old[2] #renamed more than once before the events were flushed
+        self.events.pop((collection,dest),None)
+        if not isdir:
+            self.events[(collection,dest)]=['RENAME',isdir,src]
+            return
+        ##pending events for files in the directory now refer to the new location (and are handled after the rename)
+        prefix=src+os.sep
+        events=collections.OrderedDict()
+        moved=[]
+        for (c,path),event in self.events.iteritems():
+            if c==collection and path.startswith(prefix):
+                moved.append(((c,os.path.join(dest,path[len(prefix):])),event))
+            else:
+                events[(c,path)]=event
+        events[(collection,dest)]=['RENAME',isdir,src]
+        for key,event in moved:
+            events[key]=event
+        self.events=events
+
+    def _take(self):
+        '''
+        removes the pending events and returns them as a list of batches. moves that haven't been
+        paired after PAIR_TIMEOUT are treated as moves out of the monitored directories
+        '''
+        now=time.time()
+        for key,(path,isdir,t) in self.moves.items():
+            if now-t>=PAIR_TIMEOUT:
+                del self.moves[key]
+                self._put(key[0],path,'MOVED_FROM',isdir)
+        events=[(c,path,action,isdir,src) for (c,path),(action,isdir,src) in self.events.iteritems()]
+        self.events=collections.OrderedDict()
+        if self.moves:
+            self.first_time=self.last_time=now
+        else:
+            self.first_time=self.last_time=None
+        return [events[i:i+BATCH_SIZE] for i in range(0,len(events),BATCH_SIZE)]
+
+    def _schedule(self):
+        if self.timer is None and self.first_time is not None:
+            self.timer=threading.Timer(QUIET_DELAY,self._timeout)
+            self.timer.start()
+
+    def _timeout(self):
+        self.lock.acquire()
+        try:
+            self.timer=None
+            if self.first_time is None:
+                return
+            wait=min(self.last_time+QUIET_DELAY,self.first_time+MAX_DELAY)-time.time()
+            if wait>0:
+                self.timer=threading.Timer(wait,self._timeout)
+                self.timer.start()
+                return
+            batches=self._take()
+            self._schedule()
+        finally:
+            self.lock.release()
+        for batch in batches:
+            self.flush_cb(batch)
+
+    def stop(self):
+        'cancel the pending flush (the pending events are discarded)'
+        self.lock.acquire()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer=None
+        self.events=collections.OrderedDict()
+        self.moves={}
+        self.first_time=self.last_time=None
+        self.lock.release()
@@ -8,7 +8,7 @@ if '__version__' in dir(pyinotify) and pyinotify.__version__>='0.8.0':
     mask = (pyinotify.IN_DELETE |
             pyinotify.IN_CREATE |
             pyinotify.IN_DONT_FOLLOW |
-            pyinotify.IN_MODIFY|
+            pyinotify.IN_CLOSE_WRITE|
             pyinotify.IN_MOVED_FROM|
             pyinotify.IN_MOVED_TO)  # watched events
 
@@ -32,15 +32,16 @@ if '__version__' in dir(pyinotify) and pyinotify.__version__>='0.8.0':
                 print 'Error removing watch'
                 import traceback,sys
                 print traceback.format_exc(sys.exc_info()[2])
-        def process_IN_MODIFY(self, event):
+        def process_IN_CLOSE_WRITE(self, event):
+            ##reported once the file has been written and closed, rather than for every write (IN_MODIFY)
             path=os.path.join(event.path, event.name)
             self.cb(path,'MODIFY',event.dir)
         def process_IN_MOVED_FROM(self, event):
             path=os.path.join(event.path, event.name)
-            self.cb(path,'MOVED_FROM',event.dir)
+            self.cb(path,'MOVED_FROM',event.dir,getattr(event,'cookie',None))
         def process_IN_MOVED_TO(self, event):
             path=os.path.join(event.path, event.name)
-            self.cb(path,'MOVED_TO',event.dir)
+            self.cb(path,'MOVED_TO',event.dir,getattr(event,'cookie',None))
         def process_IN_CREATE(self, event):
             path=os.path.join(event.path, event.name)
             self.cb(path,'CREATE',event.dir)
@@ -53,7 +54,7 @@ else:
     mask = (pyinotify.EventsCodes.IN_DELETE |
             pyinotify.EventsCodes.IN_CREATE |
             pyinotify.EventsCodes.IN_DONT_FOLLOW |
-            pyinotify.EventsCodes.IN_MODIFY|
+            pyinotify.EventsCodes.IN_CLOSE_WRITE|
             pyinotify.EventsCodes.IN_MOVED_FROM|
             pyinotify.EventsCodes.IN_MOVED_TO)  # watched events
 
@@ -77,15 +78,16 @@ else:
                 print 'Error removing watch'
                 import traceback,sys
                 print traceback.format_exc(sys.exc_info()[2])
-        def process_IN_MODIFY(self, event):
+        def process_IN_CLOSE_WRITE(self, event):
+            ##reported once the file has been written and closed, rather than for every write (IN_MODIFY)
             path=os.path.join(event.path, event.name)
             self.cb(path,'MODIFY',event.is_dir)
         def process_IN_MOVED_FROM(self, event):
             path=os.path.join(event.path, event.name)
-            self.cb(path,'MOVED_FROM',event.is_dir)
+            self.cb(path,'MOVED_FROM',event.is_dir,getattr(event,'cookie',None))
         def process_IN_MOVED_TO(self, event):
             path=os.path.join(event.path, event.name)
-            self.cb(path,'MOVED_TO',event.is_dir)
+            self.cb(path,'MOVED_TO',event.is_dir,getattr(event,'cookie',None))
         def process_IN_CREATE(self, event):
             path=os.path.join(event.path, event.name)
             self.cb(path,'CREATE',event.is_dir)
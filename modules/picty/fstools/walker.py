@@ -0,0 +1,254 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+walker.py
+
+A directory walker for finding image and video files. Each directory is listed once with scandir
+(when available) so the file type reported by the directory listing is reused instead of
+stat'ing every entry, and files are classified by their extension. Only files with an unknown
+extension have their content type sniffed with io.get_mime_type.
+
+Callers can supply the signature (mtime and entry count) recorded for each directory by an earlier
+scan, and the files in directories whose signature is unchanged are skipped. Without scandir the
+signature is checked before the entries are stat'd, and only the entries that aren't named like media
+files are stat'd to find the sub-directories of an unchanged directory. On network file systems the
+remaining stats can be run in a pool of threads (see settings.stat_threads) to hide the latency.
+'''
+
+##standard imports
+import mimetypes
+import os
+import os.path
+import stat
+import threading
+
+try:
+    scandir=os.scandir
+except AttributeError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir=None
+
+try:
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    ThreadPool=None
+
+##picty imports
+from picty import settings
+from picty.fstools import io
+
+_ext_types={} #lower case extension -> mimetype guessed from the extension (None if unknown)
+
+_stat_pool=None
+_stat_pool_failed=False
+_stat_pool_lock=threading.Lock()
+
+
+def is_media_type(mimetype):
+    mimetype=mimetype.lower()
+    return mimetype.startswith('image') or mimetype.startswith('video')
+
+
+def _ext_type(name):
+    'returns the mimetype guessed from the extension of name (None if it has no extension or it is not recognized)'
+    r=name.rfind('.')
+    if r<=0:
+        return None
+    ext=name[r:].lower()
+    try:
+        return _ext_types[ext]
+    except KeyError:
+        mimetype=_ext_types[ext]=mimetypes.guess_type('x'+ext)[0]
+        return mimetype
+
+
+def is_media_file(name,path):
+    '''
+    returns True if the file name (at path) is an image or video. the type is guessed from
+    the extension, falling back to the content type of the file if the extension is not recognized
+    '''
+    if name.rfind('.')<=0:
+        return False
+    mimetype=_ext_type(name)
+    if mimetype is None:
+        try:
+            mimetype=io.get_mime_type(path)
+        except:
+            return False
+        if not mimetype:
+            return False
+    return is_media_type(mimetype)
+
+
+def get_stat_pool():
+    '''
+    returns the thread pool used to stat files, creating it on first use
+    returns None if settings.stat_threads is 0 or the pool is unavailable
+    '''
+    global _stat_pool,_stat_pool_failed
+    if _stat_pool is not None or _stat_pool_failed:
+        return _stat_pool
+    if ThreadPool is None or settings.stat_threads<=0:
+        _stat_pool_failed=True
+        return None
+    _stat_pool_lock.acquire()
+    try:
+        if _stat_pool is None and not _stat_pool_failed:
+            _stat_pool=ThreadPool(settings.stat_threads)
+    except:
+        print 'Error starting file stat thread pool, files will be stat\'d on the worker thread'
+        import traceback,sys
+        print traceback.format_exc(sys.exc_info()[2])
+        _stat_pool_failed=True
+        _stat_pool=None
+    finally:
+        _stat_pool_lock.release()
+    return _stat_pool
+
+
+def close_stat_pool():
+    global _stat_pool
+    if _stat_pool is not None:
+        _stat_pool.terminate()
+        _stat_pool=None
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def stat_paths(paths):
+    '''
+    returns a list of the os.stat result (or None if the file is missing) for each path in paths
+    the stats are run in the stat thread pool if there is one
+    '''
+    pool=get_stat_pool()
+    if pool is None or len(paths)<2:
+        return [_stat(p) for p in paths]
+    return pool.map(_stat,paths)
+
+
+def dir_signature(path):
+    '''
+    returns a tuple (mtime,entry count) that identifies the contents of the directory at path
+    (adding, removing or renaming an entry changes it) or None if the directory doesn't exist
+    '''
+    try:
+        return (os.stat(path).st_mtime,len(os.listdir(path)))
+    except OSError:
+        return None
+
+
+def _list_scandir(path):
+    dirs=[]
+    files=[]
+    for entry in scandir(path):
+        try:
+            if entry.is_dir():
+                dirs.append((entry.name,entry.is_symlink()))
+            else:
+                files.append((entry.name,entry.path,entry))
+        except OSError:
+            continue
+    return dirs,files,len(dirs)+len(files)
+
+
+def _list_stat(path,names):
+    dirs=[]
+    files=[]
+    paths=[os.path.join(path,name) for name in names]
+    for name,fullpath,st in zip(names,paths,stat_paths(paths)):
+        if st is None:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            dirs.append((name,os.path.islink(fullpath)))
+        else:
+            files.append((name,fullpath,st))
+    return dirs,files
+
+
+def _list_stat_dirs(path,names):
+    '''
+    returns the sub-directories of the directory at path with entries names, stat'ing only the entries that aren't
+    named like image or video files (so a directory named like one is only found when its parent has changed)
+    '''
+    names=[name for name in names if not is_media_type(_ext_type(name) or '')]
+    return _list_stat(path,names)[0]
+
+
+def list_media(path,unchanged=None):
+    '''
+    returns a tuple (dirs,files) for the directory at path: dirs is a list of (name,is_symlink)
+    for the sub-directories and files is a sorted list of (name,mtime) for the image and video files
+    if unchanged(path,signature) returns True (see dir_signature) the files are not checked and files is empty
+    '''
+    mtime=os.stat(path).st_mtime
+    if scandir is not None:
+        dirs,entries,count=_list_scandir(path)
+        if unchanged is not None and unchanged(path,(mtime,count)):
+            return dirs,[]
+    else:
+        names=os.listdir(path)
+        if unchanged is not None and unchanged(path,(mtime,len(names))):
+            return _list_stat_dirs(path,names),[]
+        dirs,entries=_list_stat(path,names)
+    entries=[e for e in entries if is_media_file(e[0],e[1])]
+    if scandir is not None:
+        if get_stat_pool() is None:
+            stats=[]
+            for name,fullpath,entry in entries:
+                try:
+                    stats.append(entry.stat())
+                except OSError:
+                    stats.append(None)
+        else:
+            stats=stat_paths([e[1] for e in entries])
+    else:
+        stats=[e[2] for e in entries]
+    files=[(e[0],int(st.st_mtime)) for e,st in zip(entries,stats) if st is not None]
+    files.sort()
+    return dirs,files
+
+
+def walk(top,unchanged=None):
+    '''
+    walks the directory tree at top, like os.walk, yielding (root,dirs,files) tuples where files is the sorted
+    list of (name,mtime) of the image and video files in root. symbolic links to directories are listed in
+    dirs but not descended into. as with os.walk, the caller may remove names from dirs to prune the walk
+    unchanged is called with the signature of each directory, if it returns True the files in the directory are skipped
+    '''
+    stack=[top]
+    while stack:
+        root=stack.pop()
+        try:
+            dirs,files=list_media(root,unchanged)
+        except OSError:
+            continue
+        links=set([d for d,link in dirs if link])
+        dirs=[d for d,link in dirs]
+        yield root,dirs,files
+        stack+=[os.path.join(root,d) for d in reversed(dirs) if d not in links]
@@ -32,6 +32,7 @@ import os
 import threading
 
 import settings
+import memcache
 import baseobjects
 import pluginmanager
 from fstools import io
@@ -87,9 +88,6 @@ else:
 
 import time
 
-##global ram cache for images and thumbs
-memimages=[]
-memthumbs=[]
 
 
 def rotate_left(item,collection=None):
@@ -132,30 +130,36 @@ def rotate_right(item,collection=None):
         collection.rotate_thumbnail(item,True)
 
 
+def toggled_keywords(tags_kw,tags):
+    '''
+    returns the list of keywords tags_kw with tags removed if all of them are present, otherwise with the missing tags added
+    '''
+    tags_lower=[t.lower() for t in tags]
+    tags_kw_lower=[t.lower() for t in tags_kw]
+    new_tags=list(tags_kw)
+    all_present=reduce(bool.__and__,[t in tags_kw_lower for t in tags_lower],True)
+    if all_present:
+        j=0
+        while j<len(new_tags):
+            if tags_kw_lower[j] in tags_lower:
+                new_tags.pop(j)
+                tags_kw_lower.pop(j)
+            else:
+                j+=1
+    else:
+        for j in range(len(tags)):
+            if tags_lower[j] not in tags_kw_lower:
+                new_tags.append(tags[j])
+    return new_tags
+
 def toggle_tags(item,tags,collection=None):
     try:
-        tags_lower=[t.lower() for t in tags]
         meta=item.meta.copy()
         try:
             tags_kw=meta['Keywords']
         except:
             tags_kw=[]
-        tags_kw_lower=[t.lower() for t in tags_kw]
-        new_tags=list(tags_kw)
-        all_present=reduce(bool.__and__,[t in tags_kw_lower for t in tags_lower],True)
-        if all_present:
-            print 'removing tags',new_tags,tags_kw_lower,tags_lower
-            j=0
-            while j<len(new_tags):
-                if tags_kw_lower[j] in tags_lower:
-                    new_tags.pop(j)
-                    tags_kw_lower.pop(j)
-                else:
-                    j+=1
-        else:
-            for j in range(len(tags)):
-                if tags_lower[j] not in tags_kw_lower:
-                    new_tags.append(tags[j])
+        new_tags=toggled_keywords(tags_kw,tags)
         if len(new_tags)==0:
             try:
                 del meta['Keywords']
@@ -235,7 +239,12 @@ def item_in_region(item,lat0,lon0,lat1,lon1):
             return True
     return False
 
-def load_metadata(item,collection=None,filename=None,get_thumbnail=False,missing_only=False,check_for_sidecar=False,notify_plugins=True):
+def load_metadata(item,collection=None,filename=None,get_thumbnail=False,missing_only=False,check_for_sidecar=False,notify_plugins=True,preloaded=None):
+    '''
+    load the metadata for item from the image file (or sidecar)
+    if `preloaded` is not None it should be a (meta,preview_data) tuple returned by metadata.read_metadata
+    (e.g. from the metadata process pool), which is used instead of reading the file
+    '''
     if item.meta is not None:
         meta=item.meta.copy()
     else:
@@ -244,6 +253,9 @@ def load_metadata(item,collection=None,filename=None,get_thumbnail=False,missing
         if collection is not None:
             filename=collection.get_path(item)
     print 'loading metadata for item',item
+    if preloaded is not None:
+        result=metadata.apply_metadata(item,preloaded,get_thumbnail,missing_only)
+        check_for_sidecar=False
     if check_for_sidecar and 'sidecar' not in item.__dict__:
         p=os.path.splitext(collection.get_path(item))[0]+'.xmp'
         if os.path.exists(p):
@@ -260,7 +272,7 @@ def load_metadata(item,collection=None,filename=None,get_thumbnail=False,missing
         else:
             del item.sidecar
             result=metadata.load_metadata(item,filename,get_thumbnail,missing_only)
-    else:
+    elif preloaded is None:
         result=metadata.load_metadata(item,filename,get_thumbnail,missing_only)
     if result:
 ##PICKLED DICT
@@ -273,13 +285,22 @@ def load_metadata(item,collection=None,filename=None,get_thumbnail=False,missing
     return result
 
 
-def save_metadata(item,collection,cache=None,sidecar_on_failure=True):
+def save_metadata(item,collection,cache=None,sidecar_on_failure=True,written=None):
     '''
     save the writable key values in item.meta to the image (translating picty native keys
     in the `meta` attribute of item to IPTC/XMP/Exif standard keys as necessary)
+    if written is not None it is the (meta,success) result of writing the metadata
+    in the metadata process pool (see metadata.pool.MetadataWriteQueue)
     '''
     fname=collection.get_path(item)
-    if 'sidecar' in item.__dict__:
+    if written is not None:
+        meta,result=written
+        if result and item.is_meta_changed()==True:
+            if item.meta==meta:
+                item.mark_meta_saved()
+            else:
+                item.meta_backup=meta ##the item was edited again while it was being written
+    elif 'sidecar' in item.__dict__:
         if os.path.exists(collection.get_path(item.sidecar)):
             result = metadata.save_sidecar(item,collection.get_path(item.sidecar))
         else:
@@ -368,25 +389,25 @@ def small_pixbuf(pixbuf):
 
 def cache_image(item):
     '''
-    append the item to the list of items with images kept in memory. drops first added thumbs once the max queue length is exceeded (settings.max_memimages)
+    add the item's full size image to the in-memory image cache, releasing the least recently used images
+    if the cache is over budget (see memcache.py)
     '''
-    memimages.append(item)
-    if len(memimages)>settings.max_memimages:
-        olditem=memimages.pop(0)
-        if olditem!=item:
-            olditem.image=None
-            olditem.qview=None
+    memcache.images.add(item)
+
+
+def cache_qview(item):
+    '''
+    add the item's screen sized image to the in-memory cache of screen images
+    '''
+    memcache.qviews.add(item)
 
 
 def cache_thumb_in_memory(item):
     '''
-    append the item to the list of items with thumbs kept in memory. drops first added thumbs once the max queue length is exceeded (settings.max_memthumbs)
+    add the item's thumbnail to the in-memory thumbnail cache, releasing the least recently used thumbnails
+    if the cache is over budget (see memcache.py)
     '''
-    memthumbs.append(item)
-    if len(memthumbs)>settings.max_memthumbs:
-        olditem=memthumbs.pop(0)
-        if olditem!=item:
-            olditem.thumb=None
+    memcache.thumbs.add(item)
 
 
 def get_jpeg_or_png_image_file(item,collection,size,strip_metadata,apply_transforms=False,filename=''):
@@ -608,15 +629,37 @@ class ImageTransformer:
 transformer = ImageTransformer()
 
 
-def load_image(item,collection,interrupt_fn,draft_mode=False,apply_transforms=True,itemfile=None):
+def draft_image(image,size):
+    '''
+    configure a JPEG image opened with PIL (but not yet loaded) to be decoded at the smallest
+    of libjpeg's 1/2, 1/4 or 1/8 scales that is still at least as large as size in both dimensions
+    returns the ratio of the decoded width to the full width (1.0 for other formats or if no scaling is possible)
+    '''
+    if image.format!='JPEG' or not size:
+        return 1.0
+    full_width=image.size[0]
+    try:
+        image.draft(image.mode,size)
+    except:
+        return 1.0
+    return 1.0*image.size[0]/full_width
+
+
+def load_image(item,collection,interrupt_fn,draft_mode=False,apply_transforms=True,itemfile=None,draft_size=None):
     '''
     load a PIL image and store it in item.image
     if transform_handlers are specified and the image has tranforms they will be applied
+    draft_mode - if True, JPEGs are decoded at reduced scale (see draft_image) to cover draft_size
+        (default 1024x1024). the ratio of the loaded to the full image width is stored in
+        item.image_draft_scale, which is removed when the full size image is loaded
     '''
     if itemfile is None:
         itemfile=collection.get_path(item)
     mimetype=io.get_mime_type(itemfile)
     oriented=False
+    draft_scale=1.0
+    if draft_mode and draft_size is None:
+        draft_size=(1024,1024)
     try:
         ##todo: load by mimetype (after porting to gio)
 #        non-parsed version
@@ -632,8 +675,11 @@ def load_image(item,collection,interrupt_fn,draft_mode=False,apply_transforms=Tr
             if io.get_mime_type(itemfile) in settings.raw_image_types: ##for extraction with dcraw
                 raise TypeError
             image=Image.open(itemfile) ## retain this call even in the parsed version to avoid lengthy delays on raw images (since this call trips the exception)
+            if draft_mode and image.format=='JPEG':
+                draft_scale=draft_image(image,draft_size)
+                image.load()
     #        parsed version
-            if not draft_mode and image.format=='JPEG':
+            elif image.format=='JPEG':
                 #parser doesn't seem to work correctly on anything but JPEGs
                 f=open(itemfile,'rb')
                 imdata=f.read(10000)
@@ -692,10 +738,12 @@ def load_image(item,collection,interrupt_fn,draft_mode=False,apply_transforms=Tr
             item.image=False
             return False
     print item.meta
-    if draft_mode:
-        image.draft(image.mode,(1024,1024)) ##todo: pull size from screen resolution
     if not interrupt_fn():
         return
+    if draft_scale<1.0:
+        item.image_draft_scale=draft_scale
+    elif 'image_draft_scale' in item.__dict__:
+        del item.image_draft_scale
     if oriented:
         item.image=orient_image(image,{})
     else:
@@ -713,10 +761,14 @@ def load_image(item,collection,interrupt_fn,draft_mode=False,apply_transforms=Tr
 
 
 def free_image(item):
+    memcache.images.discard(item)
+    memcache.qviews.discard(item)
     if 'image' in item:
         del item.image
     if 'original_image' in item:
         del item.original_image
+    if 'image_draft_scale' in item.__dict__:
+        del item.image_draft_scale
     if 'qview' in item:
         del item.qview
 
@@ -781,6 +833,7 @@ def size_image(item,size,antialias=False,zoom='fit'): ##todo: rename as size ima
         else:
             image.load()
             item.qview=image_to_pixbuf(image)
+            cache_qview(item)
             return True
     else:
         (iw,ih)=image.size
@@ -799,6 +852,7 @@ def size_image(item,size,antialias=False,zoom='fit'): ##todo: rename as size ima
     print 'resize time',time.time()-t
     if qimage:
         item.qview=image_to_pixbuf(qimage)
+        cache_qview(item)
     return False
 
 
@@ -895,11 +949,60 @@ def rotate_thumb(item,right=True,interrupt_fn=None):
 
 gdk_mime_types=set([m for n in gtk.gdk.pixbuf_get_formats() for m in n['mime_types']])
 
-def make_thumb(item,collection,interrupt_fn=None,force=False,cache=None,use_embedded=False,write_to_cache=True):
+def pixbuf_to_thumb_data(pb):
+    '''
+    returns the (has_alpha,width,height,rowstride,pixels) tuple used to store a thumbnail pixbuf in a thumbnail pack
+    '''
+    width,height,rowstride=pb.get_width(),pb.get_height(),pb.get_rowstride()
+    pixels=pb.get_pixels()
+    if len(pixels)<rowstride*height: ##the last row of a pixbuf is not padded to the rowstride
+        pixels+='\0'*(rowstride*height-len(pixels))
+    return (pb.get_has_alpha(),width,height,rowstride,pixels)
+
+
+def thumb_data_to_pixbuf(thumb_data):
+    '''
+    create a pixbuf from a (has_alpha,width,height,rowstride,pixels) tuple read from a thumbnail pack
+    '''
+    has_alpha,width,height,rowstride,pixels=thumb_data
+    return gtk.gdk.pixbuf_new_from_data(pixels,gtk.gdk.COLORSPACE_RGB,has_alpha,8,width,height,rowstride)
+
+
+def make_thumb_image(itemfile,meta,size=(128,128)):
+    '''
+    decode the image in itemfile with PIL (or dcraw if PIL can't read it) and return an oriented
+    PIL image no larger than size. gtk is not used, so this can be called in a separate process
+    '''
+    try:
+        image=Image.open(itemfile)
+        image.thumbnail(size,Image.ANTIALIAS)
+    except:
+        cmd=settings.dcraw_cmd%(itemfile,)
+        imdata=os.popen(cmd).read()
+        if not imdata or len(imdata)<100:
+            cmd=settings.dcraw_backup_cmd%(itemfile,)
+            imdata=os.popen(cmd).read()
+        p = ImageFile.Parser()
+        p.feed(imdata)
+        image = p.close()
+        image.thumbnail(size,Image.ANTIALIAS)
+    return orient_image(image,meta)
+
+
+def thumb_cache_path(item,cache):
+    '''
+    returns the path of the thumbnail for item in the collection's own thumbnail cache directory
+    '''
+    return os.path.join(cache,muuid(item.uid+str(int(item.mtime))))+'.png'
+
+
+def make_thumb(item,collection,interrupt_fn=None,force=False,cache=None,use_embedded=False,write_to_cache=True,preloaded=None):
     '''
     create a thumbnail from the original image using either PIL or dcraw
     interrupt_fn = callback that returns False if routine should cancel (not implemented)
     force = True if thumbnail should be recreated even if already present
+    preloaded = the (success,mode,size,data,thumburi) tuple returned by the thumbnail process pool
+        (see thumbpool.make_thumb_data). if the pool failed, the image is decoded here instead
     affects thumb, thumburi members of item
     '''
     itemfile=collection.get_path(item)
@@ -920,11 +1023,15 @@ def make_thumb(item,collection,interrupt_fn=None,force=False,cache=None,use_embe
     ## would not need to make the thumb in that case
     print 'Creating thumbnail for',item.uid,itemfile
     t=time.time()
+    cached_uri=None
     try:
         uri = io.get_uri(itemfile)
         mimetype=io.get_mime_type(itemfile)
         thumb_pb=None
-        if mimetype.lower().startswith('video'):
+        if preloaded is not None and preloaded[0]:
+            success,mode,size,data,cached_uri=preloaded
+            image=Image.frombytes(mode,size,data)
+        elif mimetype.lower().startswith('video'):
             cmd=settings.video_thumbnailer%(itemfile,)
             imdata=os.popen(cmd).read()
             image=Image.open(StringIO.StringIO(imdata))
@@ -944,6 +1051,7 @@ def make_thumb(item,collection,interrupt_fn=None,force=False,cache=None,use_embe
                 else:
                     image=Image.open(itemfile)
                     image.thumbnail((128,128),Image.ANTIALIAS)
+                    image=orient_image(image,item.meta) ##as in make_thumb_image (used by the thumbnail process pool)
                     print 'Opened with PIL'
             except:
                 cmd=settings.dcraw_cmd%(itemfile,)
@@ -984,14 +1092,16 @@ def make_thumb(item,collection,interrupt_fn=None,force=False,cache=None,use_embe
     uri = io.get_uri(itemfile)
     #save the new thumbnail
     try:
-        if write_to_cache:
+        if cached_uri:
+            item.thumburi=cached_uri
+        elif write_to_cache:
             if cache==None:
                 thumb_factory.save_thumbnail(thumb_pb,uri,int(item.mtime))
                 item.thumburi=thumb_factory.lookup(uri,int(item.mtime))
             else:
                 if not os.path.exists(cache):
                     os.makedirs(cache)
-                item.thumburi=os.path.join(cache,muuid(item.uid+str(int(item.mtime))))+'.png'
+                item.thumburi=thumb_cache_path(item,cache)
                 thumb_pb.save(item.thumburi,"png")
             print 'cached at',item.thumburi
     except:
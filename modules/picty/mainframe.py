@@ -358,7 +358,7 @@ class MainFrame(gtk.VBox):
         self.browser_nb.connect("switch-page",self.browser_page_switch)
         self.browser_nb.connect("page-reordered",self.browser_page_reorder)
 
-        pluginmanager.mgr.register_callback('t_collection_item_metadata_changed',self.meta_changed)
+        pluginmanager.mgr.register_callback('t_collection_items_metadata_changed',self.items_meta_changed)
         self.show_sig_id=self.sort_toggle.connect_after("realize",self.on_show) ##this is a bit of a hack to ensure the main window shows before a collection is activated or the user is prompted to create a new one
 
         try:
@@ -524,16 +524,18 @@ class MainFrame(gtk.VBox):
             else:
                 dialogs.prompt_dialog("Error Creating Collection","The collection could not be created",["_Close"])
 
-    def meta_changed(self,collection,item,old_meta):
-        if item == self.iv.item:
-            if item.meta!=old_meta:
+    def items_meta_changed(self,collection,changes):
+        for item,old_meta in changes:
+            if item == self.iv.item and item.meta!=old_meta:
                 self.iv.redraw_view()
 #                if 'ImageTransforms' in item.meta or 'ImageTransforms' in old_meta:
                 self.update_image_edit_selector(item)
         if collection!=self.active_collection:
             return
-        if item.meta!=old_meta:
-            collection.browser.redraw_view()
+        for item,old_meta in changes:
+            if item.meta!=old_meta:
+                collection.browser.redraw_view()
+                break
 
     def collections_init(self):
         ##now fill the collection manager with
@@ -0,0 +1,225 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+memcache.py
+
+In-memory caches for the pixel data attached to items: thumbnails (item.thumb), screen sized
+views (item.qview) and full decoded images (item.image). Each tier is a least recently used
+cache with a budget in bytes. When the budget is exceeded the least recently used items have
+their pixel data released (the attribute is set to None, so it is reloaded when next needed).
+The budgets are a share of the memory available on the system, which is checked again every
+BUDGET_INTERVAL seconds as items are added.
+'''
+
+import collections
+import os
+import threading
+import time
+
+import settings
+
+##share of the memory cache budget given to each tier
+TIER_SHARES={'thumbs':0.25,'qviews':0.25,'images':0.5}
+DEFAULT_AVAILABLE_MEMORY=1024*1024*1024 #assumed if the available memory can't be determined
+MIN_BUDGET=16*1024*1024
+BUDGET_INTERVAL=10.0 #minimum number of seconds between checks of the available memory
+
+
+def available_memory():
+    'returns the number of bytes of physical memory available to the program without swapping'
+    try:
+        f=open('/proc/meminfo')
+        try:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+        finally:
+            f.close()
+    except (IOError,ValueError,IndexError):
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError,AttributeError,OSError):
+        pass
+    try:
+        import ctypes
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_=[('dwLength',ctypes.c_ulong),('dwMemoryLoad',ctypes.c_ulong),
+                      ('ullTotalPhys',ctypes.c_ulonglong),('ullAvailPhys',ctypes.c_ulonglong),
+                      ('ullTotalPageFile',ctypes.c_ulonglong),('ullAvailPageFile',ctypes.c_ulonglong),
+                      ('ullTotalVirtual',ctypes.c_ulonglong),('ullAvailVirtual',ctypes.c_ulonglong),
+                      ('sullAvailExtendedVirtual',ctypes.c_ulonglong)]
+        stat=MEMORYSTATUSEX()
+        stat.dwLength=ctypes.sizeof(stat)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(stat)):
+            return stat.ullAvailPhys
+    except:
+        pass
+    return DEFAULT_AVAILABLE_MEMORY
+
+
+def total_budget(cached=0):
+    '''
+    returns the number of bytes available to all tiers of the cache
+    cached is the number of bytes held by the cache (which is memory the cache could use, but isn't available)
+    '''
+    if settings.memcache_max_mb>0:
+        return settings.memcache_max_mb*1024*1024
+    return int((available_memory()+cached)*settings.memcache_fraction)
+
+
+def pixbuf_size(pb):
+    try:
+        return pb.get_rowstride()*pb.get_height()
+    except:
+        return 0
+
+def image_size(image):
+    'returns the approximate number of bytes used by the pixels of a PIL image'
+    try:
+        w,h=image.size
+        return w*h*len(image.getbands())
+    except:
+        return 0
+
+
+class LRUCache:
+    '''
+    a least recently used cache of the items that have the attribute `attr` set, limited to `budget` bytes
+    `size_fn` returns the size in bytes of the attribute value. items are evicted by setting the attribute to None
+    the most recently added item is never evicted, even if it is larger than the budget
+    '''
+    def __init__(self,name,attr,size_fn,budget):
+        self.name=name
+        self.attr=attr
+        self.size_fn=size_fn
+        self.budget=budget
+        self.entries=collections.OrderedDict() #id(item) -> (item,size), least recently used first
+        self.used=0
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.lock=threading.Lock()
+
+    def add(self,item):
+        '''
+        add item to the cache (or update its size if already cached), evicting least recently used items if over budget
+        '''
+        value=getattr(item,self.attr,None)
+        if not value:
+            return self.discard(item)
+        check_budget()
+        size=self.size_fn(value)
+        evicted=[]
+        self.lock.acquire()
+        try:
+            key=id(item)
+            old=self.entries.pop(key,None)
+            if old is not None:
+                self.used-=old[1]
+            self.entries[key]=(item,size)
+            self.used+=size
+            while self.used>self.budget and len(self.entries)>1:
+                k,(olditem,oldsize)=self.entries.popitem(last=False)
+                self.used-=oldsize
+                self.evictions+=1
+                evicted.append(olditem)
+        finally:
+            self.lock.release()
+        for olditem in evicted:
+            setattr(olditem,self.attr,None)
+
+    def touch(self,item):
+        '''
+        mark item as recently used. returns True if the item is cached (and counts a hit or miss)
+        '''
+        self.lock.acquire()
+        try:
+            entry=self.entries.pop(id(item),None)
+            if entry is None:
+                self.misses+=1
+                return False
+            self.entries[id(item)]=entry
+            self.hits+=1
+            return True
+        finally:
+            self.lock.release()
+
+    def discard(self,item):
+        'remove item from the cache without releasing its data'
+        self.lock.acquire()
+        entry=self.entries.pop(id(item),None)
+        if entry is not None:
+            self.used-=entry[1]
+        self.lock.release()
+
+    def set_budget(self,budget):
+        self.budget=budget
+        self.lock.acquire()
+        evicted=[]
+        while self.used>self.budget and len(self.entries)>1:
+            k,(olditem,oldsize)=self.entries.popitem(last=False)
+            self.used-=oldsize
+            self.evictions+=1
+            evicted.append(olditem)
+        self.lock.release()
+        for olditem in evicted:
+            setattr(olditem,self.attr,None)
+
+    def stats(self):
+        return {'name':self.name,'items':len(self.entries),'bytes':self.used,'budget':self.budget,
+                'hits':self.hits,'misses':self.misses,'evictions':self.evictions}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _make_tiers():
+    budget=max(total_budget(),MIN_BUDGET)
+    return (LRUCache('thumbs','thumb',pixbuf_size,int(budget*TIER_SHARES['thumbs'])),
+            LRUCache('qviews','qview',pixbuf_size,int(budget*TIER_SHARES['qviews'])),
+            LRUCache('images','image',image_size,int(budget*TIER_SHARES['images'])))
+
+thumbs,qviews,images=_make_tiers()
+
+
+_next_budget_check=time.time()+BUDGET_INTERVAL
+
+def update_budget():
+    'recompute the budget of each tier (e.g. after the user changes the memory cache settings)'
+    global _next_budget_check
+    _next_budget_check=time.time()+BUDGET_INTERVAL
+    tiers=(thumbs,qviews,images)
+    budget=max(total_budget(sum(tier.used for tier in tiers)),MIN_BUDGET)
+    for tier in tiers:
+        tier.set_budget(int(budget*TIER_SHARES[tier.name]))
+
+
+def check_budget():
+    'recompute the budgets if the available memory was last checked more than BUDGET_INTERVAL seconds ago'
+    if time.time()>=_next_budget_check:
+        update_budget()
+
+
+def stats():
+    'returns a list of dictionaries with the usage statistics of each tier'
+    return [tier.stats() for tier in (thumbs,qviews,images)]
@@ -68,39 +68,49 @@ def extract_thumbnail_from_metadata(item, rawmeta):
     previews = rawmeta.previews
     if previews:
         print 'opening preview',len(previews)
-        preview_ind = len(previews)-1
-        while True:
-            try:
-                try:
-                    if settings.is_windows: #something is missing from GTK+ on windows -- prevents PixbufLoader from reading the preview images
-                        raise IOError('PixbufLoader not available on windows')
-                    pbloader = gtk.gdk.PixbufLoader()
-                    pbloader.write(previews[preview_ind].data)
-                    pb = pbloader.get_pixbuf()
-                    pbloader.close()
-                    w=pb.get_width()
-                    h=pb.get_height()
-                    a=max(128,w,h)
-                    item.thumb=pb.scale_simple(128*w/a,128*h/a,gtk.gdk.INTERP_BILINEAR)
-                    break
-                except: ##Mostly a workaround for DNGs or Windows PCs
-                    im = Image.open(_io.BytesIO(previews[preview_ind].data))
-#                    p = ImageFile.Parser()
-#                    p.feed(previews[preview_ind].data)
-#                    im = p.close()
-                    from picty import imagemanip
-                    im.thumbnail((128,128),Image.ANTIALIAS)
-                    item.thumb = imagemanip.image_to_pixbuf(im)
-                    break
-            except:
-                if preview_ind == 0:
-                    raise
-                preview_ind = 0
+        return extract_thumbnail_from_previews(item, [previews[-1].data, previews[0].data])
     else:
         print 'No usable thumbnail data for', item
         item.thumb=False
         return False
 
+def extract_thumbnail_from_previews(item, preview_data):
+    '''
+    set the thumbnail of `item` from the first usable buffer in the list `preview_data` of embedded preview images
+    '''
+    if not preview_data:
+        print 'No usable thumbnail data for', item
+        item.thumb=False
+        return False
+    preview_ind = 0
+    while True:
+        try:
+            try:
+                if settings.is_windows: #something is missing from GTK+ on windows -- prevents PixbufLoader from reading the preview images
+                    raise IOError('PixbufLoader not available on windows')
+                pbloader = gtk.gdk.PixbufLoader()
+                pbloader.write(preview_data[preview_ind])
+                pb = pbloader.get_pixbuf()
+                pbloader.close()
+                w=pb.get_width()
+                h=pb.get_height()
+                a=max(128,w,h)
+                item.thumb=pb.scale_simple(128*w/a,128*h/a,gtk.gdk.INTERP_BILINEAR)
+                break
+            except: ##Mostly a workaround for DNGs or Windows PCs
+                im = Image.open(_io.BytesIO(preview_data[preview_ind]))
+#                p = ImageFile.Parser()
+#                p.feed(preview_data[preview_ind])
+#                im = p.close()
+                from picty import imagemanip
+                im.thumbnail((128,128),Image.ANTIALIAS)
+                item.thumb = imagemanip.image_to_pixbuf(im)
+                break
+        except:
+            if preview_ind == len(preview_data)-1:
+                raise
+            preview_ind = len(preview_data)-1
+
 def load_metadata(item=None,filename=None,thumbnail=False,missing_only=False):
     '''
     load the metadata from the image and convert the keys to a subset that picty understands
@@ -143,6 +153,69 @@ def load_metadata(item=None,filename=None,thumbnail=False,missing_only=False):
     return True
 
 
+def read_metadata(filename,thumbnail=False):
+    '''
+    read the metadata from the image in `filename` and convert the keys to a subset that picty understands
+    returns a tuple (meta,preview_data) where preview_data is a list of the raw embedded preview images
+    (largest first) if thumbnail is True, otherwise None
+    this does not touch any items or gtk objects, so can be safely called in a separate process
+    '''
+    rawmeta = Exiv2Metadata(filename)
+    rawmeta.read()
+    meta={}
+    get_exiv2_meta(meta,rawmeta)
+    preview_data=None
+    if thumbnail:
+        previews = rawmeta.previews
+        preview_data = [previews[-1].data, previews[0].data] if previews else []
+    return meta,preview_data
+
+def read_metadata_batch(batch):
+    '''
+    calls read_metadata for each (filename,thumbnail) tuple in the list `batch` returning a list of
+    (meta,preview_data) tuples in the same order. meta is None if the metadata could not be read.
+    used as the task function of the metadata process pool
+    '''
+    results=[]
+    for filename,thumbnail in batch:
+        try:
+            results.append(read_metadata(filename,thumbnail))
+        except:
+            print 'Error reading metadata for',filename
+            import traceback,sys
+            print traceback.format_exc(sys.exc_info()[2])
+            results.append((None,None))
+    return results
+
+def apply_metadata(item,result,thumbnail=False,missing_only=False):
+    '''
+    update `item` with the (meta,preview_data) tuple `result` returned by read_metadata
+    thumbnail - if True, set the thumbnail from the preview data
+    missing_only - if True, will set keys that aren't already present in the item
+    '''
+    meta,preview_data=result
+    if meta is None:
+        if item.meta is None:
+            item.meta={}
+        return False
+    if missing_only and item.meta!=None:
+        for k in meta:
+            if k not in item.meta:
+                item.meta[k] = meta[k]
+    else:
+        item.meta=meta
+    if thumbnail:
+        try:
+            extract_thumbnail_from_previews(item, preview_data)
+        except:
+            print 'Load thumbnail failed for',item.uid
+            import traceback,sys
+            print traceback.format_exc(sys.exc_info()[2])
+            item.thumb=False
+    item.mark_meta_saved()
+    return True
+
+
 def load_thumbnail(item=None,filename=None):
     '''
     load the metadata from the image and convert the keys to a subset that picty understands
@@ -171,19 +244,57 @@ def load_thumbnail(item=None,filename=None):
     return True
 
 
+def changed_keys(item):
+    '''
+    returns the list of picty keys whose values differ between the item's metadata and the metadata
+    last read from or saved to the image (item.meta_backup). returns None if there is no backup
+    '''
+    try:
+        backup=item.meta_backup
+    except AttributeError:
+        return None
+    meta=item.meta
+    return [k for k in set(meta)|set(backup) if meta.get(k)!=backup.get(k)]
+
+def write_metadata(filename,meta,keys=None):
+    '''
+    write the picty metadata in the dictionary `meta` to the image in `filename`. if keys is not None,
+    only those keys are written (and removed from the image if they are not in meta)
+    this does not touch any items or gtk objects, so can be safely called in a separate process
+    '''
+    if filename.lower().endswith('.crw'):
+        raise IOError("Writing to CRW is not supported. Enable sidecars in collection settings to save your changes.")
+    rawmeta = Exiv2Metadata(filename)
+    rawmeta.read()
+    set_exiv2_meta(meta,rawmeta,keys=keys)
+    rawmeta.write()
+
+def write_metadata_batch(batch):
+    '''
+    calls write_metadata for each (filename,meta,keys) tuple in the list `batch` returning a list
+    with True for each file that was written successfully, False otherwise
+    used as the task function of the metadata process pool
+    '''
+    results=[]
+    for filename,meta,keys in batch:
+        try:
+            write_metadata(filename,meta,keys)
+            results.append(True)
+        except:
+            print 'Error writing metadata for',filename
+            import traceback,sys
+            print traceback.format_exc(sys.exc_info()[2])
+            results.append(False)
+    return results
+
 def save_metadata(item,filename):
     '''
     write the metadata in item to the underlying file converting keys from the picty representation to the relevant standard
+    only the keys that have changed since the metadata was read are written
     '''
     try:
         print 'Writing metadata for',item.uid
-        if filename.lower().endswith('.crw'):
-            raise IOError("Writing to CRW is not supported. Enable sidecars in collection settings to save your changes.")
-        rawmeta = Exiv2Metadata(filename)
-        rawmeta.read()
-        meta=item.meta.copy()
-        set_exiv2_meta(meta,rawmeta) #TODO: Only want to write the metadata of the keys that have changed
-        rawmeta.write()
+        write_metadata(filename,item.meta.copy(),changed_keys(item))
         item.mark_meta_saved()
     except:
         print 'Error writing metadata for',item.uid
@@ -286,7 +397,7 @@ def save_sidecar(item,filename):
             rawmeta_out.read()
 
         meta=item.meta.copy()
-        set_exiv2_meta(meta,rawmeta,apptags_dict_sidecar) #TODO: Only want to write the metadata of the keys that have changed
+        set_exiv2_meta(meta,rawmeta,apptags_dict_sidecar,changed_keys(item))
         if workaround:
             rawmeta.copy(rawmeta_out,exif=False, iptc=False, xmp=True,comment=False)
             rawmeta_out.write()
@@ -817,18 +928,70 @@ appkeys=[y for x in apptags for y in x[7]]
 apptags_dict_sidecar=dict([(x[0],x[1:]) for x in apptags_sidecar])
 appkeys_sidecar=[y for x in apptags_sidecar for y in x[7]]
 
+##exiv2 keys read by converters in addition to the keys listed in their apptags entry
+conv_extra_keys={
+    conv_date_taken:("Exif.Photo.DateTimeOriginal","Exif.Photo.DateTimeDigitized","Exif.Image.DateTimeOriginal","Exif.Image.DateTime"),
+    }
+
+def _flatten_keys(keys):
+    for k in keys:
+        if isinstance(k,tuple):
+            for j in _flatten_keys(k):
+                yield j
+        else:
+            yield k
+
+class ExtractionPlan:
+    '''
+    the apptags in apptags_dict compiled to a list of (appkey,converter,keys,source keys) where source
+    keys is the set of exiv2 keys the converter reads. when extracting the metadata of an image only the
+    converters whose source keys are present in the image are called (a converter returns nothing
+    if none of its keys are present, but probing for the missing keys is slow)
+    '''
+    def __init__(self,apptags_dict):
+        self.apptags_dict=apptags_dict
+        self.entries=[]
+        for appkey,data in apptags_dict.iteritems():
+            source=set(_flatten_keys(data[6]))|set(conv_extra_keys.get(data[2],()))
+            self.entries.append((appkey,data[2],data[6],frozenset(source)))
+
+    def extract(self,app_meta,exiv2_meta):
+        present=set(exiv2_meta.exif_keys)
+        present.update(exiv2_meta.iptc_keys)
+        present.update(exiv2_meta.xmp_keys)
+        for appkey,conv,keys,source in self.entries:
+            if source.isdisjoint(present):
+                continue
+            try:
+                val=conv(exiv2_meta,keys)
+                if val:
+                    app_meta[appkey]=val
+            except:
+                pass
+
+_extraction_plans={}
+
+def get_extraction_plan(apptags_dict=apptags_dict):
+    'returns the ExtractionPlan for apptags_dict, compiling it on first use'
+    plan=_extraction_plans.get(id(apptags_dict))
+    if plan is None or plan.apptags_dict is not apptags_dict:
+        plan=_extraction_plans[id(apptags_dict)]=ExtractionPlan(apptags_dict)
+    return plan
+
 def get_exiv2_meta(app_meta,exiv2_meta,apptags_dict=apptags_dict):
-    for appkey,data in apptags_dict.iteritems():
-        try:
-            val=data[2](exiv2_meta,data[6])
-            if val:
-                app_meta[appkey]=val
-        except:
-            pass
+    get_extraction_plan(apptags_dict).extract(app_meta,exiv2_meta)
 
-def set_exiv2_meta(app_meta,exiv2_meta,apptags_dict=apptags_dict):
+def set_exiv2_meta(app_meta,exiv2_meta,apptags_dict=apptags_dict,keys=None):
+    '''
+    set the exiv2 keys in exiv2_meta from the picty keys in app_meta
+    if keys is not None, only the listed picty keys are set (or removed if they aren't in app_meta)
+    '''
     i=0
-    for appkey in apptags_dict:
+    if keys is not None:
+        keys=[k for k in keys if k in apptags_dict]
+    else:
+        keys=apptags_dict
+    for appkey in keys:
         try:
             data=apptags_dict[appkey] ##TODO: Check that keys are being removed if the app_meta value is equivalent to empty
             if appkey in app_meta:
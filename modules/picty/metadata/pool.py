@@ -0,0 +1,184 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+pool.py
+
+Reads image metadata in a pool of processes so that bulk operations (scanning and verifying
+collections) are not limited to parsing one file at a time on the worker thread
+'''
+
+import collections
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing=None
+
+from picty import settings
+from picty import metadata
+
+BATCH_SIZE=20 #number of files read by a process per task
+PENDING_PER_PROCESS=2 #number of batches submitted for each process before the caller must wait for results
+
+_pool=None
+_pool_processes=0
+_pool_failed=False
+
+
+def get_pool():
+    '''
+    returns the shared process pool, creating it on first use
+    returns None if the pool is disabled or unavailable on this platform
+    '''
+    global _pool,_pool_processes,_pool_failed
+    if _pool is not None or _pool_failed:
+        return _pool
+    if multiprocessing is None or 'read_metadata_batch' not in dir(metadata) or settings.metadata_processes==1:
+        _pool_failed=True
+        return None
+    try:
+        _pool_processes=settings.metadata_processes
+        if _pool_processes<=0:
+            _pool_processes=multiprocessing.cpu_count()
+        _pool=multiprocessing.Pool(_pool_processes)
+    except:
+        print 'Error starting metadata process pool, metadata will be read on the worker thread'
+        import traceback,sys
+        print traceback.format_exc(sys.exc_info()[2])
+        _pool_failed=True
+        _pool=None
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool=None
+
+
+def write_enabled(collection):
+    'returns True if metadata changes to the items of the collection can be written by the pool'
+    c=collection
+    return c.local_filesystem and not c.use_sidecars and 'write_metadata_batch' in dir(metadata) and get_pool() is not None
+
+
+class MetadataLoadQueue:
+    '''
+    queues items of a collection to have their metadata read by the process pool, returning
+    the results in the order that the items were queued. results are applied to the item by passing
+    them to collection.load_metadata(item,preloaded=result)
+    '''
+    def __init__(self,collection,batch_size=BATCH_SIZE):
+        self.collection=collection
+        self.batch_size=batch_size
+        self.batch=[]
+        self.pending=collections.deque() #(items,async_result) for each submitted batch
+        self.count=0
+
+    def enabled(self):
+        'returns True if the items of the collection can be loaded by the pool'
+        c=self.collection
+        return c.local_filesystem and not c.use_sidecars and get_pool() is not None
+
+    def put(self,item):
+        self.batch.append(item)
+        self.count+=1
+        if len(self.batch)>=self.batch_size:
+            self.flush()
+
+    def flush(self):
+        'submit any partially filled batch to the pool'
+        if not self.batch:
+            return
+        thumbnail=self.collection.load_embedded_thumbs
+        tasks=[(self.collection.get_path(item),thumbnail) for item in self.batch]
+        self.pending.append((self.batch,get_pool().apply_async(metadata.read_metadata_batch,(tasks,))))
+        self.batch=[]
+
+    def full(self):
+        'returns True if the caller should collect some results before queueing more items'
+        return len(self.pending)>=PENDING_PER_PROCESS*max(_pool_processes,1)
+
+    def __len__(self):
+        return self.count
+
+    def get_ready(self,timeout=0):
+        '''
+        returns a list of (item,result) tuples for the batches at the front of the queue that have completed
+        waits up to timeout seconds for the first batch if none are complete. result is None if the pool
+        failed to process the batch (the caller should fall back to loading the metadata directly)
+        '''
+        results=[]
+        while self.pending:
+            items,async_result=self.pending[0]
+            if not async_result.ready():
+                if results or timeout<=0:
+                    break
+                async_result.wait(timeout)
+                if not async_result.ready():
+                    break
+            self.pending.popleft()
+            try:
+                batch_results=async_result.get()
+            except:
+                print 'Error reading metadata in process pool'
+                import traceback,sys
+                print traceback.format_exc(sys.exc_info()[2])
+                batch_results=[None]*len(items)
+            results+=zip(items,batch_results)
+            self.count-=len(items)
+        return results
+
+
+class MetadataWriteQueue(MetadataLoadQueue):
+    '''
+    queues items of a collection to have their changed metadata keys written to the image by the process pool,
+    returning the results in the order that the items were queued. results are applied to the item by passing
+    them to collection.write_metadata(item,written=result)
+    '''
+    def enabled(self):
+        return write_enabled(self.collection)
+
+    def put(self,item):
+        self.batch.append((item,item.meta.copy(),metadata.changed_keys(item)))
+        self.count+=1
+        if len(self.batch)>=self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        tasks=[(self.collection.get_path(item),meta,keys) for item,meta,keys in self.batch]
+        self.pending.append((self.batch,get_pool().apply_async(metadata.write_metadata_batch,(tasks,))))
+        self.batch=[]
+
+    def get_ready(self,timeout=0):
+        '''
+        returns a list of (item,result) tuples for the batches at the front of the queue that have completed
+        (see MetadataLoadQueue.get_ready). result is a tuple (meta,success) where meta is the metadata
+        that was written or None if the pool failed to process the batch
+        '''
+        results=[]
+        for (item,meta,keys),success in MetadataLoadQueue.get_ready(self,timeout):
+            results.append((item,(meta,success) if success is not None else None))
+        return results
@@ -107,9 +107,30 @@ class Plugin(object):
     def t_collection_item_removed(self,collection,item):
         '''item was removed from the collection'''
         pass
+    def t_collection_items_added(self,collection,items):
+        '''
+        a batch of items was added to the collection
+        the default implementation calls t_collection_item_added for each item
+        '''
+        for item in items:
+            self.t_collection_item_added(collection,item)
+    def t_collection_items_removed(self,collection,items):
+        '''
+        a batch of items was removed from the collection
+        the default implementation calls t_collection_item_removed for each item
+        '''
+        for item in items:
+            self.t_collection_item_removed(collection,item)
     def t_collection_item_metadata_changed(self,collection,item,old_metadata):
         '''item metadata has changed'''
         pass
+    def t_collection_items_metadata_changed(self,collection,changes):
+        '''
+        the metadata of a batch of items has changed. changes is a list of (item,old_metadata)
+        the default implementation calls t_collection_item_metadata_changed for each item
+        '''
+        for item,old_metadata in changes:
+            self.t_collection_item_metadata_changed(collection,item,old_metadata)
     def t_collection_item_changed(self,collection,item): ##
         '''other item characteristics have changed (mtime, size etc)'''
         pass
@@ -119,6 +140,20 @@ class Plugin(object):
     def t_collection_item_removed_from_view(self,collection,view,item):
         '''item in collection was removed from view'''
         pass
+    def t_collection_items_added_to_view(self,collection,view,items):
+        '''
+        a batch of items in collection was added to view
+        the default implementation calls t_collection_item_added_to_view for each item
+        '''
+        for item in items:
+            self.t_collection_item_added_to_view(collection,view,item)
+    def t_collection_items_removed_from_view(self,collection,view,items):
+        '''
+        a batch of items in collection was removed from view
+        the default implementation calls t_collection_item_removed_from_view for each item
+        '''
+        for item in items:
+            self.t_collection_item_removed_from_view(collection,view,item)
     def t_collection_modify_start_hint(self,collection):
         '''the collection_item* methods have started editing the batch of images.
         use this to hint to gui plugins that it should wait for the complete_hint before refreshing'''
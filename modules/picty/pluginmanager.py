@@ -21,6 +21,9 @@ License:
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import threading
+import time
+
 import gobject
 
 import pluginbase
@@ -29,6 +32,21 @@ import settings
 ##todo: need try/except blocks around most of this stuff
 ##todo: have to make the pluginmanager methods threadsafe (plugins member could change in thread while being accessed in another)
 
+##item level collection events that are delivered to plugins in batches. each maps to the name of the batch
+##interface and the number of leading arguments shared by the batch (e.g. the view for view events)
+##the remaining argument(s) of each event make up the list passed to the batch interface
+item_events={
+    't_collection_item_added':('t_collection_items_added',0),
+    't_collection_item_removed':('t_collection_items_removed',0),
+    't_collection_item_metadata_changed':('t_collection_items_metadata_changed',0),
+    't_collection_item_added_to_view':('t_collection_items_added_to_view',1),
+    't_collection_item_removed_from_view':('t_collection_items_removed_from_view',1),
+    }
+batch_events=dict([(v[0],k) for k,v in item_events.iteritems()])
+
+EVENT_BATCH_SIZE=1000 #maximum number of item events buffered for a collection before they are dispatched
+EVENT_BATCH_DELAY=0.5 #number of seconds after which buffered item events are dispatched with the next event
+
 
 
 class PluginManager():
@@ -41,6 +59,10 @@ class PluginManager():
         self.mainframe=None
         self.collection_suppress={}
         self.registered_callbacks={}
+        self.subscribers={} #batch interface name -> list of plugins that implement the batch or item interface
+        self.collection_events={} #collection -> [time of the first event,list of (interface_name,args)]
+        self.events_lock=threading.RLock()
+        self.dispatch_lock=threading.RLock() #held while buffered events are delivered, so batches are delivered one at a time and in order
     def instantiate_all_plugins(self):
         ##todo: check for plugin.name conflicts with existing plugins and reject plugin if already present
         print 'instantiating plugins except for',settings.plugins_disabled
@@ -49,9 +71,11 @@ class PluginManager():
                 self.plugins[plugin.name]=[plugin(),plugin] if plugin.name not in settings.plugins_disabled else [None,plugin]
 #            except:
 #                print 'Error initializing plugin',plugin.name
+        self.subscribers={}
     def enable_plugin(self,name):
         ##todo: check for plugin.name conflicts with existing plugins and reject plugin if already present
         self.plugins[name][0]=self.plugins[name][1]()
+        self.subscribers={}
         self.plugins[name][0].plugin_init(self.mainframe,False)
         self.plugins[name][0].viewer_register_shortcut(self.mainframe.viewer_toolbar)
 
@@ -59,6 +83,7 @@ class PluginManager():
         try:
             plugin=self.plugins[name][0]
             self.plugins[name][0]=None
+            self.subscribers={}
             from uitools import overlay_tools
             overlay_tools.deregister_all_tools_for_plugin(plugin)
             plugin.plugin_shutdown(False)
@@ -81,6 +106,7 @@ class PluginManager():
         for each plugin in self.plugins that defines the interface, runs the callback.
         Used in the main app for interfaces that always return None
         '''
+        self.flush_collection_events()
         for name,plugin in self.plugins.iteritems():
             if plugin[0]:
                 getattr(plugin[0],interface_name)(*args)
@@ -126,17 +152,114 @@ class PluginManager():
             del self.collection_suppress[collection]
             self.callback('t_collection_modify_complete_hint',collection)
     def callback_collection(self,interface_name,collection,*args):
-#        try:
-#            if self.collection_suppress[collection]>0:
-#                return
-#        except:
-#            pass
+        '''
+        notify plugins and registered handlers of a collection event. item level events (see item_events)
+        are buffered while the collection's events are suspended and delivered to the batch interfaces
+        once EVENT_BATCH_SIZE events are buffered, the oldest has waited EVENT_BATCH_DELAY seconds when
+        the next one arrives, another kind of event is sent or the events are resumed. the events are
+        always delivered on the thread of the job that sends them
+        '''
+        if interface_name in item_events:
+            self.events_lock.acquire()
+            try:
+                try:
+                    pending=self.collection_events[collection]
+                except KeyError:
+                    pending=self.collection_events[collection]=[time.time(),[]]
+                pending[1].append((interface_name,args))
+                if collection in self.collection_suppress and len(pending[1])<EVENT_BATCH_SIZE and time.time()-pending[0]<EVENT_BATCH_DELAY:
+                    return
+            finally:
+                self.events_lock.release()
+            self.flush_collection_events(collection)
+            return
+        self.flush_collection_events(collection)
+        if interface_name in batch_events:
+            self.dispatch_batch(interface_name,collection,args[:-1],args[-1])
+            return
         for name,plugin in self.plugins.iteritems():
             if plugin[0]:
                 getattr(plugin[0],interface_name)(collection,*args)
         if interface_name in self.registered_callbacks:
             for h in self.registered_callbacks[interface_name]:
                 gobject.idle_add(h,*((collection,)+args))
+    def flush_collection_events(self,collection=None):
+        '''
+        deliver the buffered item events for collection (or all collections if collection is None)
+        consecutive events of the same kind (and view) are sent as a single batch, preserving the order of events
+        '''
+        self.dispatch_lock.acquire()
+        try:
+            self.events_lock.acquire()
+            try:
+                if collection is None:
+                    pending=self.collection_events.items()
+                    self.collection_events={}
+                elif collection in self.collection_events:
+                    pending=[(collection,self.collection_events.pop(collection))]
+                else:
+                    return
+            finally:
+                self.events_lock.release()
+            self._dispatch_pending(pending)
+        finally:
+            self.dispatch_lock.release()
+    def _dispatch_pending(self,pending):
+        'deliver the list of (collection,[time,events]) removed from collection_events'
+        for collection,(t,events) in pending:
+            batch_name=None
+            for interface_name,args in events:
+                name,ncontext=item_events[interface_name]
+                context=args[:ncontext]
+                element=args[ncontext] if len(args)==ncontext+1 else args[ncontext:]
+                if batch_name!=name or context!=batch_context:
+                    if batch_name is not None:
+                        self.dispatch_batch(batch_name,collection,batch_context,batch)
+                    batch_name=name
+                    batch_context=context
+                    batch=[]
+                batch.append(element)
+            if batch_name is not None:
+                self.dispatch_batch(batch_name,collection,batch_context,batch)
+    def get_subscribers(self,batch_name):
+        '''
+        returns the list of enabled plugins that implement the batch interface batch_name or the
+        corresponding item interface (plugins implementing neither don't need to be called)
+        '''
+        try:
+            return self.subscribers[batch_name]
+        except KeyError:
+            pass
+        names=(batch_name,batch_events[batch_name])
+        subscribers=[]
+        for name,plugin in self.plugins.iteritems():
+            if plugin[0]:
+                for n in names:
+                    if getattr(plugin[1],n).im_func is not getattr(pluginbase.Plugin,n).im_func:
+                        subscribers.append(plugin[0])
+                        break
+        self.subscribers[batch_name]=subscribers
+        return subscribers
+    def dispatch_batch(self,batch_name,collection,context,batch):
+        '''
+        send a batch of item events to the plugins and registered handlers. handlers registered for the item interface
+        are called for each item from a single idle callback
+        '''
+        for plugin in self.get_subscribers(batch_name):
+            getattr(plugin,batch_name)(collection,*(tuple(context)+(batch,)))
+        if batch_name in self.registered_callbacks:
+            for h in self.registered_callbacks[batch_name]:
+                gobject.idle_add(h,*((collection,)+tuple(context)+(batch,)))
+        item_name=batch_events[batch_name]
+        if item_name in self.registered_callbacks:
+            for h in self.registered_callbacks[item_name]:
+                gobject.idle_add(self.call_each,h,collection,tuple(context),batch)
+    def call_each(self,handler,collection,context,batch):
+        'call the item event handler for each element of batch (see dispatch_batch)'
+        for element in batch:
+            args=element if isinstance(element,tuple) else (element,)
+            handler(*((collection,)+context+args))
+        return False
 
     def register_callback(self,callback_name,handler):
         try:
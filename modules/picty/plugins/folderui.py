@@ -184,6 +184,22 @@ class FolderSidebarPlugin(pluginbase.Plugin):
             return
         self.folderframe.folder_cloud[collection].remove(item)
         self.thread_refresh()
+    def t_collection_items_added(self,collection,items):
+        '''a batch of items was added to the collection'''
+        if collection is None or not collection.local_filesystem:
+            return
+        cloud=self.folderframe.folder_cloud[collection]
+        for item in items:
+            cloud.add(item)
+        self.thread_refresh()
+    def t_collection_items_removed(self,collection,items):
+        '''a batch of items was removed from the collection'''
+        if collection is None or not collection.local_filesystem:
+            return
+        cloud=self.folderframe.folder_cloud[collection]
+        for item in items:
+            cloud.remove(item)
+        self.thread_refresh()
     def t_collection_item_metadata_changed(self,collection,item,meta_before):
         '''item metadata has changed'''
         if collection!=None:
@@ -194,6 +210,19 @@ class FolderSidebarPlugin(pluginbase.Plugin):
             if i>=0:
                 self.folderframe.folder_cloud_view[collection.get_active_view()].update(item,meta_before)
             self.thread_refresh()
+    def t_collection_items_metadata_changed(self,collection,changes):
+        '''metadata of a batch of items has changed'''
+        if collection!=None:
+            if not collection.local_filesystem:
+                return
+            view=collection.get_active_view()
+            cloud=self.folderframe.folder_cloud[collection]
+            view_cloud=self.folderframe.folder_cloud_view[view]
+            for item,meta_before in changes:
+                cloud.update(item,meta_before)
+                if view.find_item(item)>=0:
+                    view_cloud.update(item,meta_before)
+            self.thread_refresh()
     def t_collection_item_added_to_view(self,collection,view,item):
         '''item in collection was added to view'''
         if collection is None or not collection.local_filesystem:
@@ -206,6 +235,22 @@ class FolderSidebarPlugin(pluginbase.Plugin):
             return
         self.folderframe.folder_cloud_view[view].remove(item)
         self.thread_refresh()
+    def t_collection_items_added_to_view(self,collection,view,items):
+        '''a batch of items in collection was added to view'''
+        if collection is None or not collection.local_filesystem:
+            return
+        cloud=self.folderframe.folder_cloud_view[view]
+        for item in items:
+            cloud.add(item)
+        self.thread_refresh()
+    def t_collection_items_removed_from_view(self,collection,view,items):
+        '''a batch of items in collection was removed from view'''
+        if collection is None or not collection.local_filesystem:
+            return
+        cloud=self.folderframe.folder_cloud_view[view]
+        for item in items:
+            cloud.remove(item)
+        self.thread_refresh()
     def t_collection_modify_start_hint(self,collection):
         if collection is None or not collection.local_filesystem:
             return
@@ -52,6 +52,8 @@ class ImageWriteJob(backend.WorkerJob):
                 h,dpath = tempfile.mkstemp(ext)
             else:
                 dpath = self.dest_path
+            if 'image_draft_scale' in self.item.__dict__: ##the viewer is showing a reduced scale proxy
+                self.collection.load_image(self.item,lambda: True)
             self.item.image.save(dpath)
         except:
             gobject.idle_add(self.plugin.image_write_failed)
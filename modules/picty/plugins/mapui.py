@@ -383,8 +383,29 @@ class MapFrame(gtk.VBox):
         lon1=coords_br[1]/math.pi*180
         self.worker.request_map_images((lat0,lon0,lat1,lon1),self.update_map_items_signal)
 
-    def update_map_items_signal(self,list_pairs):
-        '''notification of a list of images'''
-        for l in list_pairs:
-            lat,lon=imagemanip.get_coords(l[0])
-            self.osm.add_image(lat,lon,l[1])
+    def update_map_items_signal(self,map_items):
+        '''notification of a list of (item,pixbuf,count,(lat,lon)) for images or clusters of images to show on the map'''
+        for item,pb,count,coords in map_items:
+            lat,lon=coords
+            if count>1:
+                pb=self.count_pixbuf(pb,count)
+            self.osm.add_image(lat,lon,pb)
+
+    def count_pixbuf(self,pb,count):
+        '''returns a copy of the thumbnail pixbuf with the number of images in the cluster drawn in the corner'''
+        try:
+            w,h=pb.get_width(),pb.get_height()
+            pixmap,mask=pb.render_pixmap_and_mask()
+            gc=pixmap.new_gc()
+            layout=self.osm.create_pango_layout(str(count))
+            tw,th=layout.get_pixel_size()
+            gc.set_rgb_fg_color(gtk.gdk.Color(0,0,0))
+            pixmap.draw_rectangle(gc,True,0,0,tw+4,th)
+            gc.set_rgb_fg_color(gtk.gdk.Color(65535,65535,65535))
+            pixmap.draw_layout(gc,2,0,layout)
+            return gtk.gdk.Pixbuf(gtk.gdk.COLORSPACE_RGB,False,8,w,h).get_from_drawable(pixmap,pixmap.get_colormap(),0,0,0,0,w,h)
+        except:
+            print 'Error drawing cluster count on map thumbnail'
+            import traceback,sys
+            print traceback.format_exc(sys.exc_info()[2])
+            return pb
@@ -179,6 +179,18 @@ class TagSidebarPlugin(pluginbase.Plugin):
         '''item was removed from the collection'''
         self.tagframe.tag_cloud[collection].remove(item)
         self.thread_refresh()
+    def t_collection_items_added(self,collection,items):
+        '''a batch of items was added to the collection'''
+        cloud=self.tagframe.tag_cloud[collection]
+        for item in items:
+            cloud.add(item)
+        self.thread_refresh()
+    def t_collection_items_removed(self,collection,items):
+        '''a batch of items was removed from the collection'''
+        cloud=self.tagframe.tag_cloud[collection]
+        for item in items:
+            cloud.remove(item)
+        self.thread_refresh()
     def t_collection_item_metadata_changed(self,collection,item,meta_before):
         '''item metadata has changed'''
         if collection!=None:
@@ -187,6 +199,17 @@ class TagSidebarPlugin(pluginbase.Plugin):
             if i>=0:
                 self.tagframe.tag_cloud_view[collection.get_active_view()].update(item,meta_before)
             self.thread_refresh()
+    def t_collection_items_metadata_changed(self,collection,changes):
+        '''metadata of a batch of items has changed'''
+        if collection!=None:
+            view=collection.get_active_view()
+            cloud=self.tagframe.tag_cloud[collection]
+            view_cloud=self.tagframe.tag_cloud_view[view]
+            for item,meta_before in changes:
+                cloud.update(item,meta_before)
+                if view.find_item(item)>=0:
+                    view_cloud.update(item,meta_before)
+            self.thread_refresh()
     def t_collection_item_added_to_view(self,collection,view,item):
         '''item in collection was added to view'''
         self.tagframe.tag_cloud_view[view].add(item)
@@ -195,6 +218,18 @@ class TagSidebarPlugin(pluginbase.Plugin):
         '''item in collection was removed from view'''
         self.tagframe.tag_cloud_view[view].remove(item)
         self.thread_refresh()
+    def t_collection_items_added_to_view(self,collection,view,items):
+        '''a batch of items in collection was added to view'''
+        cloud=self.tagframe.tag_cloud_view[view]
+        for item in items:
+            cloud.add(item)
+        self.thread_refresh()
+    def t_collection_items_removed_from_view(self,collection,view,items):
+        '''a batch of items in collection was removed from view'''
+        cloud=self.tagframe.tag_cloud_view[view]
+        for item in items:
+            cloud.remove(item)
+        self.thread_refresh()
     def t_collection_modify_start_hint(self,collection):
 #        if collection!=self.worker.active_collection:
 #            return
@@ -131,7 +131,7 @@ class TransferImportJob(backend.WorkerJob):
             if self.browser:
                 gobject.idle_add(self.browser.update_status,2,'Transfer Complete')
             gobject.idle_add(self.plugin.transfer_completed)
-            pluginmanager.mgr.resume_collection_events(self.collection)
+            pluginmanager.mgr.resume_collection_events(self.collection_dest)
             self.collection_src=None
             self.collection_dest=None
             #jobs['VERIFYIMAGES'].setevent()
@@ -90,9 +90,9 @@ else:
 
 plugins_disabled=[]
 
-max_memthumbs=1000
-max_memimages=3
-precache_count=500 ##not currently used
+memcache_fraction=0.25 #fraction of the available system memory used to keep thumbnails and images in memory (see memcache.py)
+memcache_max_mb=0 #if non-zero, overrides memcache_fraction with a fixed limit in megabytes
+precache_count=500 ##maximum number of thumbnails the browser loads ahead of the visible items when scrolling
 
 #Not currently saved to disk
 edit_command_line='gimp'
@@ -107,6 +107,12 @@ raw_image_types = {
 'image/x-olympus-orf':[dcraw_cmd],
 }
 video_thumbnailer='totem-video-thumbnailer -j "%s" /dev/stdout'
+metadata_processes=0 #number of processes used to read metadata when scanning collections (0 - one per cpu, 1 - read on the worker thread)
+viewer_prefetch_count=1 #number of images either side of the current image that the viewer loads ahead of time
+thumbnail_processes=0 #number of processes used to create thumbnails (0 - one per cpu, 1 - create on the worker thread)
+worker_lanes=True #run directory scans and thumbnail creation on their own threads (False - run all jobs on one thread)
+stat_threads=0 #number of threads used to stat files when scanning and verifying collections (e.g. 16 to hide network file system latency, 0 - stat on the worker thread)
+collection_checkpoint_interval=60 #seconds between appending changed items to the collection item store log
 
 #the following are saved in the global settings file
 layout={}  #the layout of the user interface
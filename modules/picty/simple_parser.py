@@ -101,6 +101,95 @@ def call_tree(rtype,tree,conv,*args):
         return tree
 
 
+class Conversion:
+    '''
+    a conversion function split into a parse step that only depends on the literal (called once when
+    the tree is compiled) and a test called with the parsed literal and the caller defined arguments.
+    if test is None the parsed literal is the result of the conversion.
+    calling the conversion is equivalent to test(parse(literal),*args)
+    '''
+    def __init__(self,parse,test=None):
+        self.parse=parse
+        self.test=test
+    def __call__(self,literal,*args):
+        value=self.parse(literal)
+        if self.test is None:
+            return value
+        return self.test(value,*args)
+
+
+class _Literal:
+    'wraps the value of a literal in a compiled tree (it does not need to be evaluated for each call)'
+    def __init__(self,value):
+        self.value=value
+
+def _compile_leaf(rtype,leaf,conv):
+    if rtype and type(leaf)!=rtype:
+        try:
+            fn=conv[(type(leaf),rtype)]
+        except KeyError:
+            return _Literal('')
+        if isinstance(fn,Conversion):
+            value=fn.parse(leaf)
+            if fn.test is None:
+                return _Literal(value)
+            test=fn.test
+            def call_test(*args):
+                return test(value,*args)
+            return call_test
+        def call_conv(*args):
+            return fn(leaf,*args)
+        return call_conv
+    return _Literal(leaf)
+
+def _compile_node(rtype,tree,conv):
+    if type(tree)!=list:
+        return _compile_leaf(rtype,tree,conv)
+    op,l_type,r_type=tree[0]
+    l=_compile_node(l_type,tree[1],conv)
+    r=_compile_node(r_type,tree[2],conv)
+    ##specialize the node for literal operands so that they are passed directly
+    ##both operands are always evaluated (as in call_tree) because the token callables can have side effects
+    if isinstance(l,_Literal) and isinstance(r,_Literal):
+        lval,rval=l.value,r.value
+        def node(*args):
+            return op(lval,rval,*args)
+    elif isinstance(l,_Literal):
+        lval=l.value
+        def node(*args):
+            return op(lval,r(*args),*args)
+    elif isinstance(r,_Literal):
+        rval=r.value
+        def node(*args):
+            return op(l(*args),rval,*args)
+    else:
+        def node(*args):
+            return op(l(*args),r(*args),*args)
+    return node
+
+def compile_tree(rtype,tree,conv):
+    '''
+    compiles the parse tree into a function that takes the caller defined arguments
+    compile_tree(rtype,tree,conv)(*args) returns the same result as call_tree(rtype,tree,conv,*args)
+    but the tree is only walked (and the literal conversions looked up) once and the parse step
+    of Conversion functions is only run once for each literal
+    '''
+    fn=_compile_node(rtype,tree,conv)
+    if isinstance(fn,_Literal):
+        value=fn.value
+        def literal(*args):
+            return value
+        return literal
+    return fn
+
+def filter_items(fn,items,*args):
+    '''
+    returns the list of members of items for which the compiled tree fn returns a true value
+    each item is passed to fn as the first caller defined argument, followed by args
+    '''
+    return [item for item in items if fn(item,*args)]
+
+
 if __name__=='__main__':
     def contains_tag(l,r,*args):
         return True
@@ -151,3 +240,4 @@ if __name__=='__main__':
         tree=parse_expr(TOKENS[:],expr)
         print 'tree',tree
         print 'result',call_tree(bool,tree,converter)
+        print 'compiled result',compile_tree(bool,tree,converter)()
@@ -0,0 +1,240 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+thumbpool.py
+
+Decodes and downscales images for thumbnails in a pool of processes. Jobs on the worker
+thread queue items with the engine and collect the finished thumbnails as they complete,
+passing them to collection.make_thumbnail(item,preloaded=result) to create the pixbuf
+(and save it to the desktop thumbnail cache if the collection uses it)
+'''
+
+import collections
+import mimetypes
+import os
+import threading
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing=None
+
+import settings
+import imagemanip
+
+PENDING_PER_PROCESS=2 #number of images submitted to the pool for each process
+
+_pool=None
+_pool_processes=0
+_pool_failed=False
+_pool_lock=threading.Lock()
+
+
+def get_pool():
+    '''
+    returns the thumbnail process pool, creating it on first use
+    returns None if the pool is disabled or unavailable on this platform
+    '''
+    global _pool,_pool_processes,_pool_failed
+    if _pool is not None or _pool_failed:
+        return _pool
+    if multiprocessing is None or settings.thumbnail_processes==1:
+        _pool_failed=True
+        return None
+    _pool_lock.acquire()
+    try:
+        if _pool is None and not _pool_failed:
+            _pool_processes=settings.thumbnail_processes
+            if _pool_processes<=0:
+                _pool_processes=multiprocessing.cpu_count()
+            _pool=multiprocessing.Pool(_pool_processes)
+    except:
+        print 'Error starting thumbnail process pool, thumbnails will be created on the worker thread'
+        import traceback,sys
+        print traceback.format_exc(sys.exc_info()[2])
+        _pool_failed=True
+        _pool=None
+    finally:
+        _pool_lock.release()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool=None
+
+
+def make_thumb_data(task):
+    '''
+    task function run in the pool processes. task is a tuple (itemfile,meta,cache_file)
+    returns a tuple (success,mode,size,data,thumburi) where data is the raw pixel data of the thumbnail
+    if cache_file is not None the thumbnail is also saved there as a png and returned as thumburi
+    '''
+    itemfile,meta,cache_file=task
+    try:
+        mimetype=mimetypes.guess_type(itemfile)[0]
+        if mimetype and mimetype.startswith('video'):
+            return (False,None,None,None,None)
+        image=imagemanip.make_thumb_image(itemfile,meta)
+        if image.mode not in ('RGB','RGBA'):
+            image=image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        thumburi=None
+        if cache_file is not None:
+            cache=os.path.split(cache_file)[0]
+            if not os.path.exists(cache):
+                try:
+                    os.makedirs(cache)
+                except OSError: #another process may have created it
+                    pass
+            image.save(cache_file,'png')
+            thumburi=cache_file
+        return (True,image.mode,image.size,image.tobytes(),thumburi)
+    except:
+        print 'Error creating thumbnail in process pool for',itemfile
+        import traceback,sys
+        print traceback.format_exc(sys.exc_info()[2])
+        return (False,None,None,None,None)
+
+
+class ThumbnailEngine:
+    '''
+    feeds items to the thumbnail process pool. urgent items (e.g. those currently displayed
+    in the browser) are always submitted ahead of the rest of the queue. used by jobs on the worker's
+    interactive and cpu lanes, so the queues are protected by a lock
+    '''
+    def __init__(self):
+        self.backlog=collections.deque() #(collection,item)
+        self.urgent=collections.deque() #(collection,item)
+        self.inflight=[] #(collection,item,is_urgent,async_result)
+        self.queued=set() #(collection id,uid) of everything in the engine
+        self.urgent_count=0
+        self.lock=threading.RLock()
+
+    def enabled(self,collection):
+        'returns True if thumbnails for the collection can be created by the pool'
+        c=collection
+        return c.local_filesystem and not c.load_embedded_thumbs and not c.load_preview_icons and get_pool() is not None
+
+    def put(self,collection,item,urgent=False):
+        key=(id(collection),item.uid)
+        self.lock.acquire()
+        try:
+            if key in self.queued:
+                return
+            self.queued.add(key)
+            if urgent:
+                self.urgent.append((collection,item))
+                self.urgent_count+=1
+            else:
+                self.backlog.append((collection,item))
+            self._submit()
+        finally:
+            self.lock.release()
+
+    def cancel_urgent(self,collection):
+        '''
+        drop urgent items for collection that have not yet been submitted to the pool
+        (called when the set of items on screen changes)
+        '''
+        self.lock.acquire()
+        keep=collections.deque()
+        for c,item in self.urgent:
+            if c==collection:
+                self.queued.discard((id(c),item.uid))
+                self.urgent_count-=1
+            else:
+                keep.append((c,item))
+        self.urgent=keep
+        self.lock.release()
+
+    def cancel(self,collection):
+        'drop all items for collection that have not yet been submitted to the pool'
+        self.lock.acquire()
+        self.cancel_urgent(collection)
+        keep=collections.deque()
+        for c,item in self.backlog:
+            if c==collection:
+                self.queued.discard((id(c),item.uid))
+            else:
+                keep.append((c,item))
+        self.backlog=keep
+        self.lock.release()
+
+    def full(self):
+        'returns True if producers should collect some results before queueing more items'
+        return len(self.backlog)>=PENDING_PER_PROCESS*max(_pool_processes,1)
+
+    def __len__(self):
+        return len(self.queued)
+
+    def _submit(self):
+        pool=get_pool()
+        while len(self.inflight)<PENDING_PER_PROCESS*max(_pool_processes,1) and (self.urgent or self.backlog):
+            if self.urgent:
+                collection,item=self.urgent.popleft()
+                is_urgent=True
+            else:
+                collection,item=self.backlog.popleft()
+                is_urgent=False
+            cache_file=None
+            if collection.store_thumbnails and collection.thumbnail_cache_dir is not None:
+                cache_file=imagemanip.thumb_cache_path(item,collection.thumbnail_cache_dir)
+            task=(collection.get_path(item),item.meta,cache_file)
+            self.inflight.append((collection,item,is_urgent,pool.apply_async(make_thumb_data,(task,))))
+
+    def get_ready(self,timeout=0):
+        '''
+        returns a list of (collection,item,result) for the thumbnails that have been completed
+        waits up to timeout seconds for the oldest submitted item if none are complete
+        '''
+        inflight=self.inflight
+        if timeout>0 and inflight and not any(r[3].ready() for r in inflight):
+            inflight[0][3].wait(timeout) #without holding the lock
+        results=[]
+        pending=[]
+        self.lock.acquire()
+        try:
+            for collection,item,is_urgent,async_result in self.inflight:
+                if not async_result.ready():
+                    pending.append((collection,item,is_urgent,async_result))
+                    continue
+                try:
+                    result=async_result.get()
+                except:
+                    print 'Error creating thumbnail in process pool'
+                    import traceback,sys
+                    print traceback.format_exc(sys.exc_info()[2])
+                    result=(False,None,None,None,None)
+                self.queued.discard((id(collection),item.uid))
+                if is_urgent:
+                    self.urgent_count-=1
+                results.append((collection,item,result))
+            self.inflight=pending
+            self._submit()
+        finally:
+            self.lock.release()
+        return results
+
+
+engine=ThumbnailEngine()
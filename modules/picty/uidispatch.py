@@ -0,0 +1,121 @@
+'''
+
+    picty
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+'''
+uidispatch.py
+
+Passes UI update requests from the worker thread to the gtk main loop. Requests are queued and
+flushed together at most once per FRAME_INTERVAL. Requests to refresh the browser or the status
+bar (see COALESCED) replace any pending request with the same (callback, collection) key, so a job
+that asks for a redraw after every item only causes one redraw per frame. Other requests are
+run once each, in the order they were made.
+'''
+
+##standard imports
+import collections
+import threading
+import time
+
+##gtk imports
+import gobject
+
+##picty imports
+from logger import log
+
+FRAME_INTERVAL=0.04 #minimum number of seconds between flushes of the pending requests
+
+##callbacks whose pending requests can be replaced by a later request. the value is True if
+##requests are keyed by their first argument (the collection) as well as the callback
+COALESCED={
+    'resize_and_refresh_view':True,
+    'redraw_view':True,
+    'refresh_view':True,
+    'update_status':False,
+    'update_backstatus':False,
+    }
+
+
+class UIDispatcher:
+    def __init__(self,frame_interval=FRAME_INTERVAL):
+        self.frame_interval=frame_interval
+        self.pending=collections.OrderedDict() #key -> (callback,args) in the order they will be run
+        self.scheduled=False
+        self.last_flush=0
+        self.count=0 #unique key for requests that aren't coalesced
+        self.requested=0
+        self.coalesced=0
+        self.lock=threading.Lock()
+
+    def key(self,callback,args):
+        'returns the key used to coalesce requests for callback, or None if it should always be run'
+        try:
+            keyed=COALESCED[callback.__name__]
+        except (KeyError,AttributeError):
+            return None
+        if keyed:
+            return (callback,args[0] if args else None)
+        return (callback,)
+
+    def add(self,callback,*args):
+        'request callback(*args) to be run on the gtk main loop'
+        key=self.key(callback,args)
+        self.lock.acquire()
+        try:
+            self.requested+=1
+            if key is None:
+                self.count+=1
+                key=self.count
+            elif self.pending.pop(key,None) is not None:
+                self.coalesced+=1
+            self.pending[key]=(callback,args)
+            if not self.scheduled:
+                self.scheduled=True
+                delay=self.last_flush+self.frame_interval-time.time()
+                if delay>0:
+                    gobject.timeout_add(int(delay*1000)+1,self.flush)
+                else:
+                    gobject.idle_add(self.flush)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        'run the pending requests (called on the gtk main loop)'
+        self.lock.acquire()
+        pending=self.pending
+        self.pending=collections.OrderedDict()
+        self.scheduled=False
+        self.last_flush=time.time()
+        self.lock.release()
+        for callback,args in pending.itervalues():
+            try:
+                callback(*args)
+            except:
+                print 'Error running UI update',callback
+                import traceback,sys
+                print traceback.format_exc(sys.exc_info()[2])
+        return False
+
+    def log_stats(self):
+        log.info('UI dispatcher: %i requests, %i coalesced',self.requested,self.coalesced)
+
+
+dispatcher=UIDispatcher()
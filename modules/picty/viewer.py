@@ -34,6 +34,7 @@ gobject.threads_init()
 import settings
 from fstools import io
 import imagemanip
+import memcache
 import pluginmanager
 import metadata
 import viewsupport
@@ -43,21 +44,24 @@ from uitools import overlay_widgets
 class ImageLoader:
     '''
     Class to load full size images into memory on a background thread,
-    notifying the viewer on completion
+    notifying the viewer on completion. once the current image is displayed, the
+    neighbouring items in the view are decoded and sized to fit the screen ahead of time
     '''
     def __init__(self,viewer):
         self.thread=threading.Thread(target=self._background_task)
         self.item=None
         self.sizing=None
         self.zoom='fit'
-        self.memimages = []
-        self.max_memimages=2
         self.vlock=threading.Lock() #viewer lock -- main thread should acquire lock before touch item image properties (image, qimage, size etc)
         self.viewer=viewer
         self.want_transforms=True
         self.event=threading.Event()
         self.exit=False
         self.plugin=None
+        self.prefetched={} #id(item) -> sizing of the qview created for items loaded ahead of time
+        ##images are first loaded at a reduced scale that is large enough to fill the screen
+        screen_size=max(gtk.gdk.screen_width(),gtk.gdk.screen_height())
+        self.proxy_size=(screen_size,screen_size)
         self.thread.start()
 
     def update_image_size(self,width,height,zoom='fit'):
@@ -91,6 +95,7 @@ class ImageLoader:
         self.vlock.acquire()
         self.plugin=plugin
         self.vlock.release()
+        self.event.set() #plugins work with the full size image
 
     def release_plugin(self,plugin):
         self.vlock.acquire()
@@ -133,18 +138,29 @@ class ImageLoader:
                 continue
             if item.meta==None:
                 self.collection.load_metadata(item)
-            if not item.image:
+            ##a reduced scale proxy is only used to view the whole image: zooming, plugins and transforms
+            ##(which may use pixel coordinates) need the full size image
+            need_full_image=self.zoom!='fit' or self.plugin is not None or (self.want_transforms and item.meta and item.meta.get('ImageTransforms'))
+            prefetched_sizing=self.prefetched.pop(id(item),None)
+            if not item.image or (need_full_image and 'image_draft_scale' in item.__dict__):
+                prefetched_sizing=None
                 def interrupt_cb():
                     return self.item.uid==item.uid
-                print 'Image Viewer - LOADING IMAGE',item,'transforms',self.want_transforms
-                self.collection.load_image(item,interrupt_cb,apply_transforms=self.want_transforms) #todo: load as draft if zoom not required (but need to keep draft status of image to avoid problems)
+                size_bound=None if need_full_image else self.proxy_size
+                print 'Image Viewer - LOADING IMAGE',item,'transforms',self.want_transforms,'size',size_bound
+                self.collection.load_image(item,interrupt_cb,size_bound=size_bound,apply_transforms=self.want_transforms)
                 if not item.image:
                     gobject.idle_add(self.viewer.ImageLoaded,item) #todo: change to image load failed? (the handler currently checks the status so that's enough anyway)
                     self.vlock.acquire()
                     continue
                 gobject.idle_add(self.viewer.ImageLoaded,item)
+            else:
+                memcache.images.touch(item)
             self.vlock.acquire()
-            if self.sizing and self.sizing[0]>0 and self.sizing[1]>0:
+            if self.zoom=='fit' and not self.plugin and item.qview and prefetched_sizing==self.sizing:
+                ##the screen sized image was created while prefetching
+                gobject.idle_add(self.viewer.ImageSized,item,self.zoom,self.sizing)
+            elif self.sizing and self.sizing[0]>0 and self.sizing[1]>0:
                 # determine the require width and height of the scaled image
                 if self.zoom=='fit':
                     (w,h)=self.sizing
@@ -159,6 +175,54 @@ class ImageLoader:
                     if self.plugin:
                         self.plugin.t_viewer_sized((w,h),self.zoom,item)
                 gobject.idle_add(self.viewer.ImageSized,item,self.zoom,self.sizing)
+            sizing=self.sizing
+            self.vlock.release()
+            self._prefetch_neighbours(item,sizing)
+            self.vlock.acquire()
+
+    def _prefetch_neighbours(self,item,sizing):
+        '''
+        decode the items either side of item in the active view and size them to fit the viewer
+        (nearest first, settings.viewer_prefetch_count in each direction). stops as soon as the
+        main thread makes a new request (e.g. the user moves to another image)
+        '''
+        if settings.viewer_prefetch_count<=0 or not sizing or sizing[0]<=0 or sizing[1]<=0:
+            return
+        def interrupt_cb():
+            return self.item is item and not self.exit and not self.event.is_set()
+        try:
+            view=self.collection.get_active_view()
+            ind=view.find_item(item)
+        except:
+            return
+        if ind<0:
+            return
+        neighbours=[]
+        for i in range(1,settings.viewer_prefetch_count+1):
+            neighbours+=[ind+i,ind-i]
+        prefetched={}
+        for i in neighbours:
+            if not interrupt_cb():
+                break
+            if not 0<=i<len(view):
+                continue
+            neighbour=view(i)
+            if neighbour.qview and self.prefetched.get(id(neighbour))==sizing:
+                prefetched[id(neighbour)]=sizing
+                continue
+            if neighbour.meta==None:
+                self.collection.load_metadata(neighbour)
+            if not neighbour.image:
+                need_full_image=self.want_transforms and neighbour.meta and neighbour.meta.get('ImageTransforms')
+                print 'Image Viewer - PREFETCHING IMAGE',neighbour
+                self.collection.load_image(neighbour,interrupt_cb,size_bound=None if need_full_image else self.proxy_size,apply_transforms=self.want_transforms)
+                if not neighbour.image:
+                    continue
+            if not interrupt_cb():
+                break
+            imagemanip.size_image(neighbour,sizing,False,'fit')
+            prefetched[id(neighbour)]=sizing
+        self.prefetched=prefetched
 
 
 class ImageViewer(gtk.VBox):
@@ -267,7 +331,7 @@ class ImageViewer(gtk.VBox):
             self.imarea.connect("key-press-event",key_press_callback)
             self.imarea.connect("key-release-event",key_press_callback)
 
-        pluginmanager.mgr.register_callback('t_collection_item_metadata_changed',self.meta_changed)
+        pluginmanager.mgr.register_callback('t_collection_items_metadata_changed',self.items_meta_changed)
 
 #        self.imarea.set_size_request(128,96)
         self.item=None
@@ -437,6 +501,11 @@ class ImageViewer(gtk.VBox):
         if ntr!=otr:
             self.il.transform_image()
 
+    def items_meta_changed(self,collection,changes):
+        for item,old_meta in changes:
+            if item==self.item:
+                self.meta_changed(collection,item,old_meta)
+
 #    def mouse_enter_signal(self,obj,event):
 #        '''callback when mouse moves in the viewer area (updates image overlay as necessary)'''
 #        if self.item!=None:
@@ -684,11 +753,17 @@ class ImageViewer(gtk.VBox):
             pass
         else:
             self.zoom_level=self.get_zoom()
+        ##zoom levels are relative to the full size image, which replaces a reduced scale proxy before the zoom is applied
+        scale=self.item.__dict__.get('image_draft_scale',1.0)
         if zoom_level=='in':
-            zoom_level=self.zoom_level*1.2
+            zoom_level=self.zoom_level*1.2*scale
         if zoom_level=='out':
-            zoom_level=self.zoom_level/1.2
-        self.zoom_position_request=self.get_position_for_new_zoom(zoom_level,(x,y))
+            zoom_level=self.zoom_level/1.2*scale
+        if zoom_level=='fit' or scale==1.0:
+            self.zoom_position_request=self.get_position_for_new_zoom(zoom_level,(x,y))
+        else:
+            x,y=self.get_position_for_new_zoom(zoom_level/scale,(x,y))
+            self.zoom_position_request=(x/scale,y/scale)
         self.resize_and_refresh_view(zoom=zoom_level)
 
     def screen_xy_to_scaled_image(self,x,y):
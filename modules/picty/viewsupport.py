@@ -30,8 +30,10 @@ this module defines helper functions for:
 ##standard imports
 import bisect
 import datetime
+import math
 import os.path
 import re
+import threading
 
 ##picty imports
 import pluginmanager
@@ -163,6 +165,101 @@ sort_keys_str={
         'Relevance':get_relevance
         }
 
+##sort keys that only depend on the item's file and metadata (and so can be stored by SortKeyColumns)
+cached_sort_keys=('Date Taken','Date Last Modified','File Name','Orientation','Folder','Shutter Speed','Aperture','Focal Length')
+
+_missing=object()
+
+class SortKeyColumns:
+    '''
+    A column store of the sort keys of the items of a collection. Each item is given a slot and
+    each sort key has a column (a list indexed by slot). A key is computed by its callback the first
+    time it is needed and again only after the item's mtime or metadata changes (the metadata is
+    checked by identity, so the collection calls invalidate when it is changed in place).
+    Only the keys named in cached_sort_keys are stored, other keys are always computed.
+    '''
+    def __init__(self,sort_keys):
+        self.sort_keys=sort_keys
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lock.acquire()
+        self.slots={} #item -> slot
+        self.free=[] #slots of removed items available for reuse
+        self.mtimes=[] #the mtime of the item in each slot when its keys were computed
+        self.metas=[] #the metadata of the item in each slot when its keys were computed
+        self.columns={} #sort key name -> list of keys
+        self.lock.release()
+
+    def _slot(self,item):
+        slot=self.slots.get(item)
+        if slot is None:
+            if self.free:
+                slot=self.free.pop()
+            else:
+                slot=len(self.mtimes)
+                self.mtimes.append(None)
+                self.metas.append(None)
+                for col in self.columns.itervalues():
+                    col.append(_missing)
+            self.slots[item]=slot
+        elif self.mtimes[slot]==item.mtime and self.metas[slot] is item.meta:
+            return slot
+        self.mtimes[slot]=item.mtime
+        self.metas[slot]=item.meta
+        for col in self.columns.itervalues():
+            col[slot]=_missing
+        return slot
+
+    def _column(self,name):
+        col=self.columns.get(name)
+        if col is None:
+            col=self.columns[name]=[_missing]*len(self.mtimes)
+        return col
+
+    def keys(self,name,items):
+        'returns the list of the `name` sort keys of items'
+        key_cb=self.sort_keys[name]
+        if name not in cached_sort_keys:
+            return [key_cb(item) for item in items]
+        self.lock.acquire()
+        try:
+            col=self._column(name)
+            keys=[]
+            for item in items:
+                slot=self._slot(item)
+                key=col[slot]
+                if key is _missing:
+                    key=col[slot]=key_cb(item)
+                keys.append(key)
+            return keys
+        finally:
+            self.lock.release()
+
+    def key(self,name,item):
+        return self.keys(name,(item,))[0]
+
+    def invalidate(self,item):
+        'the keys of item will be recomputed when next needed'
+        self.lock.acquire()
+        slot=self.slots.get(item)
+        if slot is not None:
+            self.metas[slot]=_missing
+        self.lock.release()
+
+    def remove(self,item):
+        self.lock.acquire()
+        slot=self.slots.pop(item,None)
+        if slot is not None:
+            self.mtimes[slot]=None
+            self.metas[slot]=None
+            for col in self.columns.itervalues():
+                col[slot]=_missing
+            self.free.append(slot)
+        self.lock.release()
+
+
 def none_filter(l,r,item=None):
     return True
 
@@ -211,11 +308,8 @@ def geotagged_filter(l,r,item):
         return False
     return item.meta['LatLon']
 
-def keyword_filter(item,test):
-    if not test:
-        return True
-    test=test.lower()
-    relevance=0
+def item_text(item):
+    'returns the lowercase text that is searched for keywords: the uid followed by the metadata values'
     item_string=''
     item_string+=item.uid.lower()
     if item.meta!=None:
@@ -226,7 +320,17 @@ def keyword_filter(item,test):
                         item_string+=' '+str(vi).lower()
                 else:
                     item_string+=' '+str(v).lower()
-    item_string=item_string.replace('\n',' ')
+    return item_string.replace('\n',' ')
+
+def keyword_filter(item,test):
+    return keyword_match(test.lower(),item)
+
+def keyword_match(test,item):
+    'keyword_filter for a lower case test (the arguments are in the order used by the filter converter)'
+    if not test:
+        return True
+    relevance=0
+    item_string=item_text(item)
     (left,match,right)=item_string.partition(test)
     while match:
         relevance+=1
@@ -236,6 +340,399 @@ def keyword_filter(item,test):
     item.relevance=relevance
     return relevance>0
 
+class TextIndex:
+    '''
+    An inverted index of the words (space separated) in the item_text of the items of a collection,
+    storing the number of times each word occurs in each item. Searches for a single word are
+    answered from the index with the same result and relevance as keyword_filter.
+    The index is built from the items returned by items_cb the first time it is searched,
+    the collection keeps it up to date by calling add, remove and update.
+    '''
+    CACHE_SIZE=50 #number of search terms whose results are kept (updated as items are added and removed)
+    def __init__(self,items_cb):
+        self.items_cb=items_cb
+        self.lock=threading.RLock()
+        self.reset()
+
+    def reset(self):
+        'discard the index, it is rebuilt on the next search'
+        self.lock.acquire()
+        self.built=False
+        self.postings={} #word -> {item: number of occurrences}
+        self.docs={} #item -> (first word,{word: number of occurrences})
+        self.cache={} #search term -> {item: relevance}
+        self.lock.release()
+
+    def _add(self,item):
+        text=item_text(item)
+        counts={}
+        for w in text.split(' '):
+            if w:
+                counts[w]=counts.get(w,0)+1
+        first=text.split(' ',1)[0]
+        doc=self.docs[item]=(first,counts)
+        for w,n in counts.iteritems():
+            p=self.postings.get(w)
+            if p is None:
+                p=self.postings[w]={}
+            p[item]=n
+        for term,s in self.cache.iteritems():
+            relevance=self._relevance(term,doc)
+            if relevance>0:
+                s[item]=relevance
+
+    def _remove(self,item):
+        doc=self.docs.pop(item,None)
+        if doc is None:
+            return
+        for s in self.cache.itervalues():
+            s.pop(item,None)
+        for w in doc[1]:
+            p=self.postings.get(w)
+            if p is not None:
+                p.pop(item,None)
+                if not p:
+                    del self.postings[w]
+
+    def build(self):
+        self.lock.acquire()
+        try:
+            self.postings={}
+            self.docs={}
+            self.cache={}
+            for item in self.items_cb():
+                self._add(item)
+            self.built=True
+        finally:
+            self.lock.release()
+
+    def add(self,item):
+        self.lock.acquire()
+        try:
+            if self.built:
+                self._remove(item)
+                self._add(item)
+        finally:
+            self.lock.release()
+
+    def remove(self,item):
+        self.lock.acquire()
+        try:
+            if self.built:
+                self._remove(item)
+        finally:
+            self.lock.release()
+
+    def update(self,item,old_meta=None):
+        self.add(item)
+
+    def _relevance(self,term,doc):
+        'returns the relevance of term for the item with doc=(first word,word counts) (the same as scores)'
+        first,counts=doc
+        relevance=0
+        for word,count in counts.iteritems():
+            if term in word:
+                relevance+=count*word.count(term)
+                if word==term:
+                    relevance+=count-(first==word)
+        return relevance
+
+    def scores(self,term):
+        '''
+        returns a dictionary of item -> relevance for the items whose text contains term
+        (term must be lowercase and must not contain spaces)
+        '''
+        self.lock.acquire()
+        try:
+            if not self.built:
+                self.build()
+            s=self.cache.get(term)
+            if s is not None:
+                return s
+            s={}
+            for word,p in self.postings.iteritems():
+                if term not in word:
+                    continue
+                n=word.count(term)
+                for item,count in p.iteritems():
+                    relevance=count*n
+                    if word==term:
+                        ##keyword_filter scores an extra point for each occurrence that is a whole word,
+                        ##except at the start of the text
+                        relevance+=count-(self.docs[item][0]==word)
+                    s[item]=s.get(item,0)+relevance
+            if len(self.cache)>=self.CACHE_SIZE:
+                self.cache={}
+            self.cache[term]=s
+            return s
+        finally:
+            self.lock.release()
+
+    def keyword_filter(self,test,item):
+        'equivalent to keyword_filter(item,test) (the arguments are in the order used by the filter converter)'
+        return self.keyword_match(test.lower(),item)
+
+    def keyword_match(self,test,item):
+        'equivalent to keyword_match(test,item)'
+        if not test:
+            return True
+        if ' ' in test:
+            return keyword_match(test,item)
+        if not self.built:
+            self.build()
+        if item not in self.docs:
+            return keyword_match(test,item)
+        relevance=self.scores(test).get(item,0)
+        item.relevance=relevance
+        return relevance>0
+
+
+class GeoIndex:
+    '''
+    A grid index of the geotagged items (meta['LatLon']) of a collection used to find the items in a
+    region of the map without checking every item. Items are stored in square cells of CELL_SIZE degrees.
+    Clusters of items (count, mean position and a representative item) are kept for each zoom level
+    that has been asked for, where level n has cells of 360/2**n degrees (the cells of each level are
+    unions of the grid cells, up to GRID_LEVEL). The clusters of the levels above GRID_LEVEL (up to MAX_LEVEL)
+    are smaller than a grid cell, they are computed from the items in the region when they are asked for.
+    The index is built from the items returned by items_cb
+    the first time it is used, the collection keeps it up to date by calling add, remove and update.
+    Regions are given as (lat0,lon0,lat1,lon1) with (lat0,lon0) the top left corner, as in imagemanip.item_in_region
+    '''
+    GRID_LEVEL=10
+    CELL_SIZE=360.0/2**GRID_LEVEL
+    MAX_LEVEL=20
+    def __init__(self,items_cb):
+        self.items_cb=items_cb
+        self.lock=threading.RLock()
+        self.reset()
+
+    def reset(self):
+        'discard the index, it is rebuilt when next used'
+        self.lock.acquire()
+        self.built=False
+        self.cells={} #(row,column) -> set of items
+        self.coords={} #item -> (lat,lon)
+        self.levels={} #level -> {(row,column): [count,lat sum,lon sum,representative item or None]}
+        self.lock.release()
+
+    def __len__(self):
+        return len(self.coords)
+
+    def _item_coords(self,item):
+        try:
+            lat,lon=item.meta['LatLon']
+            lat,lon=float(lat),float(lon)
+        except:
+            return None
+        if not (-90.0<=lat<=90.0 and -180.0<=lon<=180.0):
+            return None
+        return lat,lon
+
+    def _key(self,lat,lon,size):
+        return (int(math.floor(lat/size)),int(math.floor(lon/size)))
+
+    def _add(self,item):
+        c=self._item_coords(item)
+        if c is None:
+            return
+        self.coords[item]=c
+        key=self._key(c[0],c[1],self.CELL_SIZE)
+        try:
+            self.cells[key].add(item)
+        except KeyError:
+            self.cells[key]=set([item])
+        for level,clusters in self.levels.iteritems():
+            key=self._key(c[0],c[1],360.0/2**level)
+            cluster=clusters.get(key)
+            if cluster is None:
+                clusters[key]=[1,c[0],c[1],item]
+            else:
+                cluster[0]+=1
+                cluster[1]+=c[0]
+                cluster[2]+=c[1]
+                if cluster[3] is None:
+                    cluster[3]=item
+
+    def _remove(self,item):
+        c=self.coords.pop(item,None)
+        if c is None:
+            return
+        key=self._key(c[0],c[1],self.CELL_SIZE)
+        cell=self.cells.get(key)
+        if cell is not None:
+            cell.discard(item)
+            if not cell:
+                del self.cells[key]
+        for level,clusters in self.levels.iteritems():
+            key=self._key(c[0],c[1],360.0/2**level)
+            cluster=clusters.get(key)
+            if cluster is None:
+                continue
+            cluster[0]-=1
+            if cluster[0]<=0:
+                del clusters[key]
+                continue
+            cluster[1]-=c[0]
+            cluster[2]-=c[1]
+            if cluster[3]==item:
+                cluster[3]=None #a new representative is chosen when the cluster is next returned
+
+    def build(self):
+        self.lock.acquire()
+        try:
+            self.cells={}
+            self.coords={}
+            self.levels={}
+            for item in self.items_cb():
+                self._add(item)
+            self.built=True
+        finally:
+            self.lock.release()
+
+    def add(self,item):
+        self.lock.acquire()
+        try:
+            if self.built:
+                self._remove(item)
+                self._add(item)
+        finally:
+            self.lock.release()
+
+    def remove(self,item):
+        self.lock.acquire()
+        try:
+            if self.built:
+                self._remove(item)
+        finally:
+            self.lock.release()
+
+    def update(self,item,old_meta=None):
+        self.add(item)
+
+    def _keys_in_region(self,table,size,lat0,lon0,lat1,lon1):
+        'returns the keys of table for the cells of the given size that overlap the region'
+        r0,c0=self._key(lat1,lon0,size)
+        r1,c1=self._key(lat0,lon1,size)
+        if (r1-r0+1)*(c1-c0+1)<=len(table):
+            return [(r,c) for r in xrange(r0,r1+1) for c in xrange(c0,c1+1) if (r,c) in table]
+        return [k for k in table if r0<=k[0]<=r1 and c0<=k[1]<=c1]
+
+    def query(self,lat0,lon0,lat1,lon1,limit=None):
+        '''
+        returns a list of the items whose geolocation is in the region (at most limit items if limit is not None)
+        '''
+        self.lock.acquire()
+        try:
+            if not self.built:
+                self.build()
+            result=[]
+            for key in self._keys_in_region(self.cells,self.CELL_SIZE,lat0,lon0,lat1,lon1):
+                for item in self.cells[key]:
+                    lat,lon=self.coords[item]
+                    if lat1<=lat<=lat0 and lon0<=lon<=lon1:
+                        result.append(item)
+                        if limit is not None and len(result)>=limit:
+                            return result
+            return result
+        finally:
+            self.lock.release()
+
+    def level_for_region(self,lat0,lon0,lat1,lon1,columns=8):
+        'returns the cluster level that divides the width of the region into about `columns` clusters'
+        width=max(lon1-lon0,360.0/2**self.MAX_LEVEL)
+        level=int(math.ceil(math.log(360.0*columns/width,2)))
+        return max(0,min(level,self.MAX_LEVEL))
+
+    def clusters(self,level,lat0,lon0,lat1,lon1):
+        '''
+        returns a list of (count,lat,lon,item) for the clusters at the zoom level that overlap the region,
+        where (lat,lon) is the mean position of the items in the cluster and item is a representative item.
+        clusters are clipped to the region: only the items of the cluster that are in the region are counted
+        '''
+        self.lock.acquire()
+        try:
+            if not self.built:
+                self.build()
+            level=max(0,min(level,self.MAX_LEVEL))
+            size=360.0/2**level
+            if level>self.GRID_LEVEL:
+                return self._region_clusters(size,lat0,lon0,lat1,lon1)
+            clusters=self.levels.get(level)
+            if clusters is None:
+                clusters=self.levels[level]={}
+                for item,(lat,lon) in self.coords.iteritems():
+                    key=self._key(lat,lon,size)
+                    cluster=clusters.get(key)
+                    if cluster is None:
+                        clusters[key]=[1,lat,lon,item]
+                    else:
+                        cluster[0]+=1
+                        cluster[1]+=lat
+                        cluster[2]+=lon
+            result=[]
+            for key in self._keys_in_region(clusters,size,lat0,lon0,lat1,lon1):
+                cluster=clusters[key]
+                if not (lat1<=key[0]*size and (key[0]+1)*size<=lat0 and lon0<=key[1]*size and (key[1]+1)*size<=lon1):
+                    cluster=self._clip(key,size,lat0,lon0,lat1,lon1)
+                    if cluster is not None:
+                        result.append(cluster)
+                    continue
+                if cluster[3] is None:
+                    cluster[3]=self._representative(key,size)
+                result.append((cluster[0],cluster[1]/cluster[0],cluster[2]/cluster[0],cluster[3]))
+            return result
+        finally:
+            self.lock.release()
+
+    def _region_clusters(self,size,lat0,lon0,lat1,lon1):
+        'returns the list of (count,lat,lon,item) for the clusters of the items in the region with cells of the given size'
+        clusters={}
+        for item in self.query(lat0,lon0,lat1,lon1):
+            lat,lon=self.coords[item]
+            key=self._key(lat,lon,size)
+            cluster=clusters.get(key)
+            if cluster is None:
+                clusters[key]=[1,lat,lon,item]
+            else:
+                cluster[0]+=1
+                cluster[1]+=lat
+                cluster[2]+=lon
+        return [(c[0],c[1]/c[0],c[2]/c[0],c[3]) for c in clusters.itervalues()]
+
+    def _clip(self,key,size,lat0,lon0,lat1,lon1):
+        'returns (count,lat,lon,item) for the items of the cluster with key that are in the region or None if there are none'
+        count=0
+        latsum=lonsum=0.0
+        rep=None
+        clat0=min(lat0,(key[0]+1)*size)
+        clon0=max(lon0,key[1]*size)
+        clat1=max(lat1,key[0]*size)
+        clon1=min(lon1,(key[1]+1)*size)
+        for k in self._keys_in_region(self.cells,self.CELL_SIZE,clat0,clon0,clat1,clon1):
+            for item in self.cells[k]:
+                lat,lon=self.coords[item]
+                if lat1<=lat<=lat0 and lon0<=lon<=lon1 and self._key(lat,lon,size)==key:
+                    count+=1
+                    latsum+=lat
+                    lonsum+=lon
+                    if rep is None:
+                        rep=item
+        if count==0:
+            return None
+        return (count,latsum/count,lonsum/count,rep)
+
+    def _representative(self,key,size):
+        'returns an item in the cluster with key at the level with cells of the given size'
+        lat0=(key[0]+1)*size
+        lon0=key[1]*size
+        for k in self._keys_in_region(self.cells,self.CELL_SIZE,lat0,lon0,key[0]*size,(key[1]+1)*size):
+            for item in self.cells[k]:
+                if self._key(self.coords[item][0],self.coords[item][1],size)==key:
+                    return item
+        return None
+
+
 class FolderEquals:
     def __init__(self,subfolders = False):
         if subfolders:
@@ -398,6 +895,9 @@ def _and(l,r,item):
 def str2bool(val,item):
     return keyword_filter(item,val)
 
+def str2lower(val):
+    return val.lower()
+
 
 def str2datetime(val,item=None):
     match=date_re.match(val) ##todo: should only need to do this once per search not for every item
@@ -413,7 +913,7 @@ def str2datetime(val,item=None):
     return datetime.datetime(*date_list)
 
 def str2datetime_list(val,item=None):
-    match=date_re.match(val) ##todo: should only need to do this once per search not for every item
+    match=date_re.match(val)
     if not match:
         return False
     date_list=[]
@@ -429,11 +929,58 @@ literal_converter={
 (str,DateTime):str2datetime_list
 }
 
+##keywords are lower cased and dates are parsed once when a filter tree is compiled (see simple_parser.Conversion)
 converter={
-(str,bool):str2bool,
-(str,DateTime):str2datetime_list
+(str,bool):sp.Conversion(str2lower,keyword_match),
+(str,DateTime):sp.Conversion(str2datetime_list)
 }
 
+def narrows_query(old_expr,new_expr):
+    '''
+    returns True if every item that matches the filter expression new_expr also matches old_expr:
+    old_expr is empty, new_expr adds an & term to old_expr, or both are keywords and new_expr
+    contains old_expr (e.g. the user typed more characters)
+    '''
+    old_expr=old_expr.strip()
+    new_expr=new_expr.strip()
+    if old_expr==new_expr or new_expr.startswith('lastview&'):
+        return False
+    if not old_expr:
+        return True
+    if not new_expr.startswith(old_expr) or old_expr.count('"')%2!=0:
+        return False
+    ##a space (outside quotes) is an OR operator with the lowest precedence, so the & only narrows if there are none
+    if new_expr[len(old_expr):].lstrip().startswith('&'):
+        return len(sp.split_expr(' ',new_expr,sp.test_token_space))==1
+    try:
+        old_tree=sp.parse_expr(TOKENS[:],old_expr,literal_converter)
+        new_tree=sp.parse_expr(TOKENS[:],new_expr,literal_converter)
+    except:
+        return False
+    return type(old_tree)==str and type(new_tree)==str and old_tree.lower() in new_tree.lower()
+
+##filter tokens whose result depends on the state of the item rather than its file and metadata
+volatile_filter_tokens=('selected','thumb')
+
+def cacheable_query(expr):
+    'returns True if the result of filtering with expr only changes when the collection changes'
+    for token in volatile_filter_tokens:
+        if token in expr:
+            return False
+    return True
+
+def search_converter(collection):
+    '''
+    returns the converter to use when filtering the items of collection: keywords are looked up
+    in the collection's text_index if it has one
+    '''
+    text_index=getattr(collection,'text_index',None)
+    if text_index is None:
+        return converter
+    conv=dict(converter)
+    conv[(str,bool)]=sp.Conversion(str2lower,text_index.keyword_match)
+    return conv
+
 
 
 TOKENS=[
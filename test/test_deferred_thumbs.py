@@ -0,0 +1,52 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty.baseobjects import Item
+    from picty.backend import DeferredThumbQueue
+
+    c1 = 'collection1'
+    c2 = 'collection2'
+
+    print 'Test 1'
+    ##only the first item queued for a collection needs a job, until the job finishes
+    queue = DeferredThumbQueue()
+    assert(queue.put(c1, Item('a')))
+    assert(not queue.put(c1, Item('b')))
+    assert(queue.put(c2, Item('a')))
+    assert(queue.count(c1) == 2 and queue.count(c2) == 1)
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##an item queued again is only queued once, at the end of the queue
+    a = Item('a')
+    assert(not queue.put(c1, a))
+    assert(queue.count(c1) == 2)
+    batch = queue.pop_batch(c1, 1)
+    assert([item.uid for item in batch] == ['b'])
+    assert(queue.pop_batch(c1, 10) == [a])
+    assert(queue.pop_batch(c1, 10) == [])
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##the job can only finish once the queue of its collection is empty
+    assert(not queue.put(c1, Item('c')))
+    assert(not queue.finish(c1))
+    assert(not queue.put(c1, Item('d')))
+    assert([item.uid for item in queue.pop_batch(c1, 10)] == ['c', 'd'])
+    assert(queue.finish(c1))
+    assert(queue.put(c1, Item('e')))
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##removed items are dropped and clearing a collection (the job was cancelled) means a new job is needed
+    assert(queue.discard(c1, 'e'))
+    assert(not queue.discard(c1, 'e'))
+    assert(not queue.put(c1, Item('f')))
+    queue.clear(c1)
+    assert(queue.count(c1) == 0 and queue.count(c2) == 1)
+    assert(queue.put(c1, Item('g')))
+    assert(not queue.put(c2, Item('h')))
+    print 'Test 4 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,79 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects
+    from picty import backend, pluginmanager, pluginbase
+    import random
+
+    def state(item):
+        return (item.meta, item.__dict__.get('meta_backup'))
+
+    def new_item(meta):
+        item = baseobjects.Item('1.jpg')
+        item.meta = dict(meta)
+        return item
+
+    print 'Test 1'
+    ##applying a dictionary of changes leaves the item with the same metadata and backup as setting each key in turn
+    random.seed(1)
+    original = {'Title': 'title', 'Artist': 'artist', 'Keywords': ['cat']}
+    values = ['title', 'artist', 'other', '', None, ['cat'], ['dog']]
+    for i in range(500):
+        a = new_item(original)
+        b = new_item(original)
+        for j in range(random.randint(1, 4)): ##later edits can revert the earlier ones
+            changes = dict((key, random.choice(values)) for key in random.sample(['Title', 'Artist', 'Keywords', 'Rating'], random.randint(1, 3)))
+            before = dict(a.meta)
+            old = a.apply_meta_changes(changes)
+            for key, value in changes.iteritems():
+                b.set_meta_key(key, value)
+            assert(state(a) == state(b))
+            assert(old == (None if a.meta == before else before))
+    item = new_item(original)
+    assert(item.apply_meta_changes({'Rating': ''}) is not None and item.meta['Rating'] == '')
+    assert(item.apply_meta_changes({'Rating': ''}) is not None and not item.is_meta_changed()) ##'' removes a key not in the backup
+    assert(item.apply_meta_changes({'Title': None}) is not None)
+    assert(state(item) == ({'Artist': 'artist', 'Keywords': ['cat']}, original))
+    assert(item.apply_meta_changes({'Title': 'title'}) is not None and not item.is_meta_changed())
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##the collection and plugins are notified once for each batch of edits, with the items that changed
+    calls = []
+    class BatchPlugin(pluginbase.Plugin):
+        name = 'Batch'
+        def t_collection_items_metadata_changed(self, collection, changes):
+            calls.append(list(changes))
+    pluginmanager.mgr.plugins['Batch'] = [BatchPlugin(), BatchPlugin]
+    updates = []
+    class Collection(baseobjects.CollectionBase):
+        def items_metadata_update(self, changes):
+            updates.append(list(changes))
+    collection = Collection()
+    items = [new_item(original) for i in range(3)]
+    changes = collection.edit_metadata([(items[0], {'Title': 'new'}), (items[1], {'Title': 'title'}), (items[2], {'Artist': None})])
+    assert(changes == [(items[0], original), (items[2], original)])
+    assert(calls == [changes] and updates == [changes])
+    assert(collection.edit_metadata([(items[1], {'Title': 'title'})]) == [] and len(calls) == 1)
+    del pluginmanager.mgr.plugins['Batch']
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##the keyword edits of an EditMetaDataJob
+    def job(mode, keyword_string='', meta=None):
+        return backend.EditMetaDataJob(None, None, None, mode, meta, keyword_string)
+    kw = ['Cat', 'dog']
+    assert(job(backend.ADD_KEYWORDS, 'cat bird "big fish"').keyword_changes(kw) == ['Cat', 'dog', 'bird', 'big fish'])
+    assert(job(backend.REMOVE_KEYWORDS, 'CAT bird').keyword_changes(kw) == ['dog'])
+    assert(job(backend.RENAME_KEYWORDS, 'dog hound').keyword_changes(kw) == ['Cat', 'hound'])
+    assert(job(backend.TOGGLE_KEYWORDS, 'cat dog').keyword_changes(kw) == [])
+    assert(job(backend.TOGGLE_KEYWORDS, 'cat bird').keyword_changes(kw) == ['Cat', 'dog', 'bird'])
+    item = new_item({'Keywords': kw})
+    assert(job(backend.ADD_KEYWORDS, 'dog').changes(item) == {})
+    assert(job(backend.REMOVE_KEYWORDS, 'cat dog').changes(item) == {'Keywords': None})
+    assert(job(backend.ADD_KEYWORDS, 'bird').changes(new_item({})) == {'Keywords': ['bird']})
+    assert(job(backend.CHANGE_META, meta={'Title': 'new'}).changes(item) == {'Title': 'new'})
+    print 'Test 3 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,108 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty.fstools import eventqueue
+    from picty.fstools.eventqueue import EventQueue
+    import threading
+    import time
+
+    eventqueue.QUIET_DELAY = 0.05
+    eventqueue.MAX_DELAY = 0.5
+    eventqueue.PAIR_TIMEOUT = 0.1
+
+    batches = []
+    flushed = threading.Event()
+    def flush_cb(batch):
+        batches.append(batch)
+        flushed.set()
+
+    def wait_flush():
+        assert(flushed.wait(2.0))
+        flushed.clear()
+        result = batches[:]
+        del batches[:]
+        return result
+
+    queue = EventQueue(flush_cb)
+    c = 'collection'
+    d = os.path.join('/photos', 'dir')
+    d2 = os.path.join('/photos', 'dir2')
+
+    print 'Test 1'
+    ##only the last event for each path is kept and the events are flushed once they are quiet
+    queue.add(c, '/photos/1.jpg', 'CREATE', False)
+    queue.add(c, '/photos/2.jpg', 'MODIFY', False)
+    queue.add(c, '/photos/1.jpg', 'MODIFY', False)
+    queue.add(c, '/photos/1.jpg', 'MODIFY', False)
+    assert(wait_flush() == [[(c, '/photos/2.jpg', 'MODIFY', False, None), (c, '/photos/1.jpg', 'MODIFY', False, None)]])
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##a MOVED_FROM/MOVED_TO pair is a rename, an unpaired MOVED_FROM is a move out of the collection
+    queue.add(c, '/photos/3.jpg', 'MOVED_FROM', False, 1)
+    queue.add(c, '/photos/4.jpg', 'MOVED_TO', False, 1)
+    queue.add(c, '/photos/4.jpg', 'MODIFY', False)
+    queue.add(c, '/photos/5.jpg', 'MOVED_FROM', False, 2)
+    assert(wait_flush() == [[(c, '/photos/4.jpg', 'RENAME', False, '/photos/3.jpg')]])
+    assert(wait_flush() == [[(c, '/photos/5.jpg', 'MOVED_FROM', False, None)]])
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##a file renamed twice is renamed from its original path, a renamed file that is deleted removes the original
+    queue.add(c, '/photos/6.jpg', 'MOVED_FROM', False, 3)
+    queue.add(c, '/photos/7.jpg', 'MOVED_TO', False, 3)
+    queue.add(c, '/photos/7.jpg', 'MOVED_FROM', False, 4)
+    queue.add(c, '/photos/8.jpg', 'MOVED_TO', False, 4)
+    queue.add(c, '/photos/9.jpg', 'MOVED_FROM', False, 5)
+    queue.add(c, '/photos/10.jpg', 'MOVED_TO', False, 5)
+    queue.add(c, '/photos/10.jpg', 'DELETE', False)
+    result = wait_flush()
+    assert(result == [[(c, '/photos/8.jpg', 'RENAME', False, '/photos/6.jpg'),
+                       (c, '/photos/9.jpg', 'DELETE', False, None),
+                       (c, '/photos/10.jpg', 'DELETE', False, None)]])
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##pending events for the files in a renamed directory are moved to the new location, after the rename
+    queue.add(c, os.path.join(d, 'a.jpg'), 'MODIFY', False)
+    queue.add(c, '/photos/other.jpg', 'MODIFY', False)
+    queue.add(c, d, 'MOVED_FROM', True, 6)
+    queue.add(c, d2, 'MOVED_TO', True, 6)
+    assert(wait_flush() == [[(c, '/photos/other.jpg', 'MODIFY', False, None),
+                             (c, d2, 'RENAME', True, d),
+                             (c, os.path.join(d2, 'a.jpg'), 'MODIFY', False, None)]])
+    print 'Test 4 passed'
+
+    print 'Test 5'
+    ##events are flushed in batches of at most BATCH_SIZE, and at once when a batch is full
+    eventqueue.BATCH_SIZE = 10
+    for i in range(25):
+        queue.add(c, '/photos/%i.jpg' % i, 'CREATE', False)
+    result = wait_flush()
+    assert([len(batch) for batch in result] == [10, 10])
+    result = wait_flush()
+    assert([len(batch) for batch in result] == [5])
+    print 'Test 5 passed'
+
+    print 'Test 6'
+    ##events that keep arriving are flushed after MAX_DELAY
+    start = time.time()
+    for i in range(20):
+        queue.add(c, '/photos/busy.jpg', 'MODIFY', False)
+        time.sleep(0.04)
+        if flushed.is_set():
+            break
+    assert(wait_flush() == [[(c, '/photos/busy.jpg', 'MODIFY', False, None)]])
+    assert(eventqueue.MAX_DELAY <= time.time()-start < 1.5)
+    print 'Test 6 passed'
+
+    print 'Test 7'
+    ##stopping the queue discards the pending events
+    queue.add(c, '/photos/1.jpg', 'MODIFY', False)
+    queue.stop()
+    time.sleep(0.2)
+    assert(not flushed.is_set() and not batches)
+    print 'Test 7 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,99 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects
+    from picty.viewsupport import GeoIndex
+    import random
+
+    class Item:
+        def __init__(self, lat, lon):
+            self.meta = {'LatLon': (lat, lon)}
+
+    def coords(item):
+        return item.meta['LatLon']
+
+    def in_region(item, lat0, lon0, lat1, lon1):
+        lat, lon = coords(item)
+        return lat1 <= lat <= lat0 and lon0 <= lon <= lon1
+
+    def random_region():
+        lat1, lat0 = sorted([random.uniform(-70, 70) for i in range(2)])
+        lon0, lon1 = sorted([random.uniform(-110, 110) for i in range(2)])
+        return (lat0, lon0, lat1, lon1)
+
+    random.seed(1)
+    items = [Item(random.uniform(-60, 60), random.uniform(-100, 100)) for i in range(2000)]
+    items.append(Item(10.0, 20.0))
+    collection = items+[Item(None, None), Item(95.0, 0.0)]
+    index = GeoIndex(lambda: collection)
+
+    def check(region):
+        expected = set(item for item in items if in_region(item, *region))
+        assert(set(index.query(*region)) == expected)
+        for level in (0, 3, index.level_for_region(*region), index.MAX_LEVEL):
+            clusters = index.clusters(level, *region)
+            assert(sum(count for count, lat, lon, item in clusters) == len(expected))
+            for count, lat, lon, item in clusters:
+                assert(item in expected)
+                assert(region[2]-1e-9 <= lat <= region[0]+1e-9 and region[1]-1e-9 <= lon <= region[3]+1e-9)
+
+    print 'Test 1'
+    ##queries return the items in the region, items without a valid location aren't indexed
+    check((90.0, -180.0, -90.0, 180.0))
+    assert(len(index) == len(items))
+    assert(len(index.query(90.0, -180.0, -90.0, 180.0, limit=10)) == 10)
+    assert(index.query(10.0, 20.0, 10.0, 20.0) == [items[-1]])
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##the clusters overlapping a region only count (and are represented by) the items in the region
+    for i in range(200):
+        check(random_region())
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##the index and the clusters of each level are kept up to date as items are added, moved and removed
+    for i in range(300):
+        action = random.randint(0, 2)
+        if action == 0:
+            item = Item(random.uniform(-60, 60), random.uniform(-100, 100))
+            items.append(item)
+            collection.append(item)
+            index.add(item)
+        elif action == 1:
+            item = random.choice(items)
+            item.meta = {'LatLon': (random.uniform(-60, 60), random.uniform(-100, 100))}
+            index.update(item)
+        else:
+            item = random.choice(items)
+            items.remove(item)
+            collection.remove(item)
+            index.remove(item)
+        if i % 10 == 0:
+            check(random_region())
+    check((90.0, -180.0, -90.0, 180.0))
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##the level chosen for a region gives about `columns` clusters across its width
+    assert(index.level_for_region(90.0, -180.0, -90.0, 180.0, columns=8) == 3)
+    assert(index.level_for_region(1.0, 0.0, 0.0, 0.0) == index.MAX_LEVEL)
+    print 'Test 4 passed'
+
+    print 'Test 5'
+    ##the levels above GRID_LEVEL split the items in a grid cell into smaller clusters
+    city = [Item(48.85+random.uniform(0, 0.02), 2.35+random.uniform(0, 0.02)) for i in range(1000)]
+    items += city
+    collection += city
+    for item in city:
+        index.add(item)
+    region = (48.871, 2.349, 48.849, 2.371)
+    level = index.level_for_region(*region)
+    assert(index.GRID_LEVEL < level < index.MAX_LEVEL)
+    clusters = index.clusters(level, *region)
+    assert(len(clusters) > 1 and max(count for count, lat, lon, item in clusters) < len(city))
+    check(region)
+    print 'Test 5 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,102 @@
+
+if __name__ == '__main__':
+    import sys, os, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty.collectiontypes import itemstore
+    from picty.collectiontypes.itemstore import ItemStore
+    import shutil
+    import tempfile
+
+    class Item:
+        def __init__(self, uid, title=''):
+            self.uid = uid
+            self.title = title
+        def __cmp__(self, other):
+            return cmp(self.uid, other.uid)
+
+    def contents(items):
+        return [(item.uid, item.title) for item in items]
+
+    coll_dir = tempfile.mkdtemp()
+    try:
+        print 'Test 1'
+        store = ItemStore(coll_dir)
+        assert(not store.exists())
+        store.create([Item('a', 'A'), Item('b', 'B')])
+        assert(store.exists())
+        store = ItemStore(coll_dir)
+        assert(contents(store.load()) == [('a', 'A'), ('b', 'B')])
+        assert(store.stamp() == (1, 0))
+        print 'Test 1 passed'
+
+        print 'Test 2'
+        store.mark_dirty(Item('a', 'A2'))
+        store.mark_dirty(Item('c', 'C'))
+        store.mark_deleted(Item('b'))
+        assert(store.has_changes())
+        assert(store.flush())
+        assert(not store.has_changes())
+        assert(store.log_records == 3)
+        store = ItemStore(coll_dir)
+        assert(contents(store.load()) == [('a', 'A2'), ('c', 'C')])
+        assert(store.stamp() == (1, 3))
+        print 'Test 2 passed'
+
+        print 'Test 3'
+        ##a record that was only partly written (e.g. after a crash) is discarded and cut off the log
+        size = os.path.getsize(store.log_file())
+        store.mark_dirty(Item('d', 'D'))
+        store.flush()
+        f = open(store.log_file(), 'r+b')
+        f.truncate(os.path.getsize(store.log_file()) - 3)
+        f.close()
+        store = ItemStore(coll_dir)
+        assert(contents(store.load()) == [('a', 'A2'), ('c', 'C')])
+        assert(store.log_records == 3)
+        assert(os.path.getsize(store.log_file()) == size)
+        print 'Test 3 passed'
+
+        print 'Test 4'
+        ##compacting in steps writes a new snapshot and starts a new log, changes made meanwhile are kept
+        items = store.load()
+        calls = []
+        def continue_cb():
+            calls.append(1)
+            return len(calls) > 1
+        itemstore.CHUNK_SIZE = 1
+        assert(not store.compact(items, continue_cb))
+        assert(store.is_compacting())
+        store.mark_dirty(Item('e', 'E'))
+        assert(not store.flush())
+        assert(store.compact(items, continue_cb))
+        assert(not store.is_compacting())
+        assert(store.stamp() == (2, 0))
+        assert(store.flush())
+        store = ItemStore(coll_dir)
+        assert(contents(store.load()) == [('a', 'A2'), ('c', 'C'), ('e', 'E')])
+        assert(store.stamp() == (2, 1))
+        print 'Test 4 passed'
+
+        print 'Test 5'
+        ##a log left over from an older snapshot is never replayed
+        shutil.copyfile(store.log_file(), store.log_file() + '.old')
+        store.compact(store.load())
+        shutil.copyfile(store.log_file() + '.old', store.log_file())
+        store = ItemStore(coll_dir)
+        assert(contents(store.load()) == [('a', 'A2'), ('c', 'C'), ('e', 'E')])
+        assert(store.stamp() == (3, 0))
+        print 'Test 5 passed'
+
+        print 'Test 6'
+        ##a cancelled compaction leaves the current snapshot in place
+        assert(not store.compact(store.load(), lambda: False))
+        store.cancel_compaction()
+        assert(not os.path.exists(store.snapshot_file() + '.tmp'))
+        store = ItemStore(coll_dir)
+        assert(len(store.load()) == 3)
+        assert(store.stamp() == (3, 0))
+        print 'Test 6 passed'
+
+        print 'All tests passed'
+    finally:
+        shutil.rmtree(coll_dir)
@@ -0,0 +1,96 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import memcache, settings
+    from picty.memcache import LRUCache
+
+    class Pixbuf:
+        def __init__(self, size):
+            self.size = size
+        def get_rowstride(self):
+            return self.size
+        def get_height(self):
+            return 1
+
+    class Item:
+        def __init__(self, size):
+            self.thumb = Pixbuf(size)
+
+    print 'Test 1'
+    ##the least recently used items are evicted once the budget is exceeded
+    cache = LRUCache('test', 'thumb', memcache.pixbuf_size, 300)
+    a, b, c, d = Item(100), Item(100), Item(100), Item(100)
+    for item in (a, b, c):
+        cache.add(item)
+    assert(cache.used == 300 and len(cache) == 3)
+    assert(cache.touch(a))
+    cache.add(d)
+    assert(b.thumb is None)
+    assert(a.thumb is not None and c.thumb is not None and d.thumb is not None)
+    assert(cache.used == 300 and len(cache) == 3)
+    assert(not cache.touch(b))
+    assert(cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1 and cache.stats()['evictions'] == 1)
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##re-adding an item updates its size, discarding it keeps its data, an item without data isn't cached
+    a.thumb = Pixbuf(50)
+    cache.add(a)
+    assert(cache.used == 250)
+    cache.discard(c)
+    assert(c.thumb is not None)
+    assert(cache.used == 150 and len(cache) == 2)
+    b.thumb = None
+    cache.add(b)
+    assert(len(cache) == 2)
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##the most recently added item is kept even if it is larger than the budget
+    big = Item(1000)
+    cache.add(big)
+    assert(len(cache) == 1 and big.thumb is not None)
+    assert(a.thumb is None and d.thumb is None)
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##lowering the budget evicts the least recently used items
+    cache = LRUCache('test', 'thumb', memcache.pixbuf_size, 1000)
+    items = [Item(100) for i in range(5)]
+    for item in items:
+        cache.add(item)
+    cache.set_budget(250)
+    assert(cache.used == 200)
+    assert([item.thumb is not None for item in items] == [False, False, False, True, True])
+    print 'Test 4 passed'
+
+    print 'Test 5'
+    ##the budget is a share of the available memory (including the memory already held by the caches)
+    ##and is checked again when items are added after BUDGET_INTERVAL seconds
+    settings.memcache_max_mb = 0
+    settings.memcache_fraction = 0.5
+    mb = 1024*1024
+    memcache.available_memory = lambda: 400*mb
+    memcache.update_budget()
+    assert(memcache.images.budget == 100*mb)
+    assert(memcache.thumbs.budget == 50*mb)
+    item = Item(20*mb)
+    memcache.thumbs.add(item)
+    memcache.available_memory = lambda: 200*mb
+    memcache.thumbs.add(Item(1))
+    assert(memcache.thumbs.budget == 50*mb)
+    memcache._next_budget_check = 0
+    memcache.thumbs.add(Item(1))
+    assert(memcache.thumbs.budget == int((200*mb+20*mb+1)*0.5*memcache.TIER_SHARES['thumbs']))
+    assert(item.thumb is not None)
+    memcache.available_memory = lambda: 0
+    memcache.update_budget()
+    assert(memcache.thumbs.budget == int(memcache.MIN_BUDGET*memcache.TIER_SHARES['thumbs']))
+    assert(item.thumb is None)
+    settings.memcache_max_mb = 64
+    memcache.update_budget()
+    assert(memcache.images.budget == 32*mb)
+    print 'Test 5 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,83 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects
+    from picty import simple_parser as sp
+    from picty.viewsupport import narrows_query, cacheable_query, TOKENS, literal_converter, converter
+    from picty.collectiontypes import localstorebin
+    from picty import imagemanip
+    import random
+
+    class Item:
+        def __init__(self, uid, meta):
+            self.uid = uid
+            self.meta = meta
+            self.relevance = 0
+            self.selected = False
+
+    print 'Test 1'
+    for old_expr, new_expr in (
+            ('', 'cat'),
+            ('cat', 'cats'),
+            ('cat', 'cat&dog'),
+            ('cat', 'cat & dog'),
+            ('cat&dog', 'cat&dog&bird'),
+            ('"cat dog"', '"cat dog"&bird'),
+            ):
+        assert(narrows_query(old_expr, new_expr))
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    for old_expr, new_expr in (
+            ('cat', 'cat'),
+            ('cat', ''),
+            ('cats', 'cat'),
+            ('cat', 'cat dog'),
+            ('cat', 'cat|dog'),
+            ('cat', 'cat&dog bird'),
+            ('cat', 'cat !dog'),
+            ('!cat', '!cats'),
+            ('"cat', '"cat dog"'),
+            ('tag=cat', 'tag=cats'),
+            ('cat', 'lastview&cat'),
+            ):
+        assert(not narrows_query(old_expr, new_expr))
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##every item that matches a narrowing query also matches the query it narrows
+    words = ['cat', 'cats', 'dog', 'bird']
+    items = [Item('/photos/%i.jpg' % i, {'Title': ' '.join(random.sample(words, random.randint(0, 3)))}) for i in range(100)]
+    def matches(expr):
+        tree = sp.parse_expr(TOKENS[:], expr, literal_converter)
+        fn = sp.compile_tree(bool, tree, converter)
+        return set(sp.filter_items(fn, items))
+    exprs = ['', 'cat', 'cats', 'cat&dog', 'cat&dog&bird', 'cat dog', 'cat&dog bird', 'ca', 'at', 'dog|bird', '!cat']
+    for old_expr in exprs:
+        for new_expr in exprs:
+            if narrows_query(old_expr, new_expr):
+                assert(matches(new_expr) <= matches(old_expr))
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##queries on the state of the items aren't cached, saving an item invalidates the cached results of the others
+    assert(not cacheable_query('selected'))
+    assert(not cacheable_query('cat&thumb'))
+    assert(cacheable_query('cat&changed'))
+    def save_metadata(item, collection, cache=None, sidecar_on_failure=True, written=None):
+        item.mark_meta_saved()
+        item.mtime += 1
+        return True
+    imagemanip.save_metadata = save_metadata
+    collection = localstorebin.Collection({'name': 'test', 'image_dirs': ['/photos']})
+    item = baseobjects.Item('1.jpg')
+    item.mtime = 0
+    item.meta = {'Title': 'cat'}
+    item.set_meta_key('Title', 'dog')
+    count = collection.change_count
+    assert(collection.write_metadata(item))
+    assert(not item.is_meta_changed() and collection.change_count > count)
+    print 'Test 4 passed'
+
+    print 'All tests passed'
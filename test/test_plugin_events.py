@@ -0,0 +1,118 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects
+    from picty import pluginmanager, pluginbase
+    import time
+
+    calls = []
+
+    class BatchPlugin(pluginbase.Plugin):
+        name = 'Batch'
+        def t_collection_items_added(self, collection, items):
+            calls.append(('batch added', list(items)))
+        def t_collection_items_added_to_view(self, collection, view, items):
+            calls.append(('batch added to view', view, list(items)))
+        def t_collection_modify_complete_hint(self, collection):
+            calls.append(('complete',))
+
+    class ItemPlugin(pluginbase.Plugin):
+        name = 'Item'
+        def t_collection_item_added(self, collection, item):
+            calls.append(('item added', item))
+        def t_collection_item_metadata_changed(self, collection, item, old_metadata):
+            calls.append(('item changed', item, old_metadata))
+
+    class OtherPlugin(pluginbase.Plugin):
+        name = 'Other'
+
+    def new_manager():
+        mgr = pluginmanager.PluginManager()
+        for cls in (BatchPlugin, ItemPlugin, OtherPlugin):
+            mgr.plugins[cls.name] = [cls(), cls]
+        return mgr
+
+    def calls_of(prefix):
+        return [c for c in calls if c[0].startswith(prefix)]
+
+    c = 'collection'
+
+    print 'Test 1'
+    ##only plugins implementing the batch or the item interface are called, item interfaces through the adapter
+    mgr = new_manager()
+    subscribers = mgr.get_subscribers('t_collection_items_added')
+    assert(sorted(p.name for p in subscribers) == ['Batch', 'Item'])
+    assert([p.name for p in mgr.get_subscribers('t_collection_items_metadata_changed')] == ['Item'])
+    mgr.callback_collection('t_collection_item_added', c, 'a')
+    assert(calls_of('batch') == [('batch added', ['a'])])
+    assert(calls_of('item') == [('item added', 'a')])
+    del calls[:]
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##item events are buffered while the collection's events are suspended and delivered in order,
+    ##consecutive events of the same kind (and view) as one batch
+    mgr.suspend_collection_events(c)
+    mgr.callback_collection('t_collection_item_added', c, 'a')
+    mgr.callback_collection('t_collection_item_added', c, 'b')
+    mgr.callback_collection('t_collection_item_added_to_view', c, 'view1', 'a')
+    mgr.callback_collection('t_collection_item_added_to_view', c, 'view1', 'b')
+    mgr.callback_collection('t_collection_item_added_to_view', c, 'view2', 'c')
+    mgr.callback_collection('t_collection_item_metadata_changed', c, 'a', {'Title': 'old'})
+    mgr.callback_collection('t_collection_item_added', c, 'd')
+    assert(calls == [])
+    mgr.resume_collection_events(c)
+    assert(calls_of('batch') == [('batch added', ['a', 'b']),
+                                 ('batch added to view', 'view1', ['a', 'b']),
+                                 ('batch added to view', 'view2', ['c']),
+                                 ('batch added', ['d'])])
+    assert(calls_of('item') == [('item added', 'a'), ('item added', 'b'),
+                                ('item changed', 'a', {'Title': 'old'}),
+                                ('item added', 'd')])
+    assert(calls[-1] == ('complete',))
+    del calls[:]
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##buffered events are delivered when another kind of event is sent and when EVENT_BATCH_SIZE events are buffered
+    mgr.suspend_collection_events(c)
+    mgr.callback_collection('t_collection_item_added', c, 'a')
+    mgr.callback_collection('t_collection_items_added', c, ['b', 'c'])
+    assert(calls_of('batch') == [('batch added', ['a']), ('batch added', ['b', 'c'])])
+    del calls[:]
+    for i in range(pluginmanager.EVENT_BATCH_SIZE):
+        mgr.callback_collection('t_collection_item_added', c, i)
+    assert(calls_of('batch') == [('batch added', range(pluginmanager.EVENT_BATCH_SIZE))])
+    del calls[:]
+    print 'Test 3 passed'
+
+    print 'Test 4'
+    ##buffered events are delivered with the first event sent after EVENT_BATCH_DELAY seconds, never by another thread
+    pluginmanager.EVENT_BATCH_DELAY = 0.1
+    mgr.callback_collection('t_collection_item_added', c, 'a')
+    time.sleep(0.3)
+    assert(calls == [])
+    mgr.callback_collection('t_collection_item_added', c, 'b')
+    assert(calls_of('batch') == [('batch added', ['a', 'b'])])
+    del calls[:]
+    mgr.callback_collection('t_collection_item_added', c, 'c')
+    mgr.flush_collection_events(c)
+    assert(calls_of('batch') == [('batch added', ['c'])])
+    del calls[:]
+    mgr.callback_collection('t_collection_item_added', c, 'd')
+    mgr.resume_collection_events(c)
+    assert(calls_of('batch') == [('batch added', ['d'])])
+    del calls[:]
+    print 'Test 4 passed'
+
+    print 'Test 5'
+    ##handlers registered for an item interface are called for each element of the batch
+    handled = []
+    def handler(collection, view, item):
+        handled.append((collection, view, item))
+    assert(mgr.call_each(handler, c, ('view1',), ['a', 'b']) == False)
+    assert(handled == [(c, 'view1', 'a'), (c, 'view1', 'b')])
+    print 'Test 5 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,94 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import simple_parser as sp
+
+    class Item:
+        def __init__(self, text, selected=False):
+            self.text = text
+            self.selected = selected
+            self.relevance = 0
+
+    def contains_tag(l, r, item):
+        return r.strip() in item.text.split(' ')
+
+    def selected(l, r, item):
+        return item.selected
+
+    def _not(l, r, item):
+        return not r
+
+    def _or(l, r, item):
+        return l or r
+
+    def _and(l, r, item):
+        return l and r
+
+    parsed = []
+    def lower(val):
+        parsed.append(val)
+        return val.lower()
+
+    def keyword_match(test, item):
+        item.relevance = item.text.count(test)
+        return item.relevance > 0
+
+    TOKENS = [
+        (' ', (_or, bool, bool)),
+        ('&', (_and, bool, bool)),
+        ('|', (_or, bool, bool)),
+        ('!', (_not, None, bool)),
+        ('tag=', (contains_tag, None, str)),
+        ('selected', (selected, None, None)),
+        ]
+    converter = {(str, bool): sp.Conversion(lower, keyword_match)}
+
+    items = [Item('cat dog'), Item('cat', True), Item('bird dog dog'), Item(''), Item('Cat Bird', True)]
+    exprs = (
+        'cat',
+        'CAT dog',
+        'cat&!dog',
+        '"bird dog"|cat',
+        'selected&cat',
+        '!selected',
+        'tag=dog tag=cat&selected',
+        'dog & | bird',
+        '',
+        )
+
+    print 'Test 1'
+    ##a compiled tree gives the same result (and side effects) as calling the tree for every item
+    for expr in exprs:
+        tree = sp.parse_expr(TOKENS[:], expr, converter)
+        fn = sp.compile_tree(bool, tree, converter)
+        for item in items:
+            item.relevance = 0
+            expected = sp.call_tree(bool, tree, converter, item)
+            relevance = item.relevance
+            item.relevance = 0
+            assert(fn(item) == expected)
+            assert(item.relevance == relevance)
+        assert(sp.filter_items(fn, items) == [item for item in items if sp.call_tree(bool, tree, converter, item)])
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##the parse step of a conversion is run once per literal when the tree is compiled, not for each item
+    tree = sp.parse_expr(TOKENS[:], 'CAT|Dog', converter)
+    del parsed[:]
+    fn = sp.compile_tree(bool, tree, converter)
+    assert(sorted(parsed) == ['CAT', 'Dog'])
+    assert(sp.filter_items(fn, items) == items[:3])
+    assert(len(parsed) == 2)
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##a conversion without a test is evaluated when the tree is compiled
+    converter = {(str, bool): sp.Conversion(lambda val: val == 'yes')}
+    for expr, result in (('yes', True), ('no', False), ('no|yes', True), ('!yes', False)):
+        tree = sp.parse_expr(TOKENS[:], expr, {})
+        assert(sp.compile_tree(bool, tree, converter)(items[0]) == result)
+        assert(sp.call_tree(bool, tree, converter, items[0]) == result)
+    print 'Test 3 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,72 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects
+    from picty.viewsupport import TextIndex, keyword_filter
+    import random
+
+    class Item:
+        def __init__(self, uid, meta):
+            self.uid = uid
+            self.meta = meta
+            self.relevance = 0
+
+    words = ['cat', 'Cats', 'dog', 'catdog', 'bird', 'a', 'Dog.jpg']
+    def random_meta():
+        return {'Title': ' '.join(random.sample(words, random.randint(0, 3))),
+                'Keywords': random.sample(words, random.randint(0, 2))}
+
+    random.seed(1)
+    items = [Item('/photos/%s%i.jpg' % (random.choice(words), i), random_meta()) for i in range(200)]
+    collection = list(items)
+    index = TextIndex(lambda: collection)
+    tests = ['cat', 'CAT', 'cats', 'dog', 'dog.jpg', 'at', 'bird cat', 'photos', 'x', '', 'a']
+
+    def check():
+        for test in tests:
+            for item in collection:
+                result = keyword_filter(item, test)
+                relevance = item.relevance
+                item.relevance = -1
+                assert(index.keyword_filter(test, item) == result)
+                assert(item.relevance == relevance or not test)
+
+    print 'Test 1'
+    ##searches answered from the index give the same result and relevance as keyword_filter
+    check()
+    assert(index.built)
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##the index (and the cached scores of recent searches) are kept up to date as items change
+    for i in range(100):
+        item = random.choice(collection)
+        action = random.randint(0, 2)
+        if action == 0:
+            old_meta = item.meta
+            item.meta = random_meta()
+            index.update(item, old_meta)
+        elif action == 1:
+            collection.remove(item)
+            index.remove(item)
+        else:
+            item = Item('/photos/new%i %s.jpg' % (i, random.choice(words)), random_meta())
+            collection.append(item)
+            index.add(item)
+        if i % 10 == 0:
+            check()
+    check()
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##items that aren't in the index (e.g. added before it was built) are searched directly
+    item = Item('/photos/other.jpg', {'Title': 'cat'})
+    assert(index.keyword_filter('cat', item))
+    assert(item.relevance == 2)
+    index.reset()
+    assert(not index.built)
+    check()
+    print 'Test 3 passed'
+
+    print 'All tests passed'
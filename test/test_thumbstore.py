@@ -0,0 +1,83 @@
+
+if __name__ == '__main__':
+    import sys, os, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty.collectiontypes.thumbstore import ThumbStore
+    import shutil
+    import tempfile
+
+    def thumb(value, width=4, height=3):
+        return (False, width, height, width*3, chr(value)*(width*3*height))
+
+    coll_dir = tempfile.mkdtemp()
+    try:
+        print 'Test 1'
+        store = ThumbStore(coll_dir)
+        store.open()
+        store.put('a', 10, thumb(1))
+        store.put('b', 20, thumb(2, 8, 6))
+        assert(store.has('a', 10))
+        assert(not store.has('a', 11))
+        assert(store.get('a', 10) == thumb(1))
+        assert(store.get('a', 11) is None)
+        assert(store.get_many([('b', 20), ('c', 1), ('a', 10)]) == [thumb(2, 8, 6), None, thumb(1)])
+        store.close()
+        print 'Test 1 passed'
+
+        print 'Test 2'
+        ##replacing, renaming and removing thumbnails is remembered after the store is reopened
+        store = ThumbStore(coll_dir)
+        store.open()
+        assert(store.get('b', 20) == thumb(2, 8, 6))
+        store.put('a', 11, thumb(3))
+        store.rename('b', 'B')
+        store.put('c', 30, thumb(4))
+        store.remove('c')
+        assert(store.dead_bytes > 0)
+        store.close()
+        store = ThumbStore(coll_dir)
+        store.open()
+        assert(store.get('a', 10) is None)
+        assert(store.get('a', 11) == thumb(3))
+        assert(store.get('b', 20) is None)
+        assert(store.get('B', 20) == thumb(2, 8, 6))
+        assert(store.get('c', 30) is None)
+        print 'Test 2 passed'
+
+        print 'Test 3'
+        ##records written after the index was saved are recovered, a partly written record is discarded
+        store.put('d', 40, thumb(5))
+        size = store.pack_size
+        store.put('e', 50, thumb(6))
+        store.pack.close()
+        store.map.close()
+        f = open(store.pack_file(), 'r+b')
+        f.truncate(os.path.getsize(store.pack_file()) - 2)
+        f.close()
+        store = ThumbStore(coll_dir)
+        store.open()
+        assert(store.get('d', 40) == thumb(5))
+        assert(store.get('e', 50) is None)
+        assert(store.pack_size == size)
+        assert(os.path.getsize(store.pack_file()) == size)
+        print 'Test 3 passed'
+
+        print 'Test 4'
+        ##compacting drops replaced thumbnails and thumbnails of items that are no longer in the collection
+        store.compact(set(['a', 'd']))
+        assert(store.dead_bytes == 0)
+        assert(store.pack_size == os.path.getsize(store.pack_file()))
+        assert(store.get('a', 11) == thumb(3))
+        assert(store.get('d', 40) == thumb(5))
+        assert(store.get('B', 20) is None)
+        store.close()
+        store = ThumbStore(coll_dir)
+        store.open()
+        assert(store.get_many([('a', 11), ('d', 40)]) == [thumb(3), thumb(5)])
+        assert(store.dead_bytes == 0)
+        store.close()
+        print 'Test 4 passed'
+
+        print 'All tests passed'
+    finally:
+        shutil.rmtree(coll_dir)
@@ -0,0 +1,56 @@
+
+if __name__ == '__main__':
+    import sys, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty.uidispatch import UIDispatcher
+
+    calls = []
+    def redraw_view(collection):
+        calls.append(('redraw', collection))
+    def update_status(progress, message):
+        calls.append(('status', progress, message))
+    def show_item(item):
+        calls.append(('show', item))
+    def broken():
+        raise ValueError
+
+    print 'Test 1'
+    ##requests are run when the dispatcher is flushed, requests that aren't coalesced are run once each in order
+    dispatcher = UIDispatcher()
+    dispatcher.add(show_item, 'a')
+    assert(dispatcher.scheduled)
+    dispatcher.add(show_item, 'b')
+    dispatcher.add(show_item, 'a')
+    assert(calls == [])
+    assert(dispatcher.flush() == False)
+    assert(not dispatcher.scheduled)
+    assert(calls == [('show', 'a'), ('show', 'b'), ('show', 'a')])
+    del calls[:]
+    print 'Test 1 passed'
+
+    print 'Test 2'
+    ##a coalesced request replaces the pending request with the same key and is run in its new position
+    dispatcher.add(redraw_view, 'c1')
+    dispatcher.add(update_status, 0.1, 'one')
+    dispatcher.add(redraw_view, 'c2')
+    dispatcher.add(show_item, 'a')
+    dispatcher.add(update_status, 0.2, 'two')
+    dispatcher.add(redraw_view, 'c1')
+    dispatcher.flush()
+    assert(calls == [('redraw', 'c2'), ('show', 'a'), ('status', 0.2, 'two'), ('redraw', 'c1')])
+    assert(dispatcher.requested == 9 and dispatcher.coalesced == 2)
+    del calls[:]
+    print 'Test 2 passed'
+
+    print 'Test 3'
+    ##an error in one request doesn't stop the others, an empty flush does nothing
+    dispatcher.add(broken)
+    dispatcher.add(show_item, 'b')
+    dispatcher.flush()
+    assert(calls == [('show', 'b')])
+    del calls[:]
+    dispatcher.flush()
+    assert(calls == [])
+    print 'Test 3 passed'
+
+    print 'All tests passed'
@@ -0,0 +1,99 @@
+
+if __name__ == '__main__':
+    import sys, os, os.path
+    sys.path.insert(0, os.path.abspath('../modules'))
+    from picty import baseobjects, settings
+    from picty.fstools import walker
+    from picty.collectiontypes import localstorebin
+    import random
+    import shutil
+    import tempfile
+
+    top = tempfile.mkdtemp()
+
+    def touch(path, mtime):
+        f = open(os.path.join(top, path), 'wb')
+        f.close()
+        os.utime(os.path.join(top, path), (mtime, mtime))
+
+    def walk_result(unchanged=None):
+        return sorted([(os.path.relpath(root, top), sorted(dirs), files) for root, dirs, files in walker.walk(top, unchanged)])
+
+    try:
+        os.makedirs(os.path.join(top, 'a', 'b'))
+        os.makedirs(os.path.join(top, 'c'))
+        touch('1.jpg', 100)
+        touch('notes.txt', 100)
+        touch('2.PNG', 200)
+        touch('noext', 100)
+        touch(os.path.join('a', 'x.jpeg'), 300)
+        touch(os.path.join('a', 'b', 'y.mp4'), 400)
+        touch(os.path.join('c', '.hidden.txt'), 100)
+        os.symlink(os.path.join(top, 'a'), os.path.join(top, 'link'))
+        expected = [
+            ('.', ['a', 'c', 'link'], [('1.jpg', 100), ('2.PNG', 200)]),
+            ('a', ['b'], [('x.jpeg', 300)]),
+            ('a/b', [], [('y.mp4', 400)]),
+            ('c', [], []),
+            ]
+
+        print 'Test 1'
+        ##the media files of each directory are listed (symbolic links to directories aren't followed)
+        for threads in (0, 4):
+            settings.stat_threads = threads
+            walker.close_stat_pool()
+            walker._stat_pool_failed = False
+            assert(walk_result() == expected)
+        print 'Test 1 passed'
+
+        print 'Test 2'
+        ##the files of directories whose signature hasn't changed are skipped
+        signatures = {}
+        for root, dirs, files in walker.walk(top):
+            signatures[root] = walker.dir_signature(root)
+        def unchanged(path, signature):
+            return signatures.get(path) == signature
+        assert(walk_result(unchanged) == [(path, dirs, []) for path, dirs, files in expected])
+        touch(os.path.join('a', 'z.jpg'), 500)
+        result = walk_result(unchanged)
+        assert(result[1] == ('a', ['b'], [('x.jpeg', 300), ('z.jpg', 500)]))
+        assert(result[0][2] == [] and result[2][2] == [])
+        assert(walker.dir_signature(os.path.join(top, 'missing')) is None)
+        print 'Test 2 passed'
+
+        print 'Test 3'
+        ##missing_items merges the sorted lists of items in a single pass
+        collection = localstorebin.Collection({})
+        uids = ['%03i.jpg' % i for i in range(200)]
+        collection.items = sorted([baseobjects.Item(uid) for uid in random.sample(uids, 100)])
+        for n in (0, 1, 50, 200):
+            items = sorted([baseobjects.Item(uid) for uid in random.sample(uids, n)])
+            missing = collection.missing_items(items)
+            assert(missing == [item for item in items if collection.find(item) < 0])
+        print 'Test 3 passed'
+
+        print 'Test 4'
+        ##without scandir, only the entries of an unchanged directory that aren't named like media files are stat'd
+        settings.stat_threads = 0
+        walker.close_stat_pool()
+        walker._stat_pool_failed = False
+        for root, dirs, files in walker.walk(top):
+            signatures[root] = walker.dir_signature(root)
+        scandir, stat = walker.scandir, walker._stat
+        statted = []
+        def counting_stat(path):
+            statted.append(os.path.relpath(path, top))
+            return stat(path)
+        walker.scandir, walker._stat = None, counting_stat
+        try:
+            result = walk_result(unchanged)
+        finally:
+            walker.scandir, walker._stat = scandir, stat
+        assert(result == [(path, dirs, []) for path, dirs, files in expected])
+        assert(sorted(statted) == ['a', 'a/b', 'c', 'c/.hidden.txt', 'link', 'noext', 'notes.txt'])
+        print 'Test 4 passed'
+
+        print 'All tests passed'
+    finally:
+        walker.close_stat_pool()
+        shutil.rmtree(top)
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+'''
+
+    metadata-benchmark
+    Copyright (C) 2013  Damien Moore
+
+License:
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Times the conversion of exiv2 metadata to picty keys with the compiled extraction plan
+(metadata2.get_exiv2_meta) against calling every apptag converter, for a set of sample images
+
+usage: metadata-benchmark.py [-n repeats] [--sidecar] image [image ...]
+'''
+
+import os.path
+import sys
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','modules'))
+
+from picty.metadata import metadata2
+
+
+def get_exiv2_meta_all(app_meta,exiv2_meta,apptags_dict):
+    'the conversion without the extraction plan: every converter probes for its keys'
+    for appkey,data in apptags_dict.iteritems():
+        try:
+            val=data[2](exiv2_meta,data[6])
+            if val:
+                app_meta[appkey]=val
+        except:
+            pass
+
+
+def time_conversion(fn,rawmetas,apptags_dict,repeats):
+    results=[]
+    t=time.time()
+    for i in range(repeats):
+        results=[]
+        for rawmeta in rawmetas:
+            meta={}
+            fn(meta,rawmeta,apptags_dict)
+            results.append(meta)
+    return time.time()-t,results
+
+
+if __name__=='__main__':
+    args=sys.argv[1:]
+    repeats=20
+    apptags_dict=metadata2.apptags_dict
+    if '-n' in args:
+        i=args.index('-n')
+        repeats=int(args[i+1])
+        del args[i:i+2]
+    if '--sidecar' in args:
+        args.remove('--sidecar')
+        apptags_dict=metadata2.apptags_dict_sidecar
+    if not args:
+        print __doc__
+        sys.exit(1)
+
+    rawmetas=[]
+    names=[]
+    t=time.time()
+    for fname in args:
+        try:
+            rawmeta=metadata2.Exiv2Metadata(fname)
+            rawmeta.read()
+            rawmetas.append(rawmeta)
+            names.append(fname)
+        except:
+            print 'Skipping',fname,'(metadata could not be read)'
+    print 'Read metadata for %i files in %.3f s'%(len(rawmetas),time.time()-t)
+    if not rawmetas:
+        sys.exit(1)
+
+    t_all,meta_all=time_conversion(get_exiv2_meta_all,rawmetas,apptags_dict,repeats)
+    t_plan,meta_plan=time_conversion(metadata2.get_exiv2_meta,rawmetas,apptags_dict,repeats)
+    n=len(rawmetas)*repeats
+    print 'All converters:  %.3f s (%.1f us per file)'%(t_all,1e6*t_all/n)
+    print 'Extraction plan: %.3f s (%.1f us per file)'%(t_plan,1e6*t_plan/n)
+    if t_plan>0:
+        print 'Speedup: %.2fx'%(t_all/t_plan,)
+    mismatched=[f for f,a,b in zip(names,meta_all,meta_plan) if a!=b]
+    if mismatched:
+        print 'Converted metadata differs for:',', '.join(mismatched)
+        sys.exit(2)
+    print 'Converted metadata matches for all files'